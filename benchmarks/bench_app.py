@@ -0,0 +1,289 @@
+"""
+Benchmarks of app start-up time, memory usage and callback latency, run offline
+against a synthetic salary dataset of configurable size.
+
+    python -m benchmarks.bench_app --rows-per-year 50000 --output results.json
+
+Results are written as JSON, so that they can be compared between commits.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import numpy as np
+
+from pathlib import Path
+
+from benchmarks.synthetic import copy_data_dir, write_synthetic_exports
+
+REPO_DIR = Path(__file__).parent.parent.absolute()
+
+# gunicorn as run by the Procfile, with this interpreter, `python -m gunicorn`
+# needs gunicorn>=20.1
+GUNICORN = [sys.executable, "-c", "from gunicorn.app.wsgiapp import run; run()"]
+
+# run in a fresh interpreter, prints import time (s) and peak RSS (kB) as JSON
+IMPORT_SCRIPT = """
+import json, resource, time
+start = time.perf_counter()
+import cola_colab.app
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    "import_time": elapsed,
+    "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+}))
+"""
+
+
+def build_dataset(data_dir, rows_per_year, years):
+    """
+    Write synthetic exports and build all stores into data_dir.
+    """
+    copy_data_dir(REPO_DIR / "cola_colab" / "data", data_dir)
+    write_synthetic_exports(
+        Path(data_dir) / "mirror", rows_per_year=rows_per_year, years=years
+    )
+    for command in (["salaries", str(Path(data_dir) / "mirror")], ["deficits"]):
+        subprocess.run(
+            [sys.executable, "-W", "ignore", "-m", "cola_colab.ingest", *command],
+            env=benchmark_env(data_dir),
+            cwd=REPO_DIR,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+
+
+def benchmark_env(data_dir):
+    env = dict(os.environ, COLA_DATA_DIR=str(data_dir))
+    env.pop("REDIS_URL", None)
+    return env
+
+
+def bench_import(data_dir, repeat):
+    """
+    Time to import the app, and peak RSS afterwards, in fresh interpreters. This
+    is what every (non-preloaded) gunicorn worker pays at start-up.
+    """
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-W", "ignore", "-c", IMPORT_SCRIPT],
+            env=benchmark_env(data_dir),
+            cwd=REPO_DIR,
+            check=True,
+            stdout=subprocess.PIPE,
+        ).stdout
+        runs.append(json.loads(output.decode().strip().splitlines()[-1]))
+    return {
+        "import_time": summarize([run["import_time"] for run in runs]),
+        "peak_rss_kb": summarize([run["peak_rss_kb"] for run in runs]),
+    }
+
+
+def bench_gunicorn(data_dir, workers, timeout=120):
+    """
+    Start the app under gunicorn as in the Procfile, and report the peak RSS
+    of each worker once it has served a request, and how much of its memory is
+    private to it, i.e. not shared with the (preloading) master process.
+    """
+    port = 8765
+    process = subprocess.Popen(
+        [
+            *GUNICORN,
+            "cola_colab.app:server",
+            "--config",
+            "gunicorn.conf.py",
+            "--workers",
+            str(workers),
+            "--bind",
+            f"127.0.0.1:{port}",
+        ],
+        env=benchmark_env(data_dir),
+        cwd=REPO_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        start = time.perf_counter()
+        while True:
+            try:
+                for _ in range(workers):
+                    urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=5)
+                break
+            except OSError:
+                if time.perf_counter() - start > timeout or process.poll() is not None:
+                    return {"error": "gunicorn did not start"}
+                time.sleep(0.5)
+        boot_time = time.perf_counter() - start
+        worker_pids = [
+            path.parent.name
+            for path in Path("/proc").glob("[0-9]*/status")
+            if proc_status(path.parent.name, "PPid") == process.pid
+        ]
+        return {
+            "workers": workers,
+            "boot_time": boot_time,
+            "master_peak_rss_kb": proc_status(process.pid, "VmHWM"),
+            "worker_peak_rss_kb": [proc_status(pid, "VmHWM") for pid in worker_pids],
+            "worker_private_kb": [proc_private_memory(pid) for pid in worker_pids],
+        }
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def proc_status(pid, field):
+    """
+    Read a numeric field, e.g. VmHWM (peak RSS in kB), from /proc/<pid>/status.
+    """
+    try:
+        lines = Path(f"/proc/{pid}/status").read_text().splitlines()
+    except OSError:
+        return None
+    for line in lines:
+        if line.startswith(f"{field}:"):
+            return int(line.split()[1])
+
+
+def proc_private_memory(pid):
+    """
+    Memory private to a process in kB, i.e. not shared with any other process,
+    from /proc/<pid>/smaps_rollup.
+    """
+    try:
+        lines = Path(f"/proc/{pid}/smaps_rollup").read_text().splitlines()
+    except OSError:
+        return None
+    return sum(
+        int(line.split()[1])
+        for line in lines
+        if line.startswith(("Private_Clean:", "Private_Dirty:"))
+    )
+
+
+def bench_callbacks(data_dir, repeat):
+    """
+    Latency and payload size of each callback across a grid of inputs, both
+    uncached and from the figure cache.
+    """
+    os.environ.update(benchmark_env(data_dir))
+    from cola_colab import app
+    from plotly.utils import PlotlyJSONEncoder
+
+    job_title_sets = [
+        app.data.MOST_COMMON_JOBS[:1],
+        app.data.MOST_COMMON_JOBS[:3],
+        app.data.MOST_COMMON_JOBS[:5],
+    ]
+    grids = {
+        "update_summary_graph": list(
+            itertools.product(
+                app.CAMPUSES[:1],
+                job_title_sets,
+                app.PAY_TYPES,
+                [["all"], ["2018"], ["2016", "2017", "2018"]],
+            )
+        ),
+        "update_hud_graph": list(
+            itertools.product(app.CAMPUSES, ["Total"], app.THRESHOLDS[::4].tolist())
+        ),
+        "update_deficit_graph": list(
+            itertools.product(app.CAMPUSES, app.THRESHOLDS[::4].tolist())
+        ),
+        "update_context_graph": list(
+            itertools.product(app.CAMPUSES, app.THRESHOLDS[::4].tolist())
+        ),
+    }
+
+    results = {}
+    for name, grid in grids.items():
+        callback = getattr(app, name)
+        uncached, cached, payload, compressed_payload = [], [], [], []
+        for args in grid:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                figure = callback.uncached(*args)
+                uncached.append(time.perf_counter() - start)
+            payload.append(len(json.dumps(figure, cls=PlotlyJSONEncoder)))
+            compressed_payload.append(len(app.figure_cache.dumps(figure)))
+            callback(*args)
+            for _ in range(repeat):
+                start = time.perf_counter()
+                callback(*args)
+                cached.append(time.perf_counter() - start)
+        results[name] = {
+            "inputs": len(grid),
+            "uncached": summarize(uncached),
+            "cached": summarize(cached),
+            "payload_bytes": summarize(payload),
+            "compressed_payload_bytes": summarize(compressed_payload),
+        }
+    return results
+
+
+def summarize(values):
+    values = np.asarray(values, dtype=float)
+    return {
+        "min": values.min(),
+        "median": np.median(values),
+        "p95": np.percentile(values, 95),
+        "max": values.max(),
+    }
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_app")
+    parser.add_argument("--rows-per-year", default=50_000, type=int)
+    parser.add_argument("--first-year", default=2011, type=int)
+    parser.add_argument("--last-year", default=2018, type=int)
+    parser.add_argument("--repeat", default=5, type=int)
+    parser.add_argument(
+        "--gunicorn-workers",
+        default=0,
+        type=int,
+        help="if given, also measure memory of gunicorn workers",
+    )
+    parser.add_argument("--output", type=Path, help="JSON file to write results to")
+    args = parser.parse_args(args)
+
+    years = range(args.first_year, args.last_year + 1)
+    with tempfile.TemporaryDirectory() as data_dir:
+        start = time.perf_counter()
+        build_dataset(data_dir, args.rows_per_year, years)
+        results = {
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "commit": subprocess.run(
+                    ["git", "rev-parse", "HEAD"],
+                    cwd=REPO_DIR,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL,
+                )
+                .stdout.decode()
+                .strip(),
+            },
+            "dataset": {"rows_per_year": args.rows_per_year, "years": list(years)},
+            "ingest_time": time.perf_counter() - start,
+            "import": bench_import(data_dir, args.repeat),
+        }
+        if args.gunicorn_workers:
+            results["gunicorn"] = bench_gunicorn(data_dir, args.gunicorn_workers)
+        results["callbacks"] = bench_callbacks(data_dir, args.repeat)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
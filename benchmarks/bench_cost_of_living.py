@@ -0,0 +1,94 @@
+"""
+Benchmark of the vectorized cost-of-living calculation against the original
+row-wise implementation, for the table behind the deficit graph.
+
+    python -m benchmarks.bench_cost_of_living
+"""
+
+import timeit
+
+import numpy as np
+
+from cola_colab.cola import THRESHOLDS, get_cost_of_living
+from cola_colab.data import CAMPUSES, HUD, NET_STIPEND
+
+
+def get_cost_of_living_rowwise(percentage, campus, academic_year):
+    """
+    Original implementation, one scalar HUD lookup per unit type and year.
+    """
+
+    def get_average_cost(bedroom_name, num_bedrooms):
+        return 0.5 * (
+            (
+                HUD.loc[(campus, bedroom_name), f"{academic_year} FMR"]
+                / num_bedrooms
+                / (percentage / 100)
+            )
+            + (
+                HUD.loc[(campus, bedroom_name), f"{academic_year+1} FMR"]
+                / num_bedrooms
+                / (percentage / 100)
+            )
+        )
+
+    return (1 / 5) * (
+        get_average_cost("Efficiency", 1)
+        + get_average_cost("1 br", 1)
+        + get_average_cost("2 br", 2)
+        + get_average_cost("3 br", 3)
+        + get_average_cost("4 br", 4)
+    )
+
+
+def rowwise(stipend_df, percentages):
+    return [
+        stipend_df.apply(
+            lambda row: get_cost_of_living_rowwise(
+                percentage, row["Campus"], row["Year"]
+            ),
+            axis=1,
+        ).values
+        for percentage in percentages
+    ]
+
+
+def vectorized(stipend_df, percentages):
+    return get_cost_of_living(
+        np.asarray(percentages)[:, None],
+        stipend_df["Campus"].values,
+        stipend_df["Year"].values,
+    )
+
+
+def main():
+    # PhD stipends, with a row per campus, discipline and year
+    stipend_df = NET_STIPEND.loc["PhD"].reset_index()
+    campus_df = stipend_df[stipend_df["Campus"] == CAMPUSES[0]]
+
+    cases = {
+        "one campus, one threshold": (campus_df, [30]),
+        "one campus, all thresholds": (campus_df, THRESHOLDS),
+        "all campuses, all thresholds": (stipend_df, THRESHOLDS),
+    }
+
+    for name, (case_df, percentages) in cases.items():
+        np.testing.assert_allclose(
+            vectorized(case_df, percentages), rowwise(case_df, percentages)
+        )
+
+        # the row-wise version is slow enough that a single run is representative
+        t_rowwise = timeit.timeit(lambda: rowwise(case_df, percentages), number=1)
+        t_vectorized = (
+            timeit.timeit(lambda: vectorized(case_df, percentages), number=100) / 100
+        )
+        print(
+            f"{name} ({len(case_df) * len(percentages)} values): "
+            f"row-wise {1e3 * t_rowwise:.2f} ms, "
+            f"vectorized {1e3 * t_vectorized:.3f} ms, "
+            f"{t_rowwise / t_vectorized:.0f}x speedup"
+        )
+
+
+if __name__ == "__main__":
+    main()
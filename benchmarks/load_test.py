@@ -0,0 +1,714 @@
+"""
+Load test of the Dash callback endpoints, replaying realistic sequences of
+`/_dash-update-component` requests from a number of concurrent users against the
+app under gunicorn, as in the Procfile, run offline against a synthetic dataset.
+
+    python -m benchmarks.load_test --users 1 8 32 --duration 30 --output load.json
+
+Each cache variant starts its own gunicorn:
+
+    memory      in-process figure cache only, per worker
+    filesystem  in-process cache in front of a cache directory (CACHE_DIR)
+    redis       in-process cache in front of Redis (REDIS_URL), a local
+                redis-server if installed, otherwise a minimal stand-in
+
+and is run at each number of users in turn, keeping its cache. Reported per run
+are the throughput, latency percentiles (overall and by callback), figure cache
+hit rates and event loop lag from each worker's `/metrics`, and the memory of
+every process.
+
+Requests are made as the browser would: callbacks are found from the app's
+`/_dash-dependencies`, initial values and options from `/_dash-layout`, and a
+callback is only requested when its inputs change, see
+`cola_colab.app.gated_callback`.
+"""
+
+import argparse
+import gzip
+import http.client
+import json
+import random
+import re
+import shutil
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+import numpy as np
+
+from pathlib import Path
+
+from benchmarks.bench_app import (
+    GUNICORN,
+    REPO_DIR,
+    benchmark_env,
+    build_dataset,
+    proc_private_memory,
+    proc_status,
+    summarize,
+)
+
+VARIANTS = ("memory", "filesystem", "redis")
+
+# seconds between the actions of a user, on average, as in a browser session
+THINK_TIME = 1.0
+
+# callback ids of the "<name>_inputs" stores, see gated_callback
+INPUTS_STORE = re.compile(r"^(?P<name>.+)_inputs\.data$")
+
+# value of an action picking one of the current options of a dropdown
+PICK = object()
+
+# seconds after which a request counts as failed
+REQUEST_TIMEOUT = 60
+
+# event loop lag counted as a stall, in seconds, one of the histogram buckets of
+# cola_colab.metrics
+STALL_SECONDS = 0.05
+
+
+class RedisStandIn(socketserver.ThreadingTCPServer):
+    """
+    Minimal in-memory server speaking enough of the Redis protocol for the
+    flask-caching Redis backend, for machines without redis-server. Expiry is
+    ignored.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port):
+        self.data = {}
+        self.lock = threading.Lock()
+        super().__init__(("127.0.0.1", port), RedisHandler)
+
+
+class RedisHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            # commands are arrays of bulk strings, e.g. *2\r\n$3\r\nGET\r\n$1\r\nk\r\n
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2])
+            self.wfile.write(self.reply(args[0].upper().decode(), args[1:]))
+
+    def reply(self, command, args):
+        data, lock = self.server.data, self.server.lock
+        with lock:
+            if command == "GET":
+                value = data.get(args[0])
+                if value is None:
+                    return b"$-1\r\n"
+                return b"$%d\r\n%s\r\n" % (len(value), value)
+            if command == "SET":
+                data[args[0]] = args[1]
+                return b"+OK\r\n"
+            if command == "SETEX":
+                data[args[0]] = args[2]
+                return b"+OK\r\n"
+            if command in ("DEL", "UNLINK"):
+                return b":%d\r\n" % sum(data.pop(key, None) is not None for key in args)
+            if command == "FLUSHDB":
+                data.clear()
+                return b"+OK\r\n"
+            if command in ("PING", "SELECT", "CLIENT"):
+                return b"+OK\r\n" if command != "PING" else b"+PONG\r\n"
+            if command == "EXPIRE":
+                return b":1\r\n"
+        return b"-ERR unknown command '%s'\r\n" % command.encode()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_redis(port):
+    """
+    Start redis-server, if installed, or else a RedisStandIn, on port.
+
+    Returns:
+        (tuple) description of the server, and a function stopping it
+    """
+    if shutil.which("redis-server"):
+        process = subprocess.Popen(
+            ["redis-server", "--port", str(port), "--save", "", "--appendonly", "no"],
+            stdout=subprocess.DEVNULL,
+        )
+        time.sleep(0.5)
+        return "redis-server", lambda: (process.terminate(), process.wait())
+    server = RedisStandIn(port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return "stand-in", lambda: (server.shutdown(), server.server_close())
+
+
+def start_gunicorn(env, workers, port, timeout=120):
+    """
+    Start the app under gunicorn as in the Procfile, and wait for it to serve.
+    """
+    process = subprocess.Popen(
+        [
+            *GUNICORN,
+            "cola_colab.app:server",
+            "--config",
+            "gunicorn.conf.py",
+            "--workers",
+            str(workers),
+            "--bind",
+            f"127.0.0.1:{port}",
+        ],
+        env=env,
+        cwd=REPO_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    start = time.perf_counter()
+    while True:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=5)
+            return process
+        except OSError:
+            if time.perf_counter() - start > timeout or process.poll() is not None:
+                process.terminate()
+                raise RuntimeError("gunicorn did not start")
+            time.sleep(0.5)
+
+
+class App:
+    """
+    The callbacks and initial state of the app, as seen by the browser.
+    """
+
+    def __init__(self, port):
+        self.port = port
+        dependencies = self.get_json("/_dash-dependencies")
+        layout = self.get_json("/_dash-layout")
+
+        self.props = {}
+        walk_layout(layout, self.props)
+
+        # inputs of each gated callback, from its clientside callback, and its
+        # server callback, by name
+        self.inputs = {}
+        self.callbacks = {}
+        for dependency in dependencies:
+            inputs_match = INPUTS_STORE.match(dependency["output"])
+            server_inputs = [f"{i['id']}.{i['property']}" for i in dependency["inputs"]]
+            if inputs_match and "clientside_function" in dependency:
+                self.inputs[inputs_match.group("name")] = server_inputs
+            elif len(server_inputs) == 1 and INPUTS_STORE.match(server_inputs[0]):
+                name = INPUTS_STORE.match(server_inputs[0]).group("name")
+                self.callbacks[name] = dependency
+
+        # the initial view, from the inputs of the pre-rendered outputs
+        self.view = {}
+        self.initial_inputs = {}
+        for name, inputs in self.inputs.items():
+            values = self.props[f"{name}_inputs.data"]
+            self.initial_inputs[name] = values
+            self.view.update(zip(inputs, values))
+
+    def get_json(self, path):
+        url = f"http://127.0.0.1:{self.port}{path}"
+        with urllib.request.urlopen(url, timeout=30) as response:
+            return json.loads(response.read())
+
+    def options(self, component):
+        """
+        Values of the options of a dropdown, or the steps of a slider.
+        """
+        props = self.props[component]
+        if "options" in props:
+            return [option["value"] for option in props["options"]]
+        step = props.get("step") or 1
+        return list(np.arange(props["min"], props["max"] + step, step).tolist())
+
+    def request_body(self, name, values, view):
+        dependency = self.callbacks[name]
+        output = dependency["output"]
+        if output.startswith(".."):
+            outputs = [
+                dict(zip(("id", "property"), part.split(".")))
+                for part in output.strip(".").split("...")
+            ]
+        else:
+            outputs = dict(zip(("id", "property"), output.split(".")))
+        return {
+            "output": output,
+            "outputs": outputs,
+            "inputs": [{"id": f"{name}_inputs", "property": "data", "value": values}],
+            "changedPropIds": [f"{name}_inputs.data"],
+            "state": [
+                {**state, "value": view.get(f"{state['id']}.{state['property']}")}
+                for state in dependency.get("state", [])
+            ],
+        }
+
+
+def walk_layout(component, props):
+    """
+    Collect the props of every component with an id, by "<id>.<prop>" and by id.
+    """
+    if isinstance(component, list):
+        for child in component:
+            walk_layout(child, props)
+        return
+    if not isinstance(component, dict):
+        return
+    component_props = component.get("props", {})
+    if "id" in component_props:
+        props[component_props["id"]] = component_props
+        for prop, value in component_props.items():
+            props[f"{component_props['id']}.{prop}"] = value
+    walk_layout(component_props.get("children"), props)
+
+
+def campus_switches(app, rng):
+    """
+    Look through the campuses, one at a time.
+    """
+    campuses = app.options("campus")
+    return [{"campus.value": campus} for campus in rng.sample(campuses, 4)]
+
+
+def slider_drag(app, rng):
+    """
+    Drag the rent burden threshold, every step on the way is a request.
+    """
+    steps = app.options("cost_of_living")
+    start, end = sorted(rng.sample(range(len(steps)), 2))
+    path = steps[start : end + 1]
+    if rng.random() < 0.5:
+        path = path[::-1]
+    return [{"cost_of_living.value": value} for value in path]
+
+
+def job_title_selection(app, rng):
+    """
+    Add job titles to the salary graph one at a time, then change pay type and
+    years.
+    """
+    job_titles = rng.sample(app.options("job_titles"), 3)
+    years = [year for year in app.options("years") if year != "all"]
+    return [
+        *[{"job_titles.value": job_titles[: i + 1]} for i in range(len(job_titles))],
+        {"pay_type.value": rng.choice(app.options("pay_type"))},
+        {"years.value": ["all"]},
+        {"years.value": sorted(rng.sample(years, 2))},
+    ]
+
+
+def degree_switch(app, rng):
+    """
+    Switch degree, and pick one of its disciplines.
+    """
+    return [
+        {"degree.value": rng.choice(app.options("degree"))},
+        {"discipline.value": PICK},
+    ]
+
+
+SEQUENCES = {
+    "campus_switches": campus_switches,
+    "slider_drag": slider_drag,
+    "job_title_selection": job_title_selection,
+    "degree_switch": degree_switch,
+}
+
+
+class User(threading.Thread):
+    """
+    Replays random sequences, with think time between sequences, until the end
+    time, recording (sequence, callback, latency, status, bytes) per request.
+    """
+
+    def __init__(self, app, sequences, end_time, think_time, seed):
+        super().__init__(daemon=True)
+        self.app = app
+        self.sequences = sequences
+        self.end_time = end_time
+        self.think_time = think_time
+        self.rng = random.Random(seed)
+        self.records = []
+        self.view = dict(app.view)
+        self.sent = dict(app.initial_inputs)
+
+    def run(self):
+        while time.time() < self.end_time:
+            sequence = self.rng.choice(self.sequences)
+            for action in SEQUENCES[sequence](self.app, self.rng):
+                if time.time() >= self.end_time:
+                    break
+                self.view.update(
+                    {
+                        key: self.pick(key) if value is PICK else value
+                        for key, value in action.items()
+                    }
+                )
+                self.update(sequence)
+                # slider drags are quick, other actions take longer
+                pause = 0.05 if sequence == "slider_drag" else self.think_time / 4
+                time.sleep(self.rng.uniform(0, 2 * pause))
+            time.sleep(self.rng.uniform(0, 2 * self.think_time))
+
+    def pick(self, key):
+        # options may have been updated by a callback
+        component = key.split(".")[0]
+        options = self.view.get(f"{component}.options")
+        if options is None:
+            options = self.app.props[f"{component}.options"]
+        return self.rng.choice(options)["value"]
+
+    def update(self, sequence):
+        # requests every callback whose inputs changed, applying the outputs to
+        # the view, until nothing changes, as the Dash renderer does
+        for _ in range(3):
+            changed = False
+            for name, inputs in self.app.inputs.items():
+                values = [self.view.get(i) for i in inputs]
+                if values == self.sent.get(name) or name not in self.app.callbacks:
+                    continue
+                self.sent[name] = values
+                changed |= self.request(sequence, name, values)
+            if not changed:
+                return
+
+    def request(self, sequence, name, values):
+        body = json.dumps(self.app.request_body(name, values, self.view))
+        start = time.perf_counter()
+        # a connection per request, as gunicorn closes idle connections after its
+        # keepalive (2 s), and a request on a closing connection would fail
+        connection = http.client.HTTPConnection(
+            "127.0.0.1", self.app.port, timeout=REQUEST_TIMEOUT
+        )
+        try:
+            connection.request(
+                "POST",
+                "/_dash-update-component",
+                body,
+                {"Content-Type": "application/json", "Accept-Encoding": "gzip"},
+            )
+            response = connection.getresponse()
+            content = response.read()
+            status = response.status
+            encoding = response.getheader("Content-Encoding")
+        except (OSError, http.client.HTTPException):
+            content, status = b"", 0
+        finally:
+            connection.close()
+        latency = time.perf_counter() - start
+        # response sizes are as sent, i.e. compressed
+        self.records.append((sequence, name, latency, status, len(content)))
+        if status != 200:
+            return False
+        if encoding == "gzip":
+            content = gzip.decompress(content)
+        return self.apply(name, json.loads(content))
+
+    def apply(self, name, content):
+        response = content.get("response", {})
+        if not content.get("multi"):
+            output = self.app.callbacks[name]["output"]
+            response = {output.split(".")[0]: response.get("props", {})}
+        changed = False
+        for component, props in response.items():
+            for prop, value in props.items():
+                key = f"{component}.{prop}"
+                if key in self.view and self.view[key] != value:
+                    self.view[key] = value
+                    changed = True
+                elif key not in self.view and prop == "options":
+                    self.view[key] = value
+        return changed
+
+
+def scrape_metrics(port, worker_pids, attempts=50):
+    """
+    Figure cache counters, and event loop lag, of each worker from `/metrics`,
+    which is served by whichever worker takes the connection.
+
+    Returns:
+        (dict) {result: count} by worker pid, with the number of event loop
+            monitor wake-ups, their total lag, the number of them within
+            STALL_SECONDS, and the longest lag as "loop_wakeups",
+            "loop_lag_seconds", "loop_on_time" and "loop_max_lag_seconds"
+    """
+    counters = {}
+    for _ in range(attempts):
+        with urllib.request.urlopen(
+            f"http://127.0.0.1:{port}/metrics", timeout=10
+        ) as response:
+            text = response.read().decode()
+        pid = int(re.search(r"^cola_worker_pid (\d+)", text, re.M).group(1))
+        counters[pid] = {
+            result: float(count)
+            for result, count in re.findall(
+                r'^cola_figure_cache_requests_total\{result="(\w+)"\} (\S+)', text, re.M
+            )
+        }
+        for key, metric in (
+            ("loop_wakeups", "cola_event_loop_lag_seconds_count"),
+            ("loop_lag_seconds", "cola_event_loop_lag_seconds_sum"),
+            (
+                "loop_on_time",
+                f'cola_event_loop_lag_seconds_bucket{{le="{STALL_SECONDS}"}}',
+            ),
+            ("loop_max_lag_seconds", "cola_event_loop_lag_max_seconds"),
+        ):
+            match = re.search(rf"^{re.escape(metric)} (\S+)", text, re.M)
+            if match:
+                counters[pid][key] = float(match.group(1))
+        if set(worker_pids) <= set(counters):
+            break
+    return counters
+
+
+def child_pids(pid):
+    return [
+        int(path.parent.name)
+        for path in Path("/proc").glob("[0-9]*/status")
+        if proc_status(path.parent.name, "PPid") == pid
+    ]
+
+
+def memory(master_pid):
+    """
+    Current and peak RSS, and private memory, in kB, of the master, each worker
+    and each figure pool process.
+    """
+
+    def process_memory(pid):
+        return {
+            "rss_kb": proc_status(pid, "VmRSS"),
+            "peak_rss_kb": proc_status(pid, "VmHWM"),
+            "private_kb": proc_private_memory(pid),
+        }
+
+    workers = child_pids(master_pid)
+    return {
+        "master": process_memory(master_pid),
+        "workers": {pid: process_memory(pid) for pid in workers},
+        "figure_pool": {
+            pid: process_memory(pid) for worker in workers for pid in child_pids(worker)
+        },
+    }
+
+
+def hit_rates(before, after):
+    """
+    Figure cache hit rates between two scrapes of every worker.
+    """
+    totals = {}
+    for pid, counters in after.items():
+        for result, count in counters.items():
+            if result.startswith("loop_"):
+                continue
+            previous = before.get(pid, {}).get(result, 0)
+            totals[result] = totals.get(result, 0) + count - previous
+    lookups = totals.get("hits", 0) + totals.get("misses", 0)
+    return {
+        **totals,
+        "hit_rate": totals.get("hits", 0) / lookups if lookups else None,
+        "l1_hit_rate": totals.get("l1_hits", 0) / lookups if lookups else None,
+        "l2_hit_rate": totals.get("l2_hits", 0) / lookups if lookups else None,
+    }
+
+
+def loop_lag(before, after):
+    """
+    Event loop lag of every worker between two scrapes: the total time greenlets
+    were kept waiting, and the number of wake-ups of the monitor later than
+    STALL_SECONDS, see cola_colab.metrics.monitor_event_loop. The longest lag is
+    since the start of each worker.
+    """
+    totals = {"wakeups": 0, "lag_seconds": 0.0, "on_time": 0}
+    for pid, counters in after.items():
+        for key in totals:
+            previous = before.get(pid, {}).get(f"loop_{key}", 0)
+            totals[key] += counters.get(f"loop_{key}", 0) - previous
+    totals["stalls"] = totals["wakeups"] - totals.pop("on_time")
+    totals["max_lag_seconds"] = max(
+        (counters.get("loop_max_lag_seconds", 0) for counters in after.values()),
+        default=0,
+    )
+    return totals
+
+
+def run_load(app, users, duration, think_time, sequences, seed):
+    end_time = time.time() + duration
+    threads = [
+        User(app, sequences, end_time, think_time, seed=seed * 1000 + i)
+        for i in range(users)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    records = [record for thread in threads for record in thread.records]
+    latencies = np.array([record[2] for record in records])
+    ok = np.array([record[3] == 200 for record in records], dtype=bool)
+    result = {
+        "users": users,
+        "requests": len(records),
+        "errors": int((~ok).sum()),
+        "throughput_rps": len(records) / elapsed,
+        "latency": latency_percentiles(latencies),
+        "by_callback": {},
+        "by_sequence": {},
+    }
+    for field, key in (("by_callback", 1), ("by_sequence", 0)):
+        for label in sorted({record[key] for record in records}):
+            selected = np.array([record[key] == label for record in records])
+            result[field][label] = {
+                "requests": int(selected.sum()),
+                "latency": latency_percentiles(latencies[selected]),
+                "response_bytes": summarize(
+                    [record[4] for record in records if record[key] == label]
+                ),
+            }
+    return result
+
+
+def latency_percentiles(latencies):
+    if not len(latencies):
+        return None
+    return {
+        "p50": np.percentile(latencies, 50),
+        "p90": np.percentile(latencies, 90),
+        "p99": np.percentile(latencies, 99),
+        "max": latencies.max(),
+    }
+
+
+def run_variant(variant, data_dir, args):
+    env = benchmark_env(data_dir)
+    env.pop("CACHE_DIR", None)
+    env["FIGURE_WORKERS"] = str(args.figure_workers)
+    port = free_port()
+    stop_redis = None
+    result = {"variant": variant}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        if variant == "filesystem":
+            env["CACHE_DIR"] = cache_dir
+        elif variant == "redis":
+            redis_port = free_port()
+            result["redis"], stop_redis = start_redis(redis_port)
+            env["REDIS_URL"] = f"redis://127.0.0.1:{redis_port}/0"
+        process = start_gunicorn(env, args.workers, port)
+        try:
+            app = App(port)
+            worker_pids = child_pids(process.pid)
+            result["runs"] = []
+            for users in args.users:
+                before = scrape_metrics(port, worker_pids)
+                run = run_load(
+                    app,
+                    users,
+                    args.duration,
+                    args.think_time,
+                    args.sequences,
+                    args.seed,
+                )
+                after = scrape_metrics(port, worker_pids)
+                run["figure_cache"] = hit_rates(before, after)
+                run["event_loop"] = loop_lag(before, after)
+                run["memory"] = memory(process.pid)
+                result["runs"].append(run)
+                print(format_run(variant, run), file=sys.stderr)
+        finally:
+            process.terminate()
+            process.wait()
+            if stop_redis is not None:
+                stop_redis()
+    return result
+
+
+def format_run(variant, run):
+    latency = run["latency"] or {}
+    workers = run["memory"]["workers"].values()
+    hit_rate = run["figure_cache"]["hit_rate"]
+    return (
+        f"{variant:>10} {run['users']:>4} users: {run['throughput_rps']:7.1f} req/s, "
+        f"p50 {latency.get('p50', np.nan) * 1000:6.0f} ms, "
+        f"p99 {latency.get('p99', np.nan) * 1000:6.0f} ms, "
+        f"{run['errors']} errors, "
+        f"hit rate {'-' if hit_rate is None else f'{hit_rate:.0%}'}, "
+        f"{run['event_loop']['stalls']:.0f} loop stalls, "
+        f"loop lag {run['event_loop']['lag_seconds']:.1f} s, "
+        f"worker RSS {max(w['rss_kb'] or 0 for w in workers) / 1024:.0f} MB"
+    )
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.load_test", description=__doc__.splitlines()[1]
+    )
+    parser.add_argument("--variants", nargs="+", choices=VARIANTS, default=VARIANTS)
+    parser.add_argument(
+        "--users",
+        nargs="+",
+        type=int,
+        default=[1, 8, 32],
+        help="numbers of concurrent users, run in turn",
+    )
+    parser.add_argument(
+        "--duration", default=30, type=float, help="seconds per number of users"
+    )
+    parser.add_argument(
+        "--think-time",
+        default=THINK_TIME,
+        type=float,
+        help="average seconds between sequences, 0 for a closed loop",
+    )
+    parser.add_argument(
+        "--sequences", nargs="+", choices=list(SEQUENCES), default=list(SEQUENCES)
+    )
+    parser.add_argument("--workers", default=2, type=int, help="gunicorn workers")
+    parser.add_argument(
+        "--figure-workers",
+        default=1,
+        type=int,
+        help="figure pool processes per worker, 0 for none, see FIGURE_WORKERS",
+    )
+    parser.add_argument("--rows-per-year", default=50_000, type=int)
+    parser.add_argument("--first-year", default=2011, type=int)
+    parser.add_argument("--last-year", default=2018, type=int)
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--output", type=Path, help="JSON file to write results to")
+    args = parser.parse_args(args)
+
+    years = range(args.first_year, args.last_year + 1)
+    with tempfile.TemporaryDirectory() as data_dir:
+        build_dataset(data_dir, args.rows_per_year, years)
+        results = {
+            "settings": {
+                key: value
+                for key, value in vars(args).items()
+                if key not in ("output", "variants")
+            },
+            "variants": [
+                run_variant(variant, data_dir, args) for variant in args.variants
+            ],
+        }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
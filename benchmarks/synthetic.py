@@ -0,0 +1,100 @@
+"""
+Synthetic salary data, in the format of the Transparent California exports, so
+that benchmarks can run offline and at any dataset size.
+"""
+
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from pathlib import Path
+
+# student job titles and their relative frequencies, roughly as in the real data
+JOB_TITLES = {
+    "TEACHG ASST-GSHIP": 0.22,
+    "GSR-FULL GSHIP": 0.18,
+    "READER-GSHIP": 0.08,
+    "TUTOR-GSHIP": 0.05,
+    "STDT 1": 0.12,
+    "STDT 2": 0.12,
+    "STDT 3": 0.08,
+    "STDT 4": 0.05,
+    "TEACHG ASST-NON GSHIP": 0.04,
+    "GSR-TUIT & FEE REM": 0.04,
+    "RES ASST-GSHIP": 0.01,
+    "ASSOC IN __-GSHIP": 0.005,
+    "TEACHG FELLOW-GSHIP": 0.005,
+}
+
+# fraction of rows for named (non-student) employees, which are excluded at ingest
+NAMED_FRACTION = 0.1
+
+
+def write_synthetic_exports(
+    directory, rows_per_year=50_000, years=range(2011, 2019), seed=0
+):
+    """
+    Write one Transparent California style CSV export per year.
+
+    Args:
+        directory (Path): output directory, created if needed
+        rows_per_year (int): number of rows in each export
+        years (iterable): years to write
+        seed (int): random seed
+
+    Returns:
+        (list) paths of the written files
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    titles = np.array(list(JOB_TITLES))
+    weights = np.array(list(JOB_TITLES.values()))
+    # each job title has its own typical pay
+    scales = dict(zip(titles, rng.uniform(2000, 12000, len(titles))))
+
+    paths = []
+    for i, year in enumerate(years):
+        job_titles = rng.choice(titles, rows_per_year, p=weights / weights.sum())
+        scale = np.array([scales[title] for title in job_titles]) * 1.03**i
+        base_pay = rng.gamma(2.0, scale)
+        other_pay = rng.exponential(200, rows_per_year)
+        benefits = rng.exponential(1000, rows_per_year)
+        df = pd.DataFrame(
+            {
+                "Employee Name": np.where(
+                    rng.random(rows_per_year) < NAMED_FRACTION,
+                    "Jane Doe",
+                    "Not provided",
+                ),
+                "Job Title": job_titles,
+                "Base Pay": base_pay.round(2),
+                "Overtime Pay": 0.0,
+                "Other Pay": other_pay.round(2),
+                "Benefits": benefits.round(2),
+                "Total Pay": (base_pay + other_pay).round(2),
+                "Total Pay & Benefits": (base_pay + other_pay + benefits).round(2),
+                "Year": year,
+                "Notes": "",
+                "Agency": "University of California",
+                "Status": "PT",
+            }
+        )
+        path = directory / f"university-of-california-{year}.csv"
+        df.to_csv(path, index=False)
+        paths.append(path)
+
+    return paths
+
+
+def copy_data_dir(source, destination):
+    """
+    Copy the (small) non-salary data files, e.g. HUD and stipend data, to a new
+    data directory, leaving out the raw data and any built stores.
+    """
+    destination = Path(destination)
+    destination.mkdir(parents=True, exist_ok=True)
+    for path in Path(source).glob("*.csv"):
+        shutil.copy(path, destination / path.name)
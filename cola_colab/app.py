@@ -4,25 +4,42 @@ import dash_core_components as dcc
 import plotly.express as px
 import plotly.graph_objects as go
 import flask
+import hashlib
+import inspect
+import numpy as np
 import os
 
+from functools import lru_cache
 from pathlib import Path
 from flask_caching import Cache
 from plotly.subplots import make_subplots
-from dash.dependencies import Input, Output, State
-from dash.exceptions import PreventUpdate
+from dash.dependencies import ClientsideFunction, Input, Output, State
 from monty.serialization import loadfn
 from scout_apm.flask import ScoutApm
 
+from cola_colab.cache import FigureCache, LRUCache, ProcessPool, TieredCache
+from cola_colab import data
+from cola_colab.cola import (
+    THRESHOLDS,
+    campus_indices,
+    get_deficits,
+    get_deflators,
+    get_disciplines,
+    get_net_stipend,
+    unit_mix_key,
+    year_indices,
+)
+from cola_colab.context import get_cola_costs, get_uncosted_headcount
+from cola_colab.metrics import callback_metrics, format_labels, phase
+from cola_colab.stats import UC_WIDE, combine_salary_stats
 from cola_colab.data import (
-    MOST_COMMON_JOBS,
-    UC_WIDE_SALARY_DF,
     PAY_TYPES,
-    HUD,
-    SURVEY,
     CAMPUSES,
-    NET_STIPEND,
-    DISCIPLINES,
+    DEGREES,
+    OCCUPANTS,
+    UNITS,
+    UNIT_WEIGHTS,
+    load,
 )
 
 # note to would-be code critics, this was a quick app intended as
@@ -36,44 +53,132 @@ FONT_AWESOME = "https://use.fontawesome.com/releases/v5.3.1/js/all.js"
 GOOGLE_ANALYTICS = "https://www.googletagmanager.com/gtag/js?id=UA-159557337-1"
 
 # used to store description text etc.
-TEXT = loadfn("cola_colab/text.yaml")
+TEXT = loadfn(str(Path(__file__).parent / "text.yaml"))
+
+# disciplines not shown in the deficit graph, "Professional" is no longer
+# included in recent tables
+DEFICIT_EXCLUDED_DISCIPLINES = ("Other", "Joint/Unknown", "Professional")
+
+# kinds of campus finances shown in the context graph, see cola_colab.context
+CONTEXT_KINDS = ("Revenue", "Expense", "Research")
 
+# if enabled, changes to the rent burden threshold are handled entirely in the
+# browser (see assets/clientside.js) rather than by server callbacks
+CLIENTSIDE_CALLBACKS = os.environ.get("CLIENTSIDE_CALLBACKS", "1") != "0"
 
-def get_cost_of_living(percentage: float, campus: str, academic_year: int):
+# dollars the HUD and deficit graphs can be shown in, real dollars being dollars
+# of the latest year with a price index, see cola_colab.data.load_deflators
+DOLLARS = ("nominal", "real")
+
+
+def dollars_label(dollars):
+    """
+    Currency of amounts in nominal or real dollars, e.g. "$" or "2020 $", as
+    shown in axis titles.
     """
-    Get an approximate cost of living figure in USD per equation in whitepaper.
-    
+    return f"{data.REAL_DOLLARS_YEAR} $" if dollars == "real" else "$"
+
+
+def real_dollars_text():
+    """
+    Description of the price index real dollars are adjusted by, which is only
+    regional if the CPI table has a column for the area of any campus, see
+    cola_colab.data.CPI_AREAS.
+    """
+    text = (
+        "Real dollars are adjusted for inflation by the consumer price index for "
+        "all urban consumers (CPI-U), "
+    )
+    if set(data.CPI_AREA) == {data.CPI_NATIONAL}:
+        return text + "U.S. city average."
+    return (
+        text + "of the metro area of the campus where published, and the U.S. city "
+        "average otherwise."
+    )
+
+
+def in_dollars(figure, dollars):
+    """
+    Convert a figure made in nominal dollars by update_hud_graph or
+    update_deficit_graph, in place, to real dollars, by multiplying each trace by
+    its deflators, given as its customdata, so that the figures are cached once
+    for both. The same is done in the browser, see assets/clientside.js.
+
     Args:
-        percentage (float): 0-100
-        campus (str): Campus to look up rental data
-        academic_year (int): Will average rental data for this year and the next, to be
-            consistent with academic years
-    
+        figure (dict): figure, as returned by the figure cache
+        dollars (str): one of DOLLARS
+
     Returns:
-        (float) cost of living figure per month
+        (dict) the figure, for convenience
     """
+    if dollars != "real":
+        return figure
+    values = []
+    for trace in figure["data"]:
+        trace["y"] = [
+            None if y is None else y * d
+            for y, d in zip(trace["y"], trace["customdata"])
+        ]
+        values += [y for y in trace["y"] if y is not None]
+    layout = figure["layout"]
+    for axis in ("yaxis", "yaxis2"):
+        if axis in layout:
+            title = layout[axis]["title"]
+            title["text"] = title["text"].replace("($", f"({dollars_label(dollars)}")
+            if "range" in layout[axis]:
+                layout[axis]["range"] = [min(values) * 0.9, max(values) * 1.1]
+    return figure
 
-    def get_average_cost(bedroom_name: str, num_bedrooms: int):
-        return 0.5 * (
-            (
-                HUD.loc[(campus, bedroom_name), f"{academic_year} FMR"]
-                / num_bedrooms
-                / (percentage / 100)
-            )
-            + (
-                HUD.loc[(campus, bedroom_name), f"{academic_year+1} FMR"]
-                / num_bedrooms
-                / (percentage / 100)
-            )
-        )
 
-    return (1 / 5) * (
-        get_average_cost("Efficiency", 1)
-        + get_average_cost("1 br", 1)
-        + get_average_cost("2 br", 2)
-        + get_average_cost("3 br", 3)
-        + get_average_cost("4 br", 4)
-    )
+def get_clientside_data():
+    """
+    Data needed by the client-side callbacks, sent to the browser once as part of
+    the layout. Monthly rents are given by unit type, and averaged and scaled to
+    the rent burden threshold in the browser, net stipends by degree and
+    discipline, and deflators to real dollars by academic year.
+    """
+    deficit_table = load("DEFICIT_TABLE")
+    years = deficit_table["years"]
+    disciplines = [
+        discipline
+        for discipline in deficit_table["disciplines"]
+        if discipline not in DEFICIT_EXCLUDED_DISCIPLINES
+    ]
+    campuses = {}
+    for c, campus in enumerate(deficit_table["campuses"]):
+        campuses[campus] = {
+            # academic year average of each unit type, see get_cost_of_living
+            "unit_rent": (
+                0.5
+                * (
+                    data.HUD_RENT[c][:, year_indices(years)]
+                    + data.HUD_RENT[c][:, year_indices(years + 1)]
+                )
+            ).tolist(),
+            # to real dollars, by academic year
+            "deflators": [
+                None if np.isnan(d) else d
+                for d in get_deflators(campus, years, academic_year=True).tolist()
+            ],
+            "net_stipend": {},
+        }
+        for g, degree in enumerate(deficit_table["degrees"]):
+            net_stipend = dict(
+                zip(deficit_table["disciplines"], deficit_table["net_stipend"][g, c])
+            )
+            campuses[campus]["net_stipend"][degree] = {
+                discipline: [
+                    None if np.isnan(s) else s for s in net_stipend[discipline]
+                ]
+                for discipline in disciplines
+            }
+    return {
+        "years": years.tolist(),
+        "disciplines": disciplines,
+        "campuses": campuses,
+        "real_dollars_label": dollars_label("real"),
+        "template": go.Figure().layout.template.to_plotly_json(),
+    }
 
 
 meta_tags = [
@@ -105,6 +210,12 @@ app = dash.Dash(
     external_stylesheets=[BULMA_CSS, OPEN_SANS],
     external_scripts=[FONT_AWESOME, GOOGLE_ANALYTICS],
     meta_tags=meta_tags,
+    # the layout is only built on first use, see serve_layout, so callbacks cannot
+    # be checked against it when they are registered
+    suppress_callback_exceptions=True,
+    # gzip JSON, HTML, CSS and JavaScript responses with flask-compress, with its
+    # default settings, as pinned (1.4) it has no other algorithm than gzip
+    compress=True,
 )
 app.title = TEXT["title"]
 server = app.server
@@ -112,281 +223,600 @@ server = app.server
 # performance monitoring
 ScoutApm(server)
 
+# figures are cached as compressed JSON in a size-limited in-process cache, in
+# front of Redis if available, or else a cache directory if given, so that the
+# cache is shared between workers
+figure_cache_l1 = LRUCache(
+    max_bytes=int(os.environ.get("CACHE_MAX_BYTES", 64 * 1024**2))
+)
+# entries for previous data versions are no longer used, so expire
+CACHE_TIMEOUT = int(os.environ.get("CACHE_TIMEOUT", 7 * 24 * 60 * 60))
 if "REDIS_URL" in os.environ:
     cache = Cache(
         app.server,
         config={
             "CACHE_TYPE": "redis",
             "CACHE_REDIS_URL": os.environ.get("REDIS_URL", ""),
+            "CACHE_DEFAULT_TIMEOUT": CACHE_TIMEOUT,
         },
     )
-else:
+elif "CACHE_DIR" in os.environ:
     cache = Cache(
-        app.server, config={"CACHE_TYPE": "filesystem", "CACHE_DIR": "cache-directory"}
+        app.server,
+        config={
+            "CACHE_TYPE": "filesystem",
+            "CACHE_DIR": os.environ["CACHE_DIR"],
+            "CACHE_DEFAULT_TIMEOUT": CACHE_TIMEOUT,
+            # number of files kept
+            "CACHE_THRESHOLD": int(os.environ.get("CACHE_THRESHOLD", 10000)),
+        },
     )
+else:
+    cache = None
+if cache is not None:
+    figure_cache = FigureCache(
+        TieredCache(figure_cache_l1, cache), version=lambda: data.DATA_VERSION
+    )
+else:
+    figure_cache = FigureCache(figure_cache_l1, version=lambda: data.DATA_VERSION)
 
-layout = html.Div(
-    [
-        html.Div(
-            [
-                html.Div(
-                    [
-                        html.H2(TEXT["title"], className="title is-2"),
-                        html.H4(TEXT["authors"], className="subtitle is-4"),
-                        dcc.Markdown(TEXT["affiliations"], className="content"),
-                        html.Div(
-                            [
-                                html.H4("Introduction", className="title is-4"),
-                                dcc.Markdown(TEXT["introduction"]),
-                                html.Br(),
-                                html.A(
-                                    html.Button(
+# figures not in the cache are built by a pool of this many processes per gunicorn
+# worker, as building them in the (gevent) worker blocks all its other requests
+# meanwhile, see the README. Each process holds about 60 MB of private memory, set
+# to 0 to build figures in the worker
+FIGURE_WORKERS = int(os.environ.get("FIGURE_WORKERS", 1))
+FIGURE_TIMEOUT = float(os.environ.get("FIGURE_TIMEOUT", 60))
+
+
+def start_figure_pool():
+    """
+    Build figures in a pool of FIGURE_WORKERS processes, forked from this one on
+    first use. Called by gunicorn in each worker, see gunicorn.conf.py, so that
+    figures for the default view are built in-process by warm_up.
+    """
+    if FIGURE_WORKERS > 0:
+        figure_cache.pool = ProcessPool(FIGURE_WORKERS, timeout=FIGURE_TIMEOUT)
+
+
+# values selected when the page is first loaded
+DEFAULTS = {
+    "campus": CAMPUSES[0],
+    "degree": DEGREES[0],
+    "discipline": "Total",
+    "cost_of_living": 30,
+    "dollars": DOLLARS[0],
+    "job_titles": ["TEACHG ASST-GSHIP"],
+    "pay_type": PAY_TYPES[0],
+    # years are strings as in the options of the dropdown, see serve_layout
+    "years": ["2018"],
+    # as sent by the unit mix inputs, see assets/clientside.js, weights are
+    # normalized to sum to one
+    "unit_mix": {
+        "weights": list(unit_mix_key()[0]),
+        "occupants": list(OCCUPANTS),
+    },
+}
+
+# inputs of each server callback, by the id of its output, for DEFAULTS, the
+# outputs for these are pre-rendered in the layout, see gated_callback
+DEFAULT_INPUTS = {
+    "summary_graph": [
+        DEFAULTS["campus"],
+        DEFAULTS["job_titles"],
+        DEFAULTS["pay_type"],
+        DEFAULTS["years"],
+    ],
+    "context_graph": [
+        DEFAULTS["campus"],
+        DEFAULTS["cost_of_living"],
+        DEFAULTS["unit_mix"],
+    ],
+    "discipline": [DEFAULTS["degree"]],
+}
+if CLIENTSIDE_CALLBACKS:
+    DEFAULT_INPUTS["hud_base"] = [
+        DEFAULTS["campus"],
+        DEFAULTS["discipline"],
+        DEFAULTS["degree"],
+        DEFAULTS["unit_mix"],
+    ]
+else:
+    DEFAULT_INPUTS["hud_graph"] = [
+        DEFAULTS["campus"],
+        DEFAULTS["discipline"],
+        DEFAULTS["cost_of_living"],
+        DEFAULTS["degree"],
+        DEFAULTS["unit_mix"],
+        DEFAULTS["dollars"],
+    ]
+    DEFAULT_INPUTS["deficit_graph"] = [
+        DEFAULTS["campus"],
+        DEFAULTS["cost_of_living"],
+        DEFAULTS["degree"],
+        DEFAULTS["unit_mix"],
+        DEFAULTS["dollars"],
+    ]
+
+
+def gated_callback(name, output, inputs, state=()):
+    """
+    Decorator registering a server callback that is only called when its inputs
+    change, and not when the page is loaded, as its output for DEFAULT_INPUTS
+    is pre-rendered in the layout.
+
+    Dash calls every callback on page load, and before Dash 1.11 neither
+    prevent_initial_call nor callback_context can tell that call apart, so the
+    inputs are compared in the browser (see assets/clientside.js) with those of
+    the output on display, kept in a "<name>_inputs" store, which is the only
+    input of the server callback.
+
+    Figures of functions memoized by the figure cache are sent as the JSON they
+    are cached as, see send_json.
+
+    Args:
+        name (str): key of DEFAULT_INPUTS
+        output (Output): output, or list of outputs, of the callback
+        inputs (list): inputs of the callback, in the order of the arguments
+        state (list): state of the callback, passed after the inputs
+    """
+    store = f"{name}_inputs"
+    app.clientside_callback(
+        ClientsideFunction("cola", "changed_inputs"),
+        Output(store, "data"),
+        inputs,
+        [State(store, "data")],
+    )
+
+    def decorator(func):
+        def callback(inputs, *state):
+            # time in nested data, cache and serialize phases is not included
+            with phase("figure"):
+                if hasattr(func, "json"):
+                    return send_json(func.json(*inputs, *state))
+                return func(*inputs, *state)
+
+        app.callback(output, [Input(store, "data")], state)(callback)
+        return func
+
+    return decorator
+
+
+@lru_cache(maxsize=None)
+def serve_layout():
+    """
+    The page layout, built on first use rather than at import since it needs
+    data, see cola_colab.data.
+
+    Figures for the default inputs are pre-rendered into it, so that the page is
+    drawn without any server callbacks, see gated_callback. Like the data it is
+    built once per process, so new data takes a restart, see
+    cola_colab.data.DATA_VERSION.
+
+    With CLIENTSIDE_CALLBACKS, the HUD and deficit graphs are drawn in the
+    browser on page load instead, the HUD graph from the hud_base store, so that
+    its figure is only sent once.
+    """
+    hud_figure = update_hud_graph(
+        DEFAULTS["campus"],
+        DEFAULTS["discipline"],
+        DEFAULTS["cost_of_living"],
+        DEFAULTS["degree"],
+        DEFAULTS["unit_mix"],
+    )
+    if CLIENTSIDE_CALLBACKS:
+        # empty figures, as dcc.Graph defaults to
+        hud_graph_figure = {"data": [], "layout": {}}
+        deficit_figure = {"data": [], "layout": {}}
+    else:
+        hud_graph_figure = hud_figure
+        deficit_figure = update_deficit_graph(
+            DEFAULTS["campus"],
+            DEFAULTS["cost_of_living"],
+            DEFAULTS["degree"],
+            DEFAULTS["unit_mix"],
+        )
+    return html.Div(
+        [
+            html.Div(
+                [
+                    html.Div(
+                        [
+                            html.H2(TEXT["title"], className="title is-2"),
+                            html.H4(TEXT["authors"], className="subtitle is-4"),
+                            dcc.Markdown(TEXT["affiliations"], className="content"),
+                            html.Div(
+                                [
+                                    html.H4("Introduction", className="title is-4"),
+                                    dcc.Markdown(TEXT["introduction"]),
+                                    html.Br(),
+                                    html.A(
+                                        html.Button(
+                                            [
+                                                html.Span(
+                                                    html.I(className="fas fa-file-pdf"),
+                                                    className="icon",
+                                                ),
+                                                html.Span("Download the whitepaper"),
+                                            ],
+                                            className="button is-link",
+                                        ),
+                                        href="uc-cola-whitepaper.pdf",
+                                    ),
+                                ],
+                                className="box column is-8 content",
+                            ),
+                            html.Br(),
+                            html.Br(),
+                            html.H4("Summary Graph", className="title is-4"),
+                            html.Div(
+                                [
+                                    html.Div(
                                         [
+                                            html.Label(
+                                                "Select a campus", className="label"
+                                            ),
+                                            dcc.Dropdown(
+                                                options=[
+                                                    {"label": c, "value": c}
+                                                    for c in CAMPUSES
+                                                ],
+                                                value=DEFAULTS["campus"],
+                                                id="campus",
+                                                clearable=False,
+                                            ),
+                                            html.Br(),
+                                            html.Label(
+                                                "Select degree", className="label"
+                                            ),
+                                            dcc.Dropdown(
+                                                options=[
+                                                    {"label": degree, "value": degree}
+                                                    for degree in DEGREES
+                                                ],
+                                                value=DEFAULTS["degree"],
+                                                id="degree",
+                                                clearable=False,
+                                            ),
+                                            html.Br(),
+                                            html.Label(
+                                                "Select discipline", className="label"
+                                            ),
+                                            dcc.Dropdown(
+                                                options=[
+                                                    {
+                                                        "label": discipline,
+                                                        "value": discipline,
+                                                    }
+                                                    for discipline in get_disciplines(
+                                                        DEFAULTS["degree"]
+                                                    )
+                                                ],
+                                                value=DEFAULTS["discipline"],
+                                                id="discipline",
+                                                clearable=False,
+                                            ),
+                                            html.Br(),
+                                            html.Label(
+                                                "Define rent burden threshold",
+                                                className="label",
+                                            ),
+                                            dcc.Slider(
+                                                min=int(THRESHOLDS[0]),
+                                                max=int(THRESHOLDS[-1]),
+                                                value=DEFAULTS["cost_of_living"],
+                                                step=int(THRESHOLDS[1] - THRESHOLDS[0]),
+                                                tooltip={
+                                                    "always_visible": False,
+                                                    "placement": "bottom",
+                                                },
+                                                id="cost_of_living",
+                                                marks={
+                                                    10: "10%",
+                                                    30: "30%",
+                                                    50: "50%",
+                                                    70: "70%",
+                                                    90: "90%",
+                                                },
+                                            ),
+                                            html.Span(
+                                                "A person is rent burdened if they spend more than "
+                                            ),
+                                            html.Span(
+                                                str(DEFAULTS["cost_of_living"]),
+                                                id="burden",
+                                            ),
+                                            html.Span("% of their salary on rent."),
+                                            html.Br(),
+                                            html.Br(),
                                             html.Span(
-                                                html.I(className="fas fa-file-pdf"),
-                                                className="icon",
+                                                "Efficiency units are defined as ones in which "
+                                                "the living area is not separated from the "
+                                                "sleeping area."
+                                            ),
+                                            html.Br(),
+                                            html.Br(),
+                                            html.Label(
+                                                "Define unit mix", className="label"
+                                            ),
+                                            html.Span(
+                                                "The cost of living is based on the average rent per "
+                                                "person, weighting each unit type by the share of "
+                                                "students renting it, with rent split between the "
+                                                "occupants of the unit."
+                                            ),
+                                            html.Table(
+                                                [
+                                                    html.Thead(
+                                                        html.Tr(
+                                                            [
+                                                                html.Th("Unit type"),
+                                                                html.Th("Weight"),
+                                                                html.Th("Occupants"),
+                                                            ]
+                                                        )
+                                                    ),
+                                                    html.Tbody(
+                                                        [
+                                                            html.Tr(
+                                                                [
+                                                                    html.Td(unit),
+                                                                    html.Td(
+                                                                        dcc.Input(
+                                                                            id=f"unit_weight_{i}",
+                                                                            type="number",
+                                                                            min=0,
+                                                                            value=UNIT_WEIGHTS[
+                                                                                i
+                                                                            ],
+                                                                            debounce=True,
+                                                                            className="input is-small",
+                                                                        )
+                                                                    ),
+                                                                    html.Td(
+                                                                        dcc.Input(
+                                                                            id=f"occupants_{i}",
+                                                                            type="number",
+                                                                            min=1,
+                                                                            value=OCCUPANTS[
+                                                                                i
+                                                                            ],
+                                                                            debounce=True,
+                                                                            className="input is-small",
+                                                                        )
+                                                                    ),
+                                                                ]
+                                                            )
+                                                            for i, unit in enumerate(
+                                                                UNITS
+                                                            )
+                                                        ]
+                                                    ),
+                                                ],
+                                                className="table is-narrow",
                                             ),
-                                            html.Span("Download the whitepaper"),
+                                            dcc.Store(
+                                                id="unit_mix", data=DEFAULTS["unit_mix"]
+                                            ),
+                                            html.Label(
+                                                "Show dollars as", className="label"
+                                            ),
+                                            dcc.RadioItems(
+                                                options=[
+                                                    {
+                                                        "label": "Nominal",
+                                                        "value": "nominal",
+                                                    },
+                                                    {
+                                                        "label": "Real ("
+                                                        f"{data.REAL_DOLLARS_YEAR} "
+                                                        "dollars)",
+                                                        "value": "real",
+                                                    },
+                                                ],
+                                                value=DEFAULTS["dollars"],
+                                                id="dollars",
+                                                labelStyle={
+                                                    "display": "inline-block",
+                                                    "margin-right": "1em",
+                                                },
+                                            ),
+                                            html.Span(real_dollars_text()),
                                         ],
-                                        className="button is-link",
+                                        className="column is-3",
                                     ),
-                                    href="uc-cola-whitepaper.pdf",
-                                ),
-                            ],
-                            className="box column is-8 content",
-                        ),
-                        html.Br(),
-                        html.Br(),
-                        html.H4("Summary Graph", className="title is-4"),
-                        html.Div(
-                            [
-                                html.Div(
-                                    [
-                                        html.Label(
-                                            "Select a campus", className="label"
-                                        ),
-                                        dcc.Dropdown(
-                                            options=[
-                                                {"label": c, "value": c}
-                                                for c in CAMPUSES
-                                            ],
-                                            value=CAMPUSES[0],
-                                            id="campus",
-                                            clearable=False,
-                                        ),
-                                        html.Br(),
-                                        html.Label(
-                                            "Select discipline", className="label"
-                                        ),
-                                        dcc.Dropdown(
-                                            options=[
-                                                {
-                                                    "label": discipline,
-                                                    "value": discipline,
-                                                }
-                                                for discipline in DISCIPLINES
-                                            ],
-                                            value="Total",
-                                            id="discipline",
-                                            clearable=False,
-                                        ),
-                                        html.Br(),
-                                        html.Label(
-                                            "Define rent burden threshold",
-                                            className="label",
-                                        ),
-                                        dcc.Slider(
-                                            min=10,
-                                            max=90,
-                                            value=30,
-                                            step=5,
-                                            tooltip={
-                                                "always_visible": False,
-                                                "placement": "bottom",
-                                            },
-                                            id="cost_of_living",
-                                            marks={
-                                                10: "10%",
-                                                30: "30%",
-                                                50: "50%",
-                                                70: "70%",
-                                                90: "90%",
-                                            },
-                                        ),
-                                        html.Span(
-                                            "A person is rent burdened if they spend more than "
-                                        ),
-                                        html.Span("30", id="burden"),
-                                        html.Span("% of their salary on rent."),
-                                        html.Br(),
-                                        html.Br(),
-                                        html.Span(
-                                            "Efficiency units are defined as ones in which "
-                                            "the living area is not separated from the "
-                                            "sleeping area."
-                                        ),
-                                    ],
-                                    className="column is-3",
-                                ),
-                                html.Div(
-                                    [
-                                        dcc.Graph(
-                                            id="hud_graph",
-                                            figure={
-                                                "layout": {
-                                                    "xaxis": {"visible": False},
-                                                    "yaxis": {"visible": False},
-                                                    "paper_bgcolor": "rgba(0,0,0,0)",
-                                                    "plot_bgcolor": "rgba(0,0,0,0)",
-                                                }
-                                            },
-                                            config={"displayModeBar": False},
-                                        )
-                                    ],
-                                    className="column",
-                                ),
-                            ],
-                            className="columns",
-                        ),
-                        html.H4(
-                            "Cost-of-Living Deficit Calculator", className="title is-4"
-                        ),
-                        html.Div(
-                            [
-                                html.Div(
-                                    [
-                                        dcc.Markdown(
-                                            """
+                                    html.Div(
+                                        [
+                                            dcc.Graph(
+                                                id="hud_graph",
+                                                figure=hud_graph_figure,
+                                                config={"displayModeBar": False},
+                                            )
+                                        ],
+                                        className="column",
+                                    ),
+                                ],
+                                className="columns",
+                            ),
+                            html.H4(
+                                "Cost-of-Living Deficit Calculator",
+                                className="title is-4",
+                            ),
+                            html.Div(
+                                [
+                                    html.Div(
+                                        [
+                                            dcc.Markdown(
+                                                """
                                         Given the rent burden threshold defined above, we can calculate the average 
                                         cost-of-living adjustment (COLA) necessary across disciplines.
                                         """
-                                        )
-                                    ],
-                                    className="column is-3",
-                                ),
-                                html.Div(
-                                    [
-                                        dcc.Graph(
-                                            id="deficit_graph",
-                                            figure={
-                                                "layout": {
-                                                    "xaxis": {"visible": False},
-                                                    "yaxis": {"visible": False},
-                                                    "paper_bgcolor": "rgba(0,0,0,0)",
-                                                    "plot_bgcolor": "rgba(0,0,0,0)",
-                                                }
-                                            },
-                                            config={"displayModeBar": False},
-                                        )
-                                    ],
-                                    className="column",
-                                ),
-                            ],
-                            className="columns",
-                        ),
-                        # html.H4("COLA in Context", className="title is-4"),
-                        html.H4("Salary Distribution", className="title is-4"),
-                        html.Div(
-                            [
-                                html.Div(
-                                    [
-                                        dcc.Markdown(
-                                            "This chart allows an exploration of UC-wide student salaries against time. "
-                                            "Only job titles with more than a thousand employees are shown. "
-                                            "If you can supply data aggregated by campus in a computer-readable format, please "
-                                            "let us know."
-                                        ),
-                                        html.Br(),
-                                        html.Label(
-                                            "Select job title(s)", className="label"
-                                        ),
-                                        dcc.Dropdown(
-                                            options=[
-                                                {"label": job, "value": job}
-                                                for job in MOST_COMMON_JOBS
-                                            ],
-                                            value=["TEACHG ASST-GSHIP"],
-                                            multi=True,
-                                            clearable=False,
-                                            id="job_titles",
-                                        ),
-                                        html.Br(),
-                                        html.Label(
-                                            "Select pay type", className="label"
-                                        ),
-                                        dcc.Dropdown(
-                                            options=[
-                                                {"label": job, "value": job}
-                                                for job in PAY_TYPES
-                                            ],
-                                            value=PAY_TYPES[0],
-                                            clearable=False,
-                                            id="pay_type",
-                                        ),
-                                        html.Br(),
-                                        html.Label("View year(s)", className="label"),
-                                        dcc.Dropdown(
-                                            options=[
-                                                {"label": "All Years", "value": "all"},
-                                                {"label": "2018", "value": "2018"},
-                                                {"label": "2017", "value": "2017"},
-                                                {"label": "2016", "value": "2016"},
-                                                {"label": "2015", "value": "2015"},
-                                                {"label": "2014", "value": "2014"},
-                                                {"label": "2013", "value": "2013"},
-                                                {"label": "2012", "value": "2012"},
-                                            ],
-                                            multi=False,
-                                            clearable=False,
-                                            id="years",
-                                            value="2018",
-                                        ),
-                                    ],
-                                    className="column is-3",
-                                ),
-                                html.Div(
-                                    [
-                                        dcc.Graph(
-                                            id="summary_graph",
-                                            figure={
-                                                "layout": {
-                                                    "xaxis": {"visible": False},
-                                                    "yaxis": {"visible": False},
-                                                    "paper_bgcolor": "rgba(0,0,0,0)",
-                                                    "plot_bgcolor": "rgba(0,0,0,0)",
-                                                }
-                                            },
-                                            config={"displayModeBar": False},
-                                        )
-                                    ],
-                                    className="column",
+                                            )
+                                        ],
+                                        className="column is-3",
+                                    ),
+                                    html.Div(
+                                        [
+                                            dcc.Graph(
+                                                id="deficit_graph",
+                                                figure=deficit_figure,
+                                                config={"displayModeBar": False},
+                                            )
+                                        ],
+                                        className="column",
+                                    ),
+                                ],
+                                className="columns",
+                            ),
+                            html.H4("COLA in Context", className="title is-4"),
+                            html.Div(
+                                [
+                                    html.Div(
+                                        [
+                                            dcc.Markdown(
+                                                "The annual cost of a COLA covering the cost-of-living deficit of every "
+                                                "graduate student at the selected campus, for the rent burden threshold "
+                                                "defined above, compared with the revenues, expenses and research awards "
+                                                "of the campus in 2018-19. Student numbers are the latest average "
+                                                "enrollments in the UCOP graduate student support tables."
+                                            )
+                                        ],
+                                        className="column is-3",
+                                    ),
+                                    html.Div(
+                                        [
+                                            dcc.Graph(
+                                                id="context_graph",
+                                                figure=update_context_graph(
+                                                    *DEFAULT_INPUTS["context_graph"]
+                                                ),
+                                                config={"displayModeBar": False},
+                                            )
+                                        ],
+                                        className="column",
+                                    ),
+                                ],
+                                className="columns",
+                            ),
+                            html.H4("Salary Distribution", className="title is-4"),
+                            html.Div(
+                                [
+                                    html.Div(
+                                        [
+                                            dcc.Markdown(
+                                                "This chart allows an exploration of student salaries against time, at the selected campus "
+                                                "where campus-level data is available, and UC-wide otherwise. "
+                                                "Only job titles with more than a thousand employees are shown. "
+                                                "If you can supply data aggregated by campus in a computer-readable format, please "
+                                                "let us know."
+                                            ),
+                                            html.Br(),
+                                            html.Label(
+                                                "Select job title(s)", className="label"
+                                            ),
+                                            dcc.Dropdown(
+                                                options=[
+                                                    {"label": job, "value": job}
+                                                    for job in data.MOST_COMMON_JOBS
+                                                ],
+                                                value=DEFAULTS["job_titles"],
+                                                multi=True,
+                                                clearable=False,
+                                                id="job_titles",
+                                            ),
+                                            html.Br(),
+                                            html.Label(
+                                                "Select pay type", className="label"
+                                            ),
+                                            dcc.Dropdown(
+                                                options=[
+                                                    {"label": job, "value": job}
+                                                    for job in PAY_TYPES
+                                                ],
+                                                value=DEFAULTS["pay_type"],
+                                                clearable=False,
+                                                id="pay_type",
+                                            ),
+                                            html.Br(),
+                                            html.Label(
+                                                "View year(s)", className="label"
+                                            ),
+                                            dcc.Dropdown(
+                                                options=[
+                                                    {
+                                                        "label": "All Years",
+                                                        "value": "all",
+                                                    },
+                                                    *[
+                                                        {
+                                                            "label": str(year),
+                                                            "value": str(year),
+                                                        }
+                                                        for year in data.SALARY_STATS[
+                                                            "years"
+                                                        ][::-1]
+                                                    ],
+                                                ],
+                                                multi=True,
+                                                id="years",
+                                                value=DEFAULTS["years"],
+                                            ),
+                                        ],
+                                        className="column is-3",
+                                    ),
+                                    html.Div(
+                                        [
+                                            dcc.Graph(
+                                                id="summary_graph",
+                                                figure=update_summary_graph(
+                                                    *DEFAULT_INPUTS["summary_graph"]
+                                                ),
+                                                config={"displayModeBar": False},
+                                            )
+                                        ],
+                                        className="column",
+                                    ),
+                                ],
+                                className="columns",
+                            ),
+                            dcc.Store(
+                                id="cola_data",
+                                data=(
+                                    get_clientside_data()
+                                    if CLIENTSIDE_CALLBACKS
+                                    else None
                                 ),
+                            ),
+                            dcc.Store(
+                                id="hud_base",
+                                data=hud_figure if CLIENTSIDE_CALLBACKS else None,
+                            ),
+                            *[
+                                dcc.Store(id=f"{name}_inputs", data=inputs)
+                                for name, inputs in DEFAULT_INPUTS.items()
                             ],
-                            className="columns",
-                        ),
-                        html.H4("References", className="title is-4"),
-                        html.Div(
-                            [dcc.Markdown(TEXT["references"])], className="container"
-                        ),
-                        html.Br(),
-                        html.Footer(
-                            dcc.Markdown(TEXT["disclaimer"]), className="footer"
-                        ),
-                    ],
-                    className="column",
-                )
-            ],
-            className="columns",
-        )
-    ],
-    className="section",
-    style={"font-family": "Open Sans"},
-)
-
-app.layout = layout
+                            html.H4("References", className="title is-4"),
+                            html.Div(
+                                [dcc.Markdown(TEXT["references"])],
+                                className="container",
+                            ),
+                            html.Br(),
+                            html.Footer(
+                                dcc.Markdown(TEXT["disclaimer"]), className="footer"
+                            ),
+                        ],
+                        className="column",
+                    )
+                ],
+                className="columns",
+            )
+        ],
+        className="section",
+        style={"font-family": "Open Sans"},
+    )
 
 
-@app.callback(
+@gated_callback(
+    "summary_graph",
     Output("summary_graph", "figure"),
     [
         Input("campus", "value"),
@@ -395,39 +825,168 @@ app.layout = layout
         Input("years", "value"),
     ],
 )
-@cache.memoize()
+@figure_cache.memoize(unordered=("job_titles", "years"))
 def update_summary_graph(campus, job_titles, pay_type, years):
-    if years == "all":
-        return px.violin(
-            UC_WIDE_SALARY_DF[UC_WIDE_SALARY_DF["Job Title"].isin(job_titles)],
-            x="Year",
-            y=pay_type,
-            points=False,
-            box=True,
+    if campus in data.SALARY_STATS["campuses"]:
+        stats_campus = campus
+        title = f"Salaries at UC {campus}"
+    else:
+        stats_campus = UC_WIDE
+        title = f"UC-wide salaries (no campus-level data for UC {campus})"
+    # a violin plot of every year, or histograms of the selected years
+    if isinstance(years, str):
+        years = [years]
+    if not years or "all" in years:
+        selected_years = None
+    else:
+        selected_years = sorted(int(year) for year in years)
+
+    with phase("data"):
+        stats = combine_salary_stats(
+            data.SALARY_STATS, job_titles, pay_type, campus=stats_campus
         )
-    elif years == "2018":
-        fig = px.histogram(
-            UC_WIDE_SALARY_DF[
-                (UC_WIDE_SALARY_DF["Job Title"].isin(job_titles))
-                & (UC_WIDE_SALARY_DF["Year"] == int(years))
-            ],
-            x=pay_type,
+        rows = int(
+            stats["counts"][np.isin(stats["years"], selected_years)].sum()
+            if selected_years
+            else stats["counts"].sum()
         )
-        return fig
+
+    # selections of any size are drawn from pre-aggregated statistics rather than
+    # individual salaries, which keeps figures small and the same whichever job
+    # titles are selected, see cola_colab.stats
+    if selected_years:
+        fig = salary_histogram_figure(stats, pay_type, selected_years)
     else:
-        raise PreventUpdate
+        fig = salary_violin_figure(stats, pay_type)
+    if rows:
+        title += f"<br><sub>Summarized from {rows:,} salaries</sub>"
+    fig.update_layout(title_text=title)
+    return fig
 
 
-@app.callback(
-    Output("hud_graph", "figure"),
-    [
-        Input("campus", "value"),
-        Input("discipline", "value"),
-        Input("cost_of_living", "value"),
-    ],
-)
-@cache.memoize()
-def update_hud_graph(campus, discipline, cost_of_living):
+def salary_violin_figure(stats, pay_type):
+    """
+    Equivalent of a plotly violin plot (with box) of salary against year,
+    drawn from kernel density estimates and quantiles.
+    """
+    color = px.colors.qualitative.Plotly[0]
+    fig = go.Figure()
+    for year, count, kde, (low, q1, median, q3, high) in zip(
+        stats["years"], stats["counts"], stats["kde"], stats["quantiles"]
+    ):
+        if not count:
+            continue
+        # trim the density to the range of the data, and scale to a fixed width
+        in_range = (stats["kde_grid"] >= low) & (stats["kde_grid"] <= high)
+        # rounded, since full precision floats would dominate the figure size
+        y = stats["kde_grid"][in_range].round()
+        half_width = (0.4 * kde[in_range] / kde.max()).round(3)
+        fig.add_trace(
+            go.Scatter(
+                x=[*(year - half_width), *(year + half_width)[::-1]],
+                y=[*y, *y[::-1]],
+                fill="toself",
+                mode="lines",
+                line=dict(color=color, width=1),
+                hoverinfo="skip",
+                showlegend=False,
+            )
+        )
+        fence = 1.5 * (q3 - q1)
+        fig.add_trace(
+            go.Box(
+                x=[year],
+                q1=[q1],
+                median=[median],
+                q3=[q3],
+                lowerfence=[max(low, q1 - fence)],
+                upperfence=[min(high, q3 + fence)],
+                width=0.1,
+                marker=dict(color=color),
+                fillcolor="white",
+                name=str(year),
+                showlegend=False,
+            )
+        )
+    fig.update_layout(xaxis_title="Year", yaxis_title=pay_type)
+    return fig
+
+
+def salary_histogram_figure(stats, pay_type, years):
+    """
+    Equivalent of a plotly histogram of salaries, overlaid for several years,
+    drawn from pre-binned counts, so each year is a lookup of its histogram.
+    Salaries above the last bin are counted in an outlined "overflow" bar past
+    it, labelled with the edge, rather than left out.
+    """
+    edges = stats["bin_edges"]
+    width = edges[1] - edges[0]
+    centers = (0.5 * (edges[1:] + edges[:-1])).round()
+    colors = px.colors.qualitative.Plotly
+    indices = {
+        year: list(stats["years"]).index(year)
+        for year in years
+        if year in stats["years"]
+    }
+    overflow = stats["overflow"][list(indices.values())]
+    if overflow.any():
+        centers = np.append(centers, (edges[-1] + 0.5 * width).round())
+    fig = go.Figure()
+    for i, year in enumerate(years):
+        y = indices.get(year)
+        counts = stats["histograms"][y] if y is not None else []
+        text = None
+        if overflow.any() and y is not None:
+            counts = np.append(counts, stats["overflow"][y])
+            # the label is only shown once, for the first year with salaries
+            label = f"over {edges[-1]:,.0f}" if year == next(iter(indices)) else ""
+            text = [""] * (len(centers) - 1) + [label]
+        fig.add_trace(
+            go.Bar(
+                x=centers,
+                y=counts,
+                width=width,
+                text=text,
+                textposition="outside",
+                marker=dict(
+                    color=colors[i % len(colors)],
+                    line=dict(
+                        color="black",
+                        width=[0] * (len(centers) - 1) + [2] if text else 0,
+                    ),
+                ),
+                name=str(year),
+                showlegend=len(years) > 1,
+            )
+        )
+    fig.update_layout(
+        xaxis_title=pay_type,
+        yaxis_title="count",
+        bargap=0,
+        barmode="overlay",
+        legend_title_text="Year",
+    )
+    if len(years) > 1:
+        fig.update_traces(opacity=0.6)
+    return fig
+
+
+def unit_mix_args(unit_mix):
+    """
+    Unit weights and occupants from the "unit_mix" store, see serve_layout.
+    """
+    unit_mix = unit_mix or DEFAULTS["unit_mix"]
+    return tuple(unit_mix["weights"]), tuple(unit_mix["occupants"])
+
+
+@figure_cache.memoize()
+def update_hud_graph(
+    campus,
+    discipline,
+    cost_of_living,
+    degree=DEGREES[0],
+    unit_mix=None,
+):
 
     units = ["Efficiency", "1 br", "2 br", "3 br", "4 br"]
 
@@ -439,9 +998,11 @@ def update_hud_graph(campus, discipline, cost_of_living):
     ucop_survey_color = "rgb(255, 255, 51)"
     wage_color = "rgb(180, 151, 231)"
 
-    years = [2007 + i for i in range(13)]
-    unit_scaling = [1.0, 1.0, 1.0 / 2.0, 1.0 / 3.0, 1.0 / 4.0]
-    label_prefix = ["", "", "Single in ", "Single in ", "Single in "]
+    # every year with HUD data, see cola_colab.data.load_hud_years
+    years = data.HUD_YEARS.tolist()
+    _, occupants = unit_mix_args(unit_mix)
+    unit_scaling = [1.0 / n for n in occupants]
+    label_prefix = ["Single in " if n > 1 else "" for n in occupants]
 
     # Create figure with secondary y-axis
     fig = make_subplots(specs=[[{"secondary_y": True}]])
@@ -449,9 +1010,13 @@ def update_hud_graph(campus, discipline, cost_of_living):
     # Add traces for housing costs for each unit type
     min_y = 1e6  # for setting y axis range, arbitrary large value
     max_y = 0
+    c = campus_indices(campus)
+    # in nominal dollars, with the deflators of each trace as customdata, see
+    # in_dollars
+    deflators = get_deflators(campus, years)
     for i, unit in enumerate(units):
-        unit_rent = HUD.loc[(campus, unit), "2007 FMR":"2019 FMR"].values.tolist()
-        unit_rent = [rent * unit_scaling[i] for rent in unit_rent]
+        unit_rent = data.HUD_RENT[c, UNITS.index(unit), year_indices(years)]
+        unit_rent = (unit_rent * unit_scaling[i]).tolist()
         min_y = min([min_y, *unit_rent])
         max_y = max([max_y, *unit_rent])
         fig.add_trace(
@@ -460,6 +1025,7 @@ def update_hud_graph(campus, discipline, cost_of_living):
                 y=unit_rent,
                 mode="lines+markers",
                 name=label_prefix[i] + unit,
+                customdata=deflators.tolist(),
                 line=dict(color=camp_colors[campus], width=5),
                 marker=dict(
                     color=unit_colors[unit],
@@ -475,9 +1041,10 @@ def update_hud_graph(campus, discipline, cost_of_living):
     fig.add_trace(
         go.Scatter(
             x=[2017],
-            y=SURVEY.loc[campus].values.tolist(),
+            y=data.SURVEY.loc[campus].values.tolist(),
             mode="markers",
             name="UCOP Grad Survey Average",
+            customdata=get_deflators(campus, [2017]).tolist(),
             marker=dict(
                 color=ucop_survey_color,
                 symbol=17,
@@ -489,15 +1056,16 @@ def update_hud_graph(campus, discipline, cost_of_living):
     )
 
     # Also plot mean/median wage vs time
-    stipend_df = NET_STIPEND[
-        (NET_STIPEND["Campus"] == campus) & (NET_STIPEND["Discipline"] == discipline)
-    ]
+    with phase("data"):
+        stipend_years, monthly_stipend = get_net_stipend(campus, discipline, degree)
+    stipend_deflators = get_deflators(campus, stipend_years, academic_year=True)
     fig.add_trace(
         go.Scatter(
             # offset academic years to be ".5", e.g. 2016-2017 is 2016.5
-            x=[y + 0.5 for y in stipend_df["Year"]],
-            y=[s / 12 for s in stipend_df["Net Stipend"]],
+            x=(stipend_years + 0.5).tolist(),
+            y=monthly_stipend.tolist(),
             name="Net stipend",
+            customdata=stipend_deflators.tolist(),
             line=dict(color=wage_color, width=5),
             marker=dict(
                 color=wage_color,
@@ -508,20 +1076,19 @@ def update_hud_graph(campus, discipline, cost_of_living):
         ),
         secondary_y=True,
     )
-    min_y = min([min_y, *[s / 12 for s in stipend_df["Net Stipend"]]])
-    max_y = max([max_y, *[s / 12 for s in stipend_df["Net Stipend"]]])
+    min_y = min([min_y, *monthly_stipend])
+    max_y = max([max_y, *monthly_stipend])
 
     # Also plot rent burden threshold
-    stipend_df = NET_STIPEND[
-        (NET_STIPEND["Campus"] == campus) & (NET_STIPEND["Discipline"] == discipline)
-    ]
+    rent_burden = (cost_of_living / 100) * monthly_stipend
     fig.add_trace(
         go.Scatter(
             # offset academic years to be ".5", e.g. 2016-2017 is 2016.5
-            x=[y + 0.5 for y in stipend_df["Year"]],
-            y=[(cost_of_living / 100) * s / 12 for s in stipend_df["Net Stipend"]],
+            x=(stipend_years + 0.5).tolist(),
+            y=rent_burden.tolist(),
             name="Rent burden threshold",
             mode="lines+markers",
+            customdata=stipend_deflators.tolist(),
             line=dict(color=wage_color, width=5),
             marker=dict(
                 color="rgb(255, 255, 255)",
@@ -532,12 +1099,8 @@ def update_hud_graph(campus, discipline, cost_of_living):
         ),
         secondary_y=True,
     )
-    min_y = min(
-        [min_y, *[(cost_of_living / 100) * s / 12 for s in stipend_df["Net Stipend"]]]
-    )
-    max_y = max(
-        [max_y, *[(cost_of_living / 100) * s / 12 for s in stipend_df["Net Stipend"]]]
-    )
+    min_y = min([min_y, *rent_burden])
+    max_y = max([max_y, *rent_burden])
 
     # Add figure title
     fig.update_layout(title_text=f"Housing costs and wages over time at UC {campus}")
@@ -566,38 +1129,44 @@ def update_hud_graph(campus, discipline, cost_of_living):
     return fig
 
 
-@app.callback(
-    Output("deficit_graph", "figure"),
-    [Input("campus", "value"), Input("cost_of_living", "value")],
-)
-@cache.memoize()
-def update_deficit_graph(campus, cost_of_living_percent):
-
-    stipend_df = NET_STIPEND[
-        (NET_STIPEND["Campus"] == campus)
-        & (NET_STIPEND["Discipline"] != "Other")
-        & (NET_STIPEND["Discipline"] != "Joint/Unknown")
-        & (
-            NET_STIPEND["Discipline"] != "Professional"
-        )  # no longer included in recent tables
-    ]
-
-    stipend_df["Cost-of-Living"] = stipend_df.apply(
-        lambda row: get_cost_of_living(
-            cost_of_living_percent, row["Campus"], row["Year"]
-        ),
-        axis=1,
-    )
+@figure_cache.memoize()
+def update_deficit_graph(
+    campus,
+    cost_of_living_percent,
+    degree=DEGREES[0],
+    unit_mix=None,
+):
 
-    stipend_df["Cost-of-Living Deficit ($/month)"] = stipend_df.apply(
-        lambda row: row["Cost-of-Living"] - (row["Net Stipend"] / 12), axis=1
-    )
+    # pre-computed for the default unit mix, see cola_colab.cola.build_deficit_table
+    with phase("data"):
+        deficits = get_deficits(
+            campus, cost_of_living_percent, degree, *unit_mix_args(unit_mix)
+        )
+        deficit_table = load("DEFICIT_TABLE")
+    # in nominal dollars, with the deflators of each trace as customdata, see
+    # in_dollars
+    deflators = get_deflators(campus, deficit_table["years"], academic_year=True)
 
-    fig = px.scatter(
-        stipend_df, x="Year", y="Cost-of-Living Deficit ($/month)", color="Discipline"
-    )
-    fig.update_traces(
-        mode="markers+lines", marker=dict(symbol=0, size=10), line=dict(width=5)
+    fig = go.Figure()
+    for discipline, discipline_deficits in zip(deficit_table["disciplines"], deficits):
+        has_data = ~np.isnan(discipline_deficits)
+        if discipline in DEFICIT_EXCLUDED_DISCIPLINES or not has_data.any():
+            continue
+        fig.add_trace(
+            go.Scatter(
+                x=deficit_table["years"][has_data].tolist(),
+                y=discipline_deficits[has_data].tolist(),
+                customdata=deflators[has_data].tolist(),
+                name=discipline,
+                mode="markers+lines",
+                marker=dict(symbol=0, size=10),
+                line=dict(width=5),
+            )
+        )
+    fig.update_layout(
+        xaxis_title="Year",
+        yaxis_title="Cost-of-Living Deficit ($/month)",
+        legend_title_text="Discipline",
     )
 
     # Add figure title
@@ -611,6 +1180,190 @@ def update_deficit_graph(campus, cost_of_living_percent):
     return fig
 
 
+@gated_callback(
+    "context_graph",
+    Output("context_graph", "figure"),
+    [
+        Input("campus", "value"),
+        Input("cost_of_living", "value"),
+        Input("unit_mix", "data"),
+    ],
+)
+@figure_cache.memoize()
+def update_context_graph(campus, cost_of_living_percent, unit_mix=None):
+
+    # pre-computed for the default unit mix, see cola_colab.context.build_context_table
+    with phase("data"):
+        context_table = load("CONTEXT_TABLE")
+        cola_costs = get_cola_costs(
+            campus, cost_of_living_percent, *unit_mix_args(unit_mix)
+        )
+        uncosted = get_uncosted_headcount(campus).sum()
+        finances = context_table["finances"][int(campus_indices(campus))]
+    # NaN if the headcounts are missing, i.e. the support tables were not extracted
+    total_cost = np.sum(cola_costs)
+
+    fig = go.Figure()
+    fig.add_trace(
+        go.Bar(
+            x=(cola_costs / 1e6).tolist(),
+            y=[f"COLA ({degree})" for degree in context_table["degrees"]],
+            name="COLA",
+            orientation="h",
+            hovertemplate="%{y}: $%{x:,.1f}M<extra></extra>",
+        )
+    )
+    for kind in CONTEXT_KINDS:
+        # categories that are zero cannot be shown on a log axis
+        in_kind = (context_table["kinds"] == kind) & (finances > 0)
+        fig.add_trace(
+            go.Bar(
+                x=(finances[in_kind] / 1e6).tolist(),
+                y=[
+                    f"{category} ({kind.lower()})"
+                    for category in context_table["categories"][in_kind]
+                ],
+                name=kind,
+                orientation="h",
+                customdata=(100 * total_cost / finances[in_kind]).tolist(),
+                hovertemplate="%{y}: $%{x:,.1f}M, the COLA is %{customdata:.2f}%"
+                "<extra></extra>",
+            )
+        )
+
+    expenses = finances[context_table["kinds"] == "Expense"].sum()
+    title = (
+        f"Annual cost of a COLA at UC {campus} for a "
+        f"{cost_of_living_percent}% rent burden threshold: "
+    )
+    if np.isnan(total_cost):
+        title += "not available, as there are no headcounts"
+    else:
+        title += (
+            f"${total_cost / 1e6:,.1f}M, {100 * total_cost / expenses:.2f}% of expenses"
+        )
+    if uncosted > 0:
+        title += (
+            f"<br><sub>Excludes {uncosted:,.0f} students in disciplines without "
+            "stipend data</sub>"
+        )
+    fig.update_layout(
+        title_text=title,
+        xaxis_title="Annual cost, revenue or expense ($M)",
+        xaxis_type="log",
+        yaxis_autorange="reversed",
+        height=600,
+        legend=dict(x=0, y=-0.2),
+        legend_orientation="h",
+    )
+
+    return fig
+
+
+@gated_callback(
+    "discipline",
+    [Output("discipline", "options"), Output("discipline", "value")],
+    [Input("degree", "value")],
+    [State("discipline", "value")],
+)
+def update_disciplines(degree, discipline):
+    # not all disciplines have data for every degree, e.g. there is no "Total"
+    # for Masters
+    with phase("data"):
+        disciplines = get_disciplines(degree)
+    if discipline not in disciplines:
+        discipline = disciplines[0]
+    return [{"label": d, "value": d} for d in disciplines], discipline
+
+
+if CLIENTSIDE_CALLBACKS:
+
+    # the server only sends the HUD graph when the campus or discipline changes,
+    # the rent burden threshold is then applied in the browser
+    @gated_callback(
+        "hud_base",
+        Output("hud_base", "data"),
+        [
+            Input("campus", "value"),
+            Input("discipline", "value"),
+            Input("degree", "value"),
+            Input("unit_mix", "data"),
+        ],
+    )
+    def update_hud_base(campus, discipline, degree, unit_mix):
+        return send_json(
+            update_hud_graph.json(
+                campus, discipline, DEFAULTS["cost_of_living"], degree, unit_mix
+            )
+        )
+
+    app.clientside_callback(
+        ClientsideFunction("cola", "hud_graph"),
+        Output("hud_graph", "figure"),
+        [
+            Input("hud_base", "data"),
+            Input("cost_of_living", "value"),
+            Input("dollars", "value"),
+            Input("cola_data", "data"),
+        ],
+    )
+
+    app.clientside_callback(
+        ClientsideFunction("cola", "deficit_graph"),
+        Output("deficit_graph", "figure"),
+        [
+            Input("campus", "value"),
+            Input("cost_of_living", "value"),
+            Input("cola_data", "data"),
+            Input("degree", "value"),
+            Input("unit_mix", "data"),
+            Input("dollars", "value"),
+        ],
+    )
+
+else:
+
+    # figures are cached in nominal dollars, and converted, see in_dollars
+    @gated_callback(
+        "hud_graph",
+        Output("hud_graph", "figure"),
+        [
+            Input("campus", "value"),
+            Input("discipline", "value"),
+            Input("cost_of_living", "value"),
+            Input("degree", "value"),
+            Input("unit_mix", "data"),
+            Input("dollars", "value"),
+        ],
+    )
+    def update_hud_graph_in_dollars(
+        campus, discipline, cost_of_living, degree, unit_mix, dollars
+    ):
+        return in_dollars(
+            update_hud_graph(campus, discipline, cost_of_living, degree, unit_mix),
+            dollars,
+        )
+
+    @gated_callback(
+        "deficit_graph",
+        Output("deficit_graph", "figure"),
+        [
+            Input("campus", "value"),
+            Input("cost_of_living", "value"),
+            Input("degree", "value"),
+            Input("unit_mix", "data"),
+            Input("dollars", "value"),
+        ],
+    )
+    def update_deficit_graph_in_dollars(
+        campus, cost_of_living_percent, degree, unit_mix, dollars
+    ):
+        return in_dollars(
+            update_deficit_graph(campus, cost_of_living_percent, degree, unit_mix),
+            dollars,
+        )
+
+
 app.clientside_callback(
     """function (value) {
         return value;
@@ -620,14 +1373,237 @@ app.clientside_callback(
     [Input("cost_of_living", "value")],
 )
 
+app.clientside_callback(
+    ClientsideFunction("cola", "unit_mix"),
+    Output("unit_mix", "data"),
+    [Input(f"unit_weight_{i}", "value") for i in range(len(UNITS))]
+    + [Input(f"occupants_{i}", "value") for i in range(len(UNITS))],
+    [State("unit_mix", "data")],
+)
+
+# assigned after the callbacks, as Dash builds a layout given as a function when
+# registering callbacks otherwise
+app.layout = serve_layout
+
+
+# datasets read by callbacks, and their dependencies, all others, e.g. the salary
+# frame UC_WIDE_SALARY_DF only needed to re-compute missing salary statistics,
+# are left to load on first use
+WARM_UP_DATASETS = (
+    "DATA_VERSION",
+    "SALARY_STATS",
+    "MOST_COMMON_JOBS",
+    "HUD_YEARS",
+    "HUD_RENT",
+    "SURVEY",
+    "REAL_DOLLARS_YEAR",
+    "DEFLATORS",
+    "ACADEMIC_DEFLATORS",
+    "DEFICIT_TABLE",
+    "CONTEXT_TABLE",
+)
+
+
+def warm_up():
+    """
+    Load the data read by callbacks, see WARM_UP_DATASETS, and build the layout,
+    filling the figure cache (both tiers, if using Redis) for the default view,
+    ahead of the first request. Called by gunicorn before forking workers, see
+    gunicorn.conf.py, otherwise everything is loaded on first use.
+    """
+    data.warm_up(WARM_UP_DATASETS)
+    serve_layout()
+
+
+WHITEPAPER_PATH = Path(__file__).parent.parent.absolute() / "whitepaper.pdf"
+
+# responses that only change with the data or a new release of the app, which
+# browsers may keep but must revalidate, see get_etag. The ETag is weak, as the
+# same one is sent with and without compression by flask-compress
+ETAG_PATHS = [
+    app.config.routes_pathname_prefix,
+    f"{app.config.routes_pathname_prefix}_dash-layout",
+    f"{app.config.routes_pathname_prefix}_dash-dependencies",
+    "/uc-cola-whitepaper.pdf",
+]
+
+# assets are requested with their modification time in the query string, e.g.
+# `/assets/clientside.js?m=1581379200.0`, so a given URL never changes
+ASSETS_PATH = f"{app.config.routes_pathname_prefix}{app.config.assets_url_path}/"
+ASSETS_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+@lru_cache(maxsize=None)
+def get_etag():
+    """
+    ETag of the responses in ETAG_PATHS: the data version and a hash of the app
+    source, text and whitepaper, so that it changes with the data or the app.
+    """
+    sha1 = hashlib.sha1(data.DATA_VERSION.encode())
+    package_dir = Path(__file__).parent
+    for path in sorted(
+        [
+            *package_dir.glob("*.py"),
+            *package_dir.glob("*.yaml"),
+            *(package_dir / "assets").glob("*"),
+            WHITEPAPER_PATH,
+        ]
+    ):
+        sha1.update(path.read_bytes())
+    return sha1.hexdigest()[:16]
+
+
+@app.server.before_request
+def not_modified():
+    # answer revalidation of unchanged responses without building them
+    request = flask.request
+    if request.method == "GET" and request.path in ETAG_PATHS:
+        if request.if_none_match.contains_weak(get_etag()):
+            response = flask.Response(status=304)
+            response.set_etag(get_etag(), weak=True)
+            response.headers["Cache-Control"] = "no-cache"
+            return response
+
+
+@app.server.after_request
+def cache_headers(response):
+    request = flask.request
+    if request.method != "GET" or response.status_code != 200:
+        return response
+    if request.path in ETAG_PATHS:
+        response.set_etag(get_etag(), weak=True)
+        response.headers["Cache-Control"] = "no-cache"
+    elif request.path.startswith(ASSETS_PATH) and "m" in request.args:
+        response.headers["Cache-Control"] = ASSETS_CACHE_CONTROL
+    return response
+
+
+CALLBACK_PATH = f"{app.config.routes_pathname_prefix}_dash-update-component"
+
+# the metrics are served to local requests only, e.g. a Prometheus agent on the
+# same host, or to requests with "Authorization: Bearer <METRICS_TOKEN>" if set
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+
+@app.server.before_request
+def start_callback_metrics():
+    request = flask.request
+    if request.method == "POST" and request.path == CALLBACK_PATH:
+        body = request.get_json(silent=True) or {}
+        callback_metrics.start(
+            body.get("output"),
+            [value.get("value") for value in body.get("inputs", [])],
+        )
+
+
+@app.server.after_request
+def finish_callback_metrics(response):
+    # runs before flask-compress, so this is the uncompressed size
+    if flask.request.path == CALLBACK_PATH:
+        callback_metrics.finish(response.calculate_content_length() or 0)
+    return response
+
+
+# placeholder for JSON spliced into a callback response, see send_json
+SEND_JSON_PLACEHOLDER = "__cola_json_{}__"
+
+
+def send_json(json_bytes):
+    """
+    Have a server callback send JSON bytes, e.g. a figure as cached by the figure
+    cache, as is, rather than parsed and re-encoded by Dash. Dash encodes a
+    placeholder, which is replaced after the request, see splice_json.
+
+    Args:
+        json_bytes (bytes): UTF-8 encoded JSON
+
+    Returns:
+        (str) placeholder, to return from the callback
+    """
+    if "send_json" not in flask.g:
+        flask.g.send_json = []
+    flask.g.send_json.append(json_bytes)
+    return SEND_JSON_PLACEHOLDER.format(len(flask.g.send_json) - 1)
+
+
+# registered after finish_callback_metrics, so that it runs before, and both run
+# before flask-compress
+@app.server.after_request
+def splice_json(response):
+    if "send_json" in flask.g and response.status_code == 200:
+        body = response.get_data()
+        for i, json_bytes in enumerate(flask.g.send_json):
+            placeholder = f'"{SEND_JSON_PLACEHOLDER.format(i)}"'.encode()
+            body = body.replace(placeholder, json_bytes, 1)
+        response.set_data(body)
+    return response
+
+
+def check_metrics_authorized():
+    request = flask.request
+    authorized = (
+        f"Bearer {METRICS_TOKEN}" == request.headers.get("Authorization")
+        if METRICS_TOKEN
+        else request.remote_addr in ("127.0.0.1", "::1")
+    )
+    if not authorized:
+        flask.abort(404)
+
+
+@app.server.route("/metrics/slowest")
+def slowest_requests():
+    # the inputs of the slowest requests of each callback, which are not metric
+    # labels, see cola_colab.metrics
+    check_metrics_authorized()
+    return flask.jsonify(callback_metrics.slowest_requests())
+
+
+@app.server.route("/metrics")
+def metrics():
+    check_metrics_authorized()
+
+    lines = callback_metrics.render()
+    lines += [
+        "# HELP cola_figure_cache_requests_total Figure cache lookups, by result",
+        "# TYPE cola_figure_cache_requests_total counter",
+    ]
+    for result, count in figure_cache.stats().items():
+        labels = format_labels([("result", result)])
+        lines.append(f"cola_figure_cache_requests_total{labels} {count}")
+    lines += [
+        "# HELP cola_figure_cache_bytes Size of the in-process figure cache",
+        "# TYPE cola_figure_cache_bytes gauge",
+        f"cola_figure_cache_bytes {figure_cache_l1.current_bytes}",
+        # metrics are per worker, e.g. benchmarks.load_test tells them apart by pid
+        "# HELP cola_worker_pid Process id of the worker serving these metrics",
+        "# TYPE cola_worker_pid gauge",
+        f"cola_worker_pid {os.getpid()}",
+    ]
+    return flask.Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
+# send_file arguments naming the download and disabling its own ETag, which were
+# renamed in Flask 2.0, and the old names removed in Flask 2.2
+if "download_name" in inspect.signature(flask.send_file).parameters:
+    WHITEPAPER_SEND_FILE_ARGS = {
+        "download_name": "uc-cola-whitepaper.pdf",
+        "etag": False,
+    }
+else:
+    WHITEPAPER_SEND_FILE_ARGS = {
+        "attachment_filename": "uc-cola-whitepaper.pdf",
+        "add_etags": False,
+    }
+
 
 @app.server.route("/uc-cola-whitepaper.pdf")
 def download_csv():
+    # see cache_headers for the ETag
     return flask.send_file(
-        Path(__file__).parent.parent.absolute() / "whitepaper.pdf",
+        WHITEPAPER_PATH,
         mimetype="application/pdf",
-        attachment_filename="uc-cola-whitepaper.pdf",
         as_attachment=True,
+        **WHITEPAPER_SEND_FILE_ARGS,
     )
 
 
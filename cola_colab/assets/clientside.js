@@ -0,0 +1,159 @@
+// Client-side versions of the callbacks that depend on the rent burden threshold,
+// so that moving the slider does not need a round trip to the server.
+// See CLIENTSIDE_CALLBACKS in app.py.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    cola: {
+        // Rescale the "Rent burden threshold" trace of a figure made by
+        // update_hud_graph in nominal dollars, and the y axis ranges to match. In
+        // real dollars, every trace is first multiplied by its deflators, which
+        // update_hud_graph gives as customdata.
+        hud_graph: function (figure, cost_of_living, dollars, data) {
+            if (!figure) {
+                // blank placeholder until the server has sent the figure
+                return {
+                    layout: {
+                        xaxis: {visible: false},
+                        yaxis: {visible: false},
+                        paper_bgcolor: "rgba(0,0,0,0)",
+                        plot_bgcolor: "rgba(0,0,0,0)"
+                    }
+                };
+            }
+            figure = JSON.parse(JSON.stringify(figure));
+
+            if (dollars === "real") {
+                figure.data.forEach(function (trace) {
+                    trace.y = trace.y.map(function (y, i) {
+                        return y === null ? null : y * trace.customdata[i];
+                    });
+                });
+                [figure.layout.yaxis, figure.layout.yaxis2].forEach(function (axis) {
+                    axis.title.text = axis.title.text.replace(
+                        "($)", "(" + data.real_dollars_label + ")"
+                    );
+                });
+            }
+
+            var stipend = figure.data.find(function (trace) {
+                return trace.name === "Net stipend";
+            });
+            var threshold = figure.data.find(function (trace) {
+                return trace.name === "Rent burden threshold";
+            });
+            threshold.y = stipend.y.map(function (s) {
+                return (cost_of_living / 100) * s;
+            });
+
+            var values = [];
+            figure.data.forEach(function (trace) {
+                values = values.concat(trace.y.filter(function (y) {
+                    return y !== null;
+                }));
+            });
+            var range = [
+                Math.min.apply(null, values) * 0.9,
+                Math.max.apply(null, values) * 1.1
+            ];
+            figure.layout.yaxis.range = range;
+            figure.layout.yaxis2.range = range;
+
+            return figure;
+        },
+
+        // Equivalent of update_deficit_graph, from the data in the "cola_data" store.
+        deficit_graph: function (campus, cost_of_living, data, degree, unit_mix, dollars) {
+            var campus_data = data.campuses[campus];
+            var real = dollars === "real";
+            var cost = data.years.map(function (year, i) {
+                var rent = 0;
+                campus_data.unit_rent.forEach(function (unit_rent, u) {
+                    rent += unit_mix.weights[u] * unit_rent[i] / unit_mix.occupants[u];
+                });
+                return rent / (cost_of_living / 100);
+            });
+
+            var traces = [];
+            data.disciplines.forEach(function (discipline) {
+                var stipend = campus_data.net_stipend[degree][discipline];
+                var x = [];
+                var y = [];
+                stipend.forEach(function (s, i) {
+                    if (s !== null) {
+                        x.push(data.years[i]);
+                        y.push((cost[i] - s) * (real ? campus_data.deflators[i] : 1));
+                    }
+                });
+                if (x.length) {
+                    traces.push({
+                        type: "scatter",
+                        x: x,
+                        y: y,
+                        name: discipline,
+                        mode: "markers+lines",
+                        marker: {symbol: 0, size: 10},
+                        line: {width: 5}
+                    });
+                }
+            });
+
+            return {
+                data: traces,
+                layout: {
+                    template: data.template,
+                    title: {
+                        text: "Cost of living deficit by discipline at UC " + campus +
+                            " for a " + cost_of_living + "% rent burden threshold"
+                    },
+                    xaxis: {title: {text: "Year"}},
+                    yaxis: {
+                        title: {
+                            text: "Cost-of-Living Deficit (" +
+                                (real ? data.real_dollars_label : "$") + "/month)"
+                        }
+                    },
+                    legend: {x: 0, y: -0.2, orientation: "h", title: {text: "Discipline"}}
+                }
+            };
+        },
+
+        // Unit weights, normalized to sum to one, and occupants from the unit mix
+        // inputs, see unit_mix_key in cola.py. Empty or negative weights count
+        // as zero, and if all weights are zero the previous weights are kept, as
+        // they are stored normalized. Empty or non-positive occupants keep their
+        // previous value.
+        unit_mix: function () {
+            var n = (arguments.length - 1) / 2;
+            var values = Array.prototype.slice.call(arguments);
+            var previous = values[2 * n];
+            var weights = values.slice(0, n).map(function (w) {
+                return (typeof w === "number" && w >= 0) ? w : 0;
+            });
+            var total = weights.reduce(function (a, b) { return a + b; }, 0);
+            weights = total > 0 ? weights.map(function (w) {
+                return w / total;
+            }) : previous.weights;
+            var occupants = values.slice(n, 2 * n).map(function (o, i) {
+                return (typeof o === "number" && o > 0) ? o : previous.occupants[i];
+            });
+            var unit_mix = {weights: weights, occupants: occupants};
+            if (JSON.stringify(unit_mix) === JSON.stringify(previous)) {
+                return window.dash_clientside.no_update;
+            }
+            return unit_mix;
+        },
+
+        // Inputs of a server callback if they differ from those of the output on
+        // display, which are passed last, see gated_callback in app.py.
+        changed_inputs: function () {
+            var inputs = Array.prototype.slice.call(arguments, 0, -1);
+            var previous = arguments[arguments.length - 1];
+            if (JSON.stringify(inputs) === JSON.stringify(previous)) {
+                // like raising PreventUpdate in a server callback, injected by
+                // dash-renderer (1.2.0 and later, with no_update) before calling
+                // clientside callbacks
+                throw window.dash_clientside.PreventUpdate;
+            }
+            return inputs;
+        }
+    }
+});
@@ -0,0 +1,379 @@
+"""
+Cache for figures returned by the Dash callbacks.
+
+Figures are stored as (compressed) JSON bytes, the form in which they are sent to
+the browser, rather than as pickled plotly Figure objects, which are larger and
+slow to unpickle and re-serialize.
+
+On a cache miss, concurrent requests for the same figure are coalesced, so the
+figure is only built once, in a ProcessPool, off the gevent loop of the gunicorn
+worker, or in-process.
+"""
+
+import hashlib
+import importlib
+import inspect
+import json
+import multiprocessing
+import os
+import threading
+import zlib
+
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import wraps
+
+from plotly.utils import PlotlyJSONEncoder
+
+from cola_colab.metrics import callback_metrics, phase
+
+
+class LRUCache:
+    """
+    Thread-safe in-process cache of bytes, evicting the least recently used
+    entries once the total size exceeds max_bytes.
+
+    Has the same get/set interface as a flask-caching Cache, so either can be used
+    as the backend of a FigureCache.
+    """
+
+    def __init__(self, max_bytes=64 * 1024**2):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        if len(value) > self.max_bytes:
+            return False
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= len(self._entries.pop(key))
+            self._entries[key] = value
+            self.current_bytes += len(value)
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted)
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+        return True
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TieredCache:
+    """
+    Two-tier cache, a small per-process cache (e.g. an LRUCache) in front of a
+    shared cache (e.g. a flask-caching Redis Cache), so that the most frequently
+    requested entries do not need a network round trip.
+    """
+
+    def __init__(self, l1, l2):
+        self.l1 = l1
+        self.l2 = l2
+        self.l1_hits = 0
+        self.l2_hits = 0
+
+    def get(self, key):
+        value = self.l1.get(key)
+        if value is not None:
+            self.l1_hits += 1
+            return value
+        value = self.l2.get(key)
+        if value is not None:
+            self.l2_hits += 1
+            self.l1.set(key, value)
+        return value
+
+    def set(self, key, value, timeout=None):
+        self.l1.set(key, value, timeout=timeout)
+        return self.l2.set(key, value, timeout=timeout)
+
+    def clear(self):
+        self.l1.clear()
+        return self.l2.clear()
+
+    def stats(self):
+        return {"l1_hits": self.l1_hits, "l2_hits": self.l2_hits}
+
+    def reset_stats(self):
+        self.l1_hits = 0
+        self.l2_hits = 0
+
+
+def dumps_figure(figure, compress=True):
+    data = json.dumps(figure, cls=PlotlyJSONEncoder).encode()
+    return zlib.compress(data) if compress else data
+
+
+def build_figure(module, name, args, kwargs, compress=True):
+    """
+    Build and serialize a figure, in a ProcessPool process. Memoized functions
+    are looked up by name, as they cannot be pickled themselves.
+
+    Returns:
+        (tuple) of the figure as bytes, see FigureCache.dumps, and the time spent
+            in each phase, for the metrics of the calling process
+    """
+    func = getattr(importlib.import_module(module), name)
+    func = getattr(func, "uncached", func)
+    callback_metrics.start(name)
+    with phase("figure"):
+        figure = func(*args, **kwargs)
+    with phase("serialize"):
+        data = dumps_figure(figure, compress)
+    return data, callback_metrics.stop()
+
+
+class ProcessPool:
+    """
+    Bounded pool of processes forked from the current one, so that they share its
+    (preloaded) data, see gunicorn.conf.py. The processes are started on first
+    use, and the pool is replaced if one of them dies, e.g. out of memory.
+    """
+
+    def __init__(self, max_workers, timeout=None):
+        """
+        Args:
+            max_workers (int): number of processes
+            timeout (float): seconds to wait for a result, waits forever if None
+        """
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def run(self, func, *args):
+        """
+        Call func(*args) in one of the processes, and wait for the result.
+        Waiting only blocks the calling greenlet (or thread).
+        """
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    self.max_workers, mp_context=multiprocessing.get_context("fork")
+                )
+                self._pid = os.getpid()
+            executor = self._executor
+        try:
+            return executor.submit(func, *args).result(self.timeout)
+        except BrokenProcessPool:
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            raise
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                # not wait=False, which leaves the queue management thread (a
+                # greenlet under gevent 1.4) on closed pipes, hanging the exit
+                self._executor.shutdown()
+            self._executor = None
+
+
+class FigureCache:
+    """
+    Memoizes functions returning plotly figures, storing the serialized figure.
+
+    Cache keys are made from the function name, the data version and the
+    normalized arguments, so that e.g. the order of selected job titles does not
+    matter. Since the data version is a hash of the data files, entries made with
+    out-of-date data are never returned once the data files change, and simply
+    expire or are evicted.
+    """
+
+    def __init__(self, backend, version="", compress=True, timeout=None, pool=None):
+        """
+        Args:
+            backend: LRUCache or flask-caching Cache instance to store bytes in
+            version (str or callable): data version, included in every key, or a
+                function returning it, called when the first key is made
+            compress (bool): whether to zlib-compress the JSON
+            timeout (int): passed on to the backend, in seconds
+            pool (ProcessPool): pool to build figures in, in-process if None
+        """
+        self.backend = backend
+        self._version = version
+        self.compress = compress
+        self.timeout = timeout
+        self.pool = pool
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        # futures of the figures being built, by key
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        if callable(self._version):
+            self._version = self._version()
+        return self._version
+
+    @staticmethod
+    def normalize_arguments(func, args, kwargs, unordered=()):
+        """
+        Bind the arguments of a call to func by name, with defaults, sorting and
+        deduplicating the lists in unordered. Both the key and the figure are
+        made from these, so that calls sharing a key make the same figure.
+
+        Returns:
+            (dict) arguments by name
+        """
+        bound = inspect.signature(func).bind(*args, **kwargs)
+        bound.apply_defaults()
+        return {
+            name: (
+                sorted(set(value))
+                if name in unordered and isinstance(value, (list, tuple))
+                else value
+            )
+            for name, value in bound.arguments.items()
+        }
+
+    def make_key(self, func, arguments):
+        """
+        Args:
+            func (callable): memoized function
+            arguments (dict): see normalize_arguments
+        """
+        digest = hashlib.sha1(
+            json.dumps(arguments, sort_keys=True, cls=PlotlyJSONEncoder).encode()
+        ).hexdigest()
+        return f"figure:{func.__name__}:{self.version}:{digest}"
+
+    def dumps(self, figure):
+        return dumps_figure(figure, self.compress)
+
+    def loads(self, data):
+        return json.loads(zlib.decompress(data) if self.compress else data)
+
+    def memoize(self, unordered=()):
+        """
+        Decorator, memoized functions return the figure as a dict. The figure as
+        JSON bytes, e.g. to send to the browser as is, is available from
+        `.json`, with the same arguments, and the undecorated function as
+        `.uncached`.
+
+        Args:
+            unordered (tuple): names of list arguments for which neither order
+                nor duplicates matter
+        """
+
+        def decorator(func):
+            def get(args, kwargs):
+                with phase("cache"):
+                    arguments = self.normalize_arguments(func, args, kwargs, unordered)
+                    key = self.make_key(func, arguments)
+                    data = self.backend.get(key)
+                if data is None:
+                    self.misses += 1
+                    return self.build(key, func, arguments)
+                self.hits += 1
+                return data
+
+            @wraps(func)
+            def memoized(*args, **kwargs):
+                data = get(args, kwargs)
+                with phase("serialize"):
+                    return self.loads(data)
+
+            @wraps(func)
+            def memoized_json(*args, **kwargs):
+                data = get(args, kwargs)
+                with phase("serialize"):
+                    return zlib.decompress(data) if self.compress else data
+
+            memoized.json = memoized_json
+            memoized.uncached = func
+            return memoized
+
+        return decorator
+
+    def build(self, key, func, arguments):
+        """
+        Build, serialize and store a figure, unless it is already being built, in
+        which case wait for that instead.
+
+        Args:
+            key (str): see make_key
+            func (callable): memoized function
+            arguments (dict): arguments of func by name, see normalize_arguments
+
+        Returns:
+            (bytes) see dumps
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is None:
+                future = self._in_flight[key] = Future()
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+        if not leader:
+            return future.result()
+
+        try:
+            if self.pool is None:
+                figure = func(**arguments)
+                with phase("serialize"):
+                    data = self.dumps(figure)
+            else:
+                data, phases = self.pool.run(
+                    build_figure,
+                    func.__module__,
+                    func.__name__,
+                    (),
+                    arguments,
+                    self.compress,
+                )
+                callback_metrics.add_phases(phases)
+            with phase("cache"):
+                self.backend.set(key, data, timeout=self.timeout)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(data)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+        return data
+
+    def stats(self):
+        """
+        Returns:
+            (dict) hit, miss and coalesced miss counts, since the start of this
+                process, including per-tier hits for a TieredCache backend
+        """
+        stats = {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced}
+        if hasattr(self.backend, "stats"):
+            stats.update(self.backend.stats())
+        return stats
+
+    def reset_stats(self):
+        """
+        Reset the counts, e.g. in a gunicorn worker, so that it does not report
+        those of the master warming up the cache.
+        """
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        if hasattr(self.backend, "reset_stats"):
+            self.backend.reset_stats()
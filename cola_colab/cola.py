@@ -0,0 +1,368 @@
+"""
+Cost-of-living calculations, per the equations in the whitepaper.
+
+These are vectorized over campuses, years and rent burden thresholds, and do not
+depend on the web app.
+"""
+
+import numpy as np
+import pandas as pd
+
+from functools import lru_cache
+from warnings import warn
+
+from cola_colab import data
+from cola_colab.data import (
+    CAMPUSES,
+    DATA_DIR,
+    DEGREES,
+    OCCUPANTS,
+    STIPEND_FILES,
+    UNITS,
+    UNIT_WEIGHTS,
+    hash_files,
+    is_up_to_date,
+    load,
+    read_only,
+    register,
+)
+
+_CAMPUS_INDEX = pd.Index(CAMPUSES)
+
+# rent burden thresholds offered in the app, in percent
+THRESHOLDS = np.arange(10, 95, 5)
+
+# pre-computed deficit table for every degree, campus, discipline, year and
+# threshold, for the default unit mix, built by `python -m cola_colab.ingest deficits`
+DEFICIT_TABLE_PATH = DATA_DIR / "cola_deficits.npz"
+
+# data files the deficit table is computed from, see cola_colab.data.is_up_to_date
+DEFICIT_TABLE_SOURCES = [
+    DATA_DIR / "hud_data.csv",
+    *(DATA_DIR / path for path in STIPEND_FILES.values()),
+]
+
+# number of distinct unit mixes to keep rents per person for
+RENT_CACHE_SIZE = 256
+
+
+def campus_indices(campus):
+    """
+    Convert campus name(s) to indices into CAMPUSES, preserving shape.
+    """
+    indices = _CAMPUS_INDEX.get_indexer(np.ravel(campus)).reshape(np.shape(campus))
+    if np.any(indices < 0):
+        raise KeyError(f"Unknown campus in {campus}")
+    return indices
+
+
+def year_indices(year):
+    """
+    Convert year(s) to indices into HUD_YEARS, preserving shape.
+    """
+    hud_years = data.HUD_YEARS
+    indices = np.asarray(year) - hud_years[0]
+    if np.any(indices < 0) or np.any(indices >= len(hud_years)):
+        raise KeyError(f"No HUD data for year in {year}")
+    return indices
+
+
+def unit_mix_key(unit_weights=UNIT_WEIGHTS, occupants=OCCUPANTS):
+    """
+    Normalize a unit mix, so that e.g. weights of (2, 2, 2, 2, 2) and
+    (1, 1, 1, 1, 1) are the same mix.
+
+    Args:
+        unit_weights (tuple): weight of each of UNITS in the average rent
+        occupants (tuple): number of people sharing each of UNITS
+
+    Returns:
+        (tuple) of weights summing to one, and of occupants, both as floats
+    """
+    weights = np.asarray(unit_weights, dtype=float)
+    occupants = np.asarray(occupants, dtype=float)
+    if weights.shape != (len(UNITS),) or occupants.shape != (len(UNITS),):
+        raise ValueError(f"Unit weights and occupants need a value for each of {UNITS}")
+    if np.any(weights < 0) or weights.sum() <= 0:
+        raise ValueError("Unit weights must be non-negative, and not all zero")
+    if np.any(occupants <= 0):
+        raise ValueError("Occupants must be positive")
+    weights = weights / weights.sum()
+    return tuple(np.round(weights, 12).tolist()), tuple(occupants.tolist())
+
+
+def get_rent_per_person(unit_weights=UNIT_WEIGHTS, occupants=OCCUPANTS):
+    """
+    Monthly HUD fair market rent per person, averaged over unit types.
+
+    Memoized by the normalized unit mix, see unit_mix_key, and computed as a
+    single dot product of the weights per occupant with the (campus, unit, year)
+    HUD_RENT array.
+
+    Args:
+        unit_weights (tuple): weight of each of UNITS in the average rent
+        occupants (tuple): number of people sharing each of UNITS
+
+    Returns:
+        (np.ndarray) read-only (campus, HUD year) rents
+    """
+    return _rent_per_person(*unit_mix_key(unit_weights, occupants))
+
+
+@lru_cache(maxsize=RENT_CACHE_SIZE)
+def _rent_per_person(unit_weights, occupants):
+    return read_only(get_rents_per_person([unit_weights], occupants)[0])
+
+
+def get_rents_per_person(unit_mixes, occupants=OCCUPANTS):
+    """
+    Monthly HUD fair market rent per person for any number of unit mixes, as a
+    single dot product of the (unit mix, unit) weights per occupant with the
+    HUD_RENT array. Not memoized, e.g. for sweeps over many unit mixes, which
+    would otherwise evict those in use by the app, see get_rent_per_person.
+
+    Args:
+        unit_mixes (list): weights of UNITS in the average rent, for each mix
+        occupants (tuple): number of people sharing each of UNITS
+
+    Returns:
+        (np.ndarray) (unit mix, campus, HUD year) rents
+    """
+    weights = np.array([unit_mix_key(w, occupants)[0] for w in unit_mixes])
+    weights = weights.reshape(-1, len(UNITS)) / np.asarray(occupants, dtype=float)
+    return np.tensordot(weights, data.HUD_RENT, axes=([1], [1]))
+
+
+def rent_to_cost_of_living(rent, percentage, campus, academic_year):
+    """
+    Cost of living from rents per person, see get_cost_of_living.
+
+    Args:
+        rent (np.ndarray): (..., campus, HUD year) monthly rents per person,
+            e.g. from get_rents_per_person, leading axes are kept
+        percentage (float): 0-100, or array of percentages, broadcast with
+            campus and academic_year
+        campus (str): campus, or array of campuses
+        academic_year (int): academic year, or array of years, rents are
+            averaged over the year and the next
+
+    Returns:
+        (np.ndarray) cost of living per month
+    """
+    c = campus_indices(campus)
+    y = year_indices(academic_year)
+    y_next = year_indices(np.asarray(academic_year) + 1)
+    average_rent = 0.5 * (rent[..., c, y] + rent[..., c, y_next])
+    return average_rent / (np.asarray(percentage) / 100)
+
+
+def get_cost_of_living(
+    percentage,
+    campus,
+    academic_year,
+    unit_weights=UNIT_WEIGHTS,
+    occupants=OCCUPANTS,
+):
+    """
+    Get an approximate cost of living figure in USD per equation in whitepaper.
+
+    All arguments can be scalars or arrays, and are broadcast together, so that
+    e.g. a column vector of percentages and a row of campuses and years gives
+    a (percentages, rows) array.
+
+    Args:
+        percentage (float): 0-100, or array of percentages
+        campus (str): Campus to look up rental data, or array of campuses
+        academic_year (int): Will average rental data for this year and the next, to be
+            consistent with academic years, or array of years
+        unit_weights (tuple): weight of each of UNITS in the average rent, by
+            default an equal mix
+        occupants (tuple): number of people sharing each of UNITS
+
+    Returns:
+        (np.ndarray) cost of living figure per month, of the broadcast shape of
+        the arguments, or a numpy float if they are all scalars
+    """
+    rent = get_rent_per_person(unit_weights, occupants)
+    return rent_to_cost_of_living(rent, percentage, campus, academic_year)
+
+
+def get_deflators(campus, year, academic_year=False):
+    """
+    Look up the factors converting nominal dollars to real dollars of
+    REAL_DOLLARS_YEAR, from the consumer price index of the campus area.
+
+    Args:
+        campus (str): campus, or array of campuses
+        year (int): year, or array of years, broadcast with campus
+        academic_year (bool): if the years are academic years, e.g. 2016 for
+            2016-2017, in which case the price index is averaged over both years
+
+    Returns:
+        (np.ndarray) deflators
+    """
+    deflators = load("ACADEMIC_DEFLATORS" if academic_year else "DEFLATORS")
+    return deflators[campus_indices(campus), year_indices(year)]
+
+
+def build_deficit_table(net_stipend=None, thresholds=THRESHOLDS):
+    """
+    Compute the cost-of-living deficit for every degree, campus, discipline,
+    academic year and rent burden threshold.
+
+    Args:
+        net_stipend (pd.DataFrame): annual net stipends indexed by "Degree",
+            "Campus", "Discipline" and "Year", defaults to NET_STIPEND. Stipends
+            not given for a campus (e.g. "Systemwide") are left out, as there is
+            no cost of living for them
+        thresholds (np.ndarray): rent burden thresholds, in percent
+
+    Returns:
+        (dict) of numpy arrays: "degrees", "campuses", "disciplines", "years" and
+            "thresholds" labelling the axes of "net_stipend" (degree, campus,
+            discipline, year) and "deficit" (degree, campus, discipline, year,
+            threshold), both monthly in USD and NaN where there is no stipend
+            data, and "cost_of_living" (campus, year, threshold)
+    """
+    if net_stipend is None:
+        net_stipend = data.NET_STIPEND
+    index = net_stipend.index
+    degrees = list(index.get_level_values("Degree").unique())
+    disciplines = list(index.get_level_values("Discipline").unique())
+    all_years = index.get_level_values("Year")
+    years = np.arange(all_years.min(), all_years.max() + 1)
+
+    campuses = _CAMPUS_INDEX.get_indexer(index.get_level_values("Campus"))
+    rows = campuses >= 0
+    monthly_stipend = np.full(
+        (len(degrees), len(CAMPUSES), len(disciplines), len(years)), np.nan
+    )
+    monthly_stipend[
+        pd.Index(degrees).get_indexer(index.get_level_values("Degree"))[rows],
+        campuses[rows],
+        pd.Index(disciplines).get_indexer(index.get_level_values("Discipline"))[rows],
+        (all_years - years[0])[rows],
+    ] = (
+        net_stipend["Net Stipend"].values[rows] / 12
+    )
+
+    cost_of_living = get_cost_of_living(
+        np.asarray(thresholds)[None, None, :],
+        np.array(CAMPUSES)[:, None, None],
+        years[None, :, None],
+    )
+
+    return {
+        "degrees": np.array(degrees, dtype=str),
+        "campuses": np.array(CAMPUSES, dtype=str),
+        "disciplines": np.array(disciplines, dtype=str),
+        "years": years,
+        "thresholds": np.asarray(thresholds),
+        "net_stipend": monthly_stipend,
+        "cost_of_living": cost_of_living,
+        "deficit": cost_of_living[None, :, None, :, :] - monthly_stipend[..., None],
+    }
+
+
+def save_deficit_table(table, path=DEFICIT_TABLE_PATH):
+    table = {**table, "source_hash": np.array(hash_files(DEFICIT_TABLE_SOURCES))}
+    np.savez_compressed(path, **table)
+
+
+def load_deficit_table(path=DEFICIT_TABLE_PATH):
+    with np.load(path) as npz:
+        return {key: npz[key] for key in npz.files}
+
+
+@register("DEFICIT_TABLE")
+def load_or_build_deficit_table():
+    if not DEFICIT_TABLE_PATH.is_file():
+        warn(
+            f"Deficit table not found in {DEFICIT_TABLE_PATH}, re-computing, "
+            f"build it with `python -m cola_colab.ingest deficits`"
+        )
+    else:
+        table = load_deficit_table()
+        if is_up_to_date(table, DEFICIT_TABLE_SOURCES):
+            return read_only(table)
+        warn(
+            f"Deficit table in {DEFICIT_TABLE_PATH} is out of date with the HUD or "
+            f"stipend data, re-computing, build it with "
+            f"`python -m cola_colab.ingest deficits`"
+        )
+    return read_only(build_deficit_table())
+
+
+def __getattr__(name):
+    # loaded on first access, see cola_colab.data.register
+    if name == "DEFICIT_TABLE":
+        return load(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_deficits(
+    campus,
+    cost_of_living_percent,
+    degree=DEGREES[0],
+    unit_weights=UNIT_WEIGHTS,
+    occupants=OCCUPANTS,
+):
+    """
+    Look up the monthly cost-of-living deficit for every discipline at a campus.
+
+    Args:
+        campus (str): campus
+        cost_of_living_percent (float): rent burden threshold, 0-100, if this is
+            not one of the pre-computed THRESHOLDS it is computed directly
+        degree (str): one of DEGREES
+        unit_weights (tuple): weight of each of UNITS in the average rent, if
+            this is not the default mix the deficits are computed directly
+        occupants (tuple): number of people sharing each of UNITS
+
+    Returns:
+        (np.ndarray) (discipline, year) deficits, labelled by DEFICIT_TABLE
+            "disciplines" and "years"
+    """
+    deficit_table = load("DEFICIT_TABLE")
+    g = list(deficit_table["degrees"]).index(degree)
+    c = int(campus_indices(campus))
+    thresholds = list(deficit_table["thresholds"])
+    is_default_mix = unit_mix_key(unit_weights, occupants) == unit_mix_key()
+    if cost_of_living_percent in thresholds and is_default_mix:
+        return deficit_table["deficit"][
+            g, c, :, :, thresholds.index(cost_of_living_percent)
+        ]
+    cost_of_living = get_cost_of_living(
+        cost_of_living_percent,
+        campus,
+        deficit_table["years"],
+        unit_weights,
+        occupants,
+    )
+    return cost_of_living[None, :] - deficit_table["net_stipend"][g, c]
+
+
+def get_net_stipend(campus, discipline, degree=DEGREES[0]):
+    """
+    Look up the monthly net stipend for a discipline at a campus.
+
+    Returns:
+        (tuple) of academic years and monthly net stipends, for years with data
+    """
+    deficit_table = load("DEFICIT_TABLE")
+    g = list(deficit_table["degrees"]).index(degree)
+    c = int(campus_indices(campus))
+    d = list(deficit_table["disciplines"]).index(discipline)
+    net_stipend = deficit_table["net_stipend"][g, c, d]
+    has_data = ~np.isnan(net_stipend)
+    return deficit_table["years"][has_data], net_stipend[has_data]
+
+
+def get_disciplines(degree=DEGREES[0]):
+    """
+    Disciplines with stipend data for a degree, at any campus.
+    """
+    deficit_table = load("DEFICIT_TABLE")
+    g = list(deficit_table["degrees"]).index(degree)
+    has_data = ~np.isnan(deficit_table["net_stipend"][g]).all(axis=(0, 2))
+    return deficit_table["disciplines"][has_data].tolist()
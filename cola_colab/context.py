@@ -0,0 +1,297 @@
+"""
+The annual cost of a COLA at each campus in the context of campus finances,
+per the "Understanding the impact of a COLA" section of the whitepaper.
+
+The cost of a COLA is the monthly cost-of-living deficit of each discipline,
+where positive, times its headcount, over the nine months of the academic
+year. Finances are the 2018-19 revenues, expenses and research awards of each
+campus. Everything shown is pre-computed into a small table with:
+
+    python -m cola_colab.ingest deficits
+
+so that drawing the panel is a lookup.
+"""
+
+import numpy as np
+import pandas as pd
+
+from warnings import warn
+
+from cola_colab.cola import (
+    DEFICIT_TABLE_SOURCES,
+    campus_indices,
+    get_deficits,
+    unit_mix_key,
+)
+from cola_colab.data import (
+    CAMPUSES,
+    DATA_DIR,
+    DEGREES,
+    OCCUPANTS,
+    UNIT_WEIGHTS,
+    hash_files,
+    is_up_to_date,
+    load,
+    read_only,
+    register,
+)
+from cola_colab.extract import MEASURE_CODES, SUPPORT_TABLE_PATH
+
+# fiscal year of the finance data, 2018-19, also the academic year the cost of a
+# COLA is computed for
+FINANCE_YEAR = 2018
+
+# finance data files, of each kind of figure, in thousands of dollars
+FINANCE_FILES = {
+    "Revenue": "uc_revenues_1819.csv",
+    "Expense": "uc_expenses_1819.csv",
+    "Research": "uc_research_1819.csv",
+}
+FINANCE_UNIT = 1000
+
+# stipend data covers the academic year, excluding the summer term
+MONTHS = 9
+
+# pre-computed context table, built by `python -m cola_colab.ingest deficits`
+CONTEXT_TABLE_PATH = DATA_DIR / "cola_context.npz"
+
+# data files the context table is computed from, see cola_colab.data.is_up_to_date
+CONTEXT_TABLE_SOURCES = [
+    *DEFICIT_TABLE_SOURCES,
+    *(DATA_DIR / path for path in FINANCE_FILES.values()),
+    SUPPORT_TABLE_PATH,
+]
+
+
+@register("FINANCES")
+def load_finances():
+    """
+    Returns:
+        (pd.DataFrame) finances of each campus in dollars, indexed by campus, with
+            (kind, category) columns, e.g. ("Expense", "Salaries and wages")
+    """
+    finances = pd.concat(
+        {
+            kind: pd.read_csv(DATA_DIR / path, index_col="UC").dropna(
+                how="all", axis="columns"
+            )
+            for kind, path in FINANCE_FILES.items()
+        },
+        axis=1,
+    )
+    return finances.loc[CAMPUSES] * FINANCE_UNIT
+
+
+def load_headcount(path=SUPPORT_TABLE_PATH):
+    """
+    Average enrollment (full year equivalent) of each degree, campus and
+    discipline in the latest year of the support tables, as extracted by
+    `python -m cola_colab.ingest support`.
+
+    Returns:
+        (pd.Series) headcount indexed by "Degree", "Campus" and "Discipline",
+            excluding the "Total" discipline, with the year in `.attrs["year"]`
+    """
+    df = pd.read_parquet(
+        path,
+        columns=["Year", "Campus", "Degree", "Discipline", "Measure", "Item", "Value"],
+    )
+    df = df[
+        df["Item"].str.startswith("Average Enrollment")
+        & (df["Measure"] == MEASURE_CODES["pc"])
+        & df["Degree"].isin(DEGREES)
+        & df["Campus"].isin(CAMPUSES)
+        & (df["Discipline"] != "Total")
+    ]
+    year = int(df["Year"].max())
+    df = df[df["Year"] == year]
+    headcount = df.groupby(["Degree", "Campus", "Discipline"])["Value"].sum()
+    headcount.attrs["year"] = year
+    return headcount
+
+
+def cola_cost(deficit, headcount, disciplines):
+    """
+    Annual cost of a COLA covering the cost-of-living deficit of every student.
+
+    Students in disciplines without stipend data at a campus are costed at the
+    deficit of the campus "Total", and there is no COLA where there is a surplus.
+
+    Args:
+        deficit (np.ndarray): (..., discipline, threshold) monthly deficits
+        headcount (np.ndarray): (..., discipline) headcounts, NaN where unknown
+        disciplines (list): discipline labels, including "Total"
+
+    Returns:
+        (np.ndarray) (..., threshold) annual cost, NaN where there is no headcount
+    """
+    total = list(disciplines).index("Total")
+    deficit = np.where(np.isnan(deficit), deficit[..., total : total + 1, :], deficit)
+    cost = MONTHS * np.nansum(headcount[..., None] * np.clip(deficit, 0, None), axis=-2)
+    cost[np.isnan(headcount).all(axis=-1)] = np.nan
+    return cost
+
+
+def uncosted_headcount(deficit, headcount, disciplines):
+    """
+    Headcount of students left out of the cost of a COLA, as neither their
+    discipline nor the campus "Total" has stipend data, see cola_cost.
+
+    Args:
+        deficit (np.ndarray): (..., discipline, threshold) monthly deficits
+        headcount (np.ndarray): (..., discipline) headcounts, NaN where unknown
+        disciplines (list): discipline labels, including "Total"
+
+    Returns:
+        (np.ndarray) (...) headcounts
+    """
+    total = list(disciplines).index("Total")
+    deficit = np.where(np.isnan(deficit), deficit[..., total : total + 1, :], deficit)
+    return np.nansum(np.where(np.isnan(deficit).all(axis=-1), headcount, 0), axis=-1)
+
+
+def build_context_table(deficit_table=None, headcount=None, finances=None):
+    """
+    Compute the annual cost of a COLA for every degree, campus and rent burden
+    threshold in FINANCE_YEAR, alongside the finances of each campus.
+
+    Args:
+        deficit_table (dict): see cola_colab.cola.build_deficit_table, defaults
+            to DEFICIT_TABLE
+        headcount (pd.Series): see load_headcount, which it defaults to if the
+            support tables have been extracted, otherwise costs are NaN
+        finances (pd.DataFrame): see load_finances, defaults to FINANCES
+
+    Returns:
+        (dict) of numpy arrays: "degrees", "campuses" and "thresholds" labelling
+            the axes of "cola_cost" (degree, campus, threshold) in dollars a
+            year, "headcount" (degree, campus, discipline) labelled by
+            "disciplines" and counted in "headcount_year", of which
+            "uncosted_headcount" (degree, campus) is left out, and "finances"
+            (campus, category) in dollars, labelled by "kinds" and "categories"
+    """
+    if deficit_table is None:
+        deficit_table = load("DEFICIT_TABLE")
+    if finances is None:
+        finances = load("FINANCES")
+    if headcount is None:
+        if SUPPORT_TABLE_PATH.is_file():
+            headcount = load_headcount()
+        else:
+            warn(
+                f"Support tables not found in {SUPPORT_TABLE_PATH}, the cost of a "
+                f"COLA needs their headcounts, extract them with "
+                f"`python -m cola_colab.ingest support`"
+            )
+            headcount = pd.Series([], dtype=float)
+
+    degrees = deficit_table["degrees"]
+    disciplines = deficit_table["disciplines"]
+    headcount_array = (
+        headcount.reindex(pd.MultiIndex.from_product([degrees, CAMPUSES, disciplines]))
+        .values.astype(float)
+        .reshape(len(degrees), len(CAMPUSES), len(disciplines))
+    )
+
+    y = list(deficit_table["years"]).index(FINANCE_YEAR)
+    deficit = deficit_table["deficit"][:, :, :, y, :]
+    return {
+        "degrees": np.asarray(degrees),
+        "campuses": np.array(CAMPUSES, dtype=str),
+        "thresholds": np.asarray(deficit_table["thresholds"]),
+        "disciplines": np.asarray(disciplines),
+        "headcount": headcount_array,
+        "headcount_year": np.array(headcount.attrs.get("year", -1)),
+        "cola_cost": cola_cost(deficit, headcount_array, disciplines),
+        "uncosted_headcount": uncosted_headcount(deficit, headcount_array, disciplines),
+        "kinds": np.array(finances.columns.get_level_values(0), dtype=str),
+        "categories": np.array(finances.columns.get_level_values(1), dtype=str),
+        "finances": finances.loc[CAMPUSES].values.astype(float),
+    }
+
+
+def save_context_table(table, path=CONTEXT_TABLE_PATH):
+    table = {**table, "source_hash": np.array(hash_files(CONTEXT_TABLE_SOURCES))}
+    np.savez_compressed(path, **table)
+
+
+def load_context_table(path=CONTEXT_TABLE_PATH):
+    with np.load(path) as npz:
+        return {key: npz[key] for key in npz.files}
+
+
+@register("CONTEXT_TABLE")
+def load_or_build_context_table():
+    if not CONTEXT_TABLE_PATH.is_file():
+        warn(
+            f"Context table not found in {CONTEXT_TABLE_PATH}, re-computing, "
+            f"build it with `python -m cola_colab.ingest deficits`"
+        )
+    else:
+        table = load_context_table()
+        if is_up_to_date(table, CONTEXT_TABLE_SOURCES):
+            return read_only(table)
+        warn(
+            f"Context table in {CONTEXT_TABLE_PATH} is out of date with the HUD, "
+            f"stipend, finance or support data, re-computing, build it with "
+            f"`python -m cola_colab.ingest deficits`"
+        )
+    return read_only(build_context_table())
+
+
+def __getattr__(name):
+    # loaded on first access, see cola_colab.data.register
+    if name in ("FINANCES", "CONTEXT_TABLE"):
+        return load(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_cola_costs(
+    campus, cost_of_living_percent, unit_weights=UNIT_WEIGHTS, occupants=OCCUPANTS
+):
+    """
+    Look up the annual cost of a COLA for every degree at a campus.
+
+    Args:
+        campus (str): campus
+        cost_of_living_percent (float): rent burden threshold, 0-100, if this is
+            not one of the pre-computed thresholds it is computed directly
+        unit_weights (tuple): weight of each of UNITS in the average rent, if
+            this is not the default mix the cost is computed directly
+        occupants (tuple): number of people sharing each of UNITS
+
+    Returns:
+        (np.ndarray) cost in dollars a year, labelled by CONTEXT_TABLE "degrees"
+    """
+    context_table = load("CONTEXT_TABLE")
+    c = int(campus_indices(campus))
+    thresholds = list(context_table["thresholds"])
+    is_default_mix = unit_mix_key(unit_weights, occupants) == unit_mix_key()
+    if cost_of_living_percent in thresholds and is_default_mix:
+        return context_table["cola_cost"][
+            :, c, thresholds.index(cost_of_living_percent)
+        ]
+    y = list(load("DEFICIT_TABLE")["years"]).index(FINANCE_YEAR)
+    deficit = np.stack(
+        [
+            get_deficits(
+                campus, cost_of_living_percent, degree, unit_weights, occupants
+            )[:, y, None]
+            for degree in context_table["degrees"]
+        ]
+    )
+    return cola_cost(
+        deficit, context_table["headcount"][:, c], context_table["disciplines"]
+    )[:, 0]
+
+
+def get_uncosted_headcount(campus):
+    """
+    Look up the headcount left out of the cost of a COLA for every degree at a
+    campus, see uncosted_headcount.
+
+    Returns:
+        (np.ndarray) headcount, labelled by CONTEXT_TABLE "degrees"
+    """
+    context_table = load("CONTEXT_TABLE")
+    return context_table["uncosted_headcount"][:, int(campus_indices(campus))]
@@ -1,12 +1,26 @@
+import hashlib
 import os
+import re
+import threading
 import pandas as pd
 import numpy as np
+import pyarrow.parquet as pq
 
 from warnings import warn
 from pathlib import Path
-from monty.serialization import loadfn, dumpfn
+from pandas.api.types import union_categoricals
 
-DATA_DIR = Path(__file__).parent.absolute() / "data"
+from cola_colab.stats import (
+    UC_WIDE,
+    build_salary_stats,
+    is_current_format,
+    load_salary_stats,
+)
+
+# can be overridden, e.g. to benchmark with synthetic data
+DATA_DIR = Path(
+    os.environ.get("COLA_DATA_DIR", Path(__file__).parent.absolute() / "data")
+)
 
 CAMPUSES = [
     "Berkeley",
@@ -21,96 +35,513 @@ CAMPUSES = [
     "Santa Cruz",
 ]
 
+# abbreviations of campus names, see match_campus
+CAMPUS_ALIASES = {
+    "ucb": "Berkeley",
+    "ucd": "Davis",
+    "uci": "Irvine",
+    "ucla": "Los Angeles",
+    "ucm": "Merced",
+    "ucr": "Riverside",
+    "ucsd": "San Diego",
+    "ucsf": "San Francisco",
+    "ucsb": "Santa Barbara",
+    "ucsc": "Santa Cruz",
+}
+
+
+def match_campus(name):
+    """
+    Match a campus name as found in source data or file names, e.g. "UC Berkeley",
+    "university-of-california-davis-2018.csv" or "UCLA", to one of CAMPUSES.
+
+    Returns:
+        (str) campus, or None if there is no match
+    """
+    key = re.sub(r"[^a-z]", "", str(name).lower())
+    if key in CAMPUS_ALIASES:
+        return CAMPUS_ALIASES[key]
+    for campus in CAMPUSES:
+        if campus.lower().replace(" ", "") in key:
+            return campus
+    return None
+
+
+# datasets are loaded on first access, as attributes of this module, rather than
+# at import, so that e.g. serving the whitepaper does not wait for salary data
+_LOADERS = {}
+_DATASETS = {}
+_LOCK = threading.RLock()
+
+
+def register(name):
+    """
+    Decorator registering a function that loads a dataset, which is then
+    available as `load(name)` or, for datasets registered in this module, as
+    `cola_colab.data.<name>`. The function is called at most once, on first
+    access, and its result is kept for the lifetime of the process.
+
+    Args:
+        name (str): dataset name
+    """
+
+    def decorator(func):
+        _LOADERS[name] = func
+        return func
+
+    return decorator
+
+
+def load(name):
+    """
+    Get a registered dataset, loading it if this is the first access.
+
+    Args:
+        name (str): dataset name
+
+    Returns:
+        the dataset
+    """
+    try:
+        return _DATASETS[name]
+    except KeyError:
+        pass
+    # datasets may load other datasets, hence the re-entrant lock
+    with _LOCK:
+        if name not in _DATASETS:
+            _DATASETS[name] = _LOADERS[name]()
+        return _DATASETS[name]
+
+
+def warm_up(names=None):
+    """
+    Load datasets ahead of the first request that needs them, e.g. in the gunicorn
+    master process so that they are shared with the workers, see gunicorn.conf.py.
+
+    Args:
+        names (list): datasets to load, defaults to all registered datasets
+    """
+    for name in names or list(_LOADERS):
+        load(name)
+
+
+def __getattr__(name):
+    if name in _LOADERS:
+        return load(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# specific column names to plot
+PAY_TYPES = ("Base Pay", "Total Pay", "Total Pay & Benefits")
 
-# UC-wide salary data from Transparent California
-if not (DATA_DIR / "uc_salary_cache.parquet").is_file():
+# salary data from Transparent California, partitioned by campus and year into
+# `Campus=<campus>/<year>.parquet` files, built offline by
+# `python -m cola_colab.ingest salaries`. Salaries that cannot be attributed to
+# a campus are stored under UC_WIDE
+SALARY_STORE = DATA_DIR / "uc_salary"
 
-    warn(f"Cached data not found, re-downloading. Looked in {DATA_DIR}")
 
-    # retrieve data for all years, and add additional column specifying year
-    dfs = {}
-    for year in range(2011, 2019):
-        dfs[year] = pd.read_csv(
-            f"https://transcal.s3.amazonaws.com/public/export/university-of-california-{year}.csv"
+def read_only(arrays):
+    """
+    Mark numpy arrays read-only, in place.
+
+    With gunicorn's preload_app (see gunicorn.conf.py) the data is loaded once in
+    the master process, and the memory holding it is shared with the forked
+    workers until it is written to, which would copy it into every worker. Data
+    held in numpy arrays rather than in many small Python objects, whose reference
+    counts are written on every access, stays shared, and making the arrays
+    read-only guards against accidental in-place changes.
+
+    Args:
+        arrays (np.ndarray, list or dict): array, or list or dict of arrays
+
+    Returns:
+        the arrays, for convenience
+    """
+    if isinstance(arrays, np.ndarray):
+        arrays.setflags(write=False)
+    else:
+        for array in arrays.values() if isinstance(arrays, dict) else arrays:
+            array.setflags(write=False)
+    return arrays
+
+
+def salary_store_partitions(store=SALARY_STORE, campuses=None, years=None):
+    """
+    Find the partitions of the salary store.
+
+    Args:
+        store (Path): salary store directory
+        campuses (list): campuses to include, defaults to all
+        years (list): years to include, defaults to all
+
+    Returns:
+        (list) of (campus, year, path) tuples
+    """
+    partitions = []
+    for directory in sorted(Path(store).glob("Campus=*")):
+        campus = directory.name.split("=", 1)[1]
+        if campuses is not None and campus not in campuses:
+            continue
+        for path in sorted(directory.glob("*.parquet")):
+            year = int(path.stem)
+            if years is None or year in years:
+                partitions.append((campus, year, path))
+    return partitions
+
+
+def _job_title_row_groups(parquet_file, job_titles):
+    """
+    Indices of the row groups that may contain any of job_titles, from the
+    min/max statistics of the "Job Title" column. Partitions are sorted by job
+    title at ingest, so each job title is in one or a few row groups.
+    """
+    metadata = parquet_file.metadata
+    row_groups = []
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        for j in range(row_group.num_columns):
+            column = row_group.column(j)
+            if column.path_in_schema != "Job Title":
+                continue
+            statistics = column.statistics
+            if statistics is None or not statistics.has_min_max:
+                row_groups.append(i)
+            elif any(statistics.min <= title <= statistics.max for title in job_titles):
+                row_groups.append(i)
+    return row_groups
+
+
+def read_salary_store(store=SALARY_STORE, campuses=None, years=None, job_titles=None):
+    """
+    Read (part of) the salary store, see `cola_colab.ingest`, only reading the
+    partitions and row groups needed for the given campuses, years and job titles.
+
+    Job titles and campuses are read back as categoricals, pay columns are stored
+    as float32 and the year as int16 to reduce memory usage.
+
+    Args:
+        store (Path): salary store directory
+        campuses (list): campuses to read, defaults to all
+        years (list): years to read, defaults to all
+        job_titles (list): job titles to read, defaults to all
+
+    Returns:
+        (pd.DataFrame) with "Campus", "Job Title", "Year" and pay type columns
+    """
+    parts = []
+    for campus, year, path in salary_store_partitions(store, campuses, years):
+        parquet_file = pq.ParquetFile(
+            str(path), memory_map=True, read_dictionary=["Job Title"]
+        )
+        if job_titles is None:
+            part = parquet_file.read().to_pandas()
+        else:
+            row_groups = _job_title_row_groups(parquet_file, job_titles)
+            if not row_groups:
+                continue
+            part = parquet_file.read_row_groups(row_groups).to_pandas()
+            part = part[part["Job Title"].isin(job_titles)]
+        parts.append((campus, part))
+
+    if not parts:
+        return pd.DataFrame(
+            {
+                "Campus": pd.Categorical([], categories=[UC_WIDE, *CAMPUSES]),
+                "Job Title": pd.Categorical([]),
+                **{pay_type: np.array([], dtype=np.float32) for pay_type in PAY_TYPES},
+                "Year": np.array([], dtype=np.int16),
+            }
+        )
+
+    # categories differ between partitions, so are combined explicitly rather
+    # than falling back to an object column
+    job_title = union_categoricals([part["Job Title"] for _, part in parts])
+    df = pd.concat(
+        [part.drop(columns=["Job Title"]) for _, part in parts], ignore_index=True
+    )
+    df.insert(0, "Job Title", job_title)
+    df.insert(
+        0,
+        "Campus",
+        pd.Categorical(
+            np.repeat(
+                [campus for campus, _ in parts], [len(part) for _, part in parts]
+            ),
+            categories=[UC_WIDE, *CAMPUSES],
+        ),
+    )
+    return df
+
+
+@register("UC_WIDE_SALARY_DF")
+def load_uc_wide_salary_df():
+    if not salary_store_partitions():
+        warn(
+            f"Salary store not found in {SALARY_STORE}, "
+            f"build it with `python -m cola_colab.ingest salaries`"
         )
-        dfs[year]["Year"] = year
+    return read_salary_store()
+
+
+# see most common job titles
+cutoff = 1024  # individuals
 
-    # join individal dataframes into one master dataframe
-    UC_WIDE_SALARY_DF = pd.concat(dfs.values())
 
-    # exclude named employees (anyone with student status has their name redacted)
-    # note that the inverse is not necessarily true: a redacted name does not imply student
-    UC_WIDE_SALARY_DF = UC_WIDE_SALARY_DF[
-        UC_WIDE_SALARY_DF["Employee Name"] == "Not provided"
+def most_common_jobs(df, cutoff=cutoff):
+    return [
+        job_name
+        for job_name, job_count in dict(df["Job Title"].value_counts()).items()
+        if job_count > cutoff
     ]
-    UC_WIDE_SALARY_DF.reset_index(drop=True, inplace=True)
 
-    # prune columns to reduce memory usage
-    UC_WIDE_SALARY_DF = UC_WIDE_SALARY_DF.drop(
+
+# pre-aggregated salary statistics for the most common job titles, also built by
+# `python -m cola_colab.ingest salaries`, see `cola_colab.stats`
+SALARY_STATS_PATH = DATA_DIR / "uc_salary_stats.npz"
+
+
+def salary_store_files(store=SALARY_STORE):
+    """
+    Partition files of the salary store, the sources of the salary statistics,
+    see is_up_to_date.
+    """
+    return [path for _, _, path in salary_store_partitions(store)]
+
+
+@register("SALARY_STATS")
+def load_salary_stats_cube():
+    if not SALARY_STATS_PATH.is_file():
+        warn(
+            f"Salary statistics not found in {SALARY_STATS_PATH}, re-computing, "
+            f"build them with `python -m cola_colab.ingest stats`"
+        )
+    else:
+        stats = load_salary_stats(SALARY_STATS_PATH)
+        # the statistics are also deployed without the store, which is then
+        # assumed to be the one they were built from
+        store_files = salary_store_files()
+        if not is_current_format(stats):
+            warn(
+                f"Salary statistics in {SALARY_STATS_PATH} are in an older format, "
+                f"re-computing, build them with `python -m cola_colab.ingest stats`"
+            )
+        elif not store_files or is_up_to_date(stats, store_files, SALARY_STORE):
+            return read_only(stats)
+        else:
+            warn(
+                f"Salary statistics in {SALARY_STATS_PATH} are out of date with the "
+                f"salary store, re-computing, build them with "
+                f"`python -m cola_colab.ingest stats`"
+            )
+    df = load("UC_WIDE_SALARY_DF")
+    stats = build_salary_stats(df, most_common_jobs(df), PAY_TYPES)
+    return read_only(stats)
+
+
+@register("MOST_COMMON_JOBS")
+def load_most_common_jobs():
+    return list(load("SALARY_STATS")["job_titles"])
+
+
+# HUD unit types, the number of people assumed to share each, and the weight of
+# each in the average rent, by default an equal mix as in the whitepaper, see
+# cola_colab.cola.get_rent_per_person
+UNITS = ("Efficiency", "1 br", "2 br", "3 br", "4 br")
+OCCUPANTS = (1, 1, 2, 3, 4)
+UNIT_WEIGHTS = (1, 1, 1, 1, 1)
+
+
+@register("HUD")
+def load_hud():
+    # HUD rental market data
+    hud = pd.read_csv(DATA_DIR / "hud_data.csv")
+    # remove empty columns (excel artefact)
+    hud = hud.dropna(how="all")
+    hud = hud.dropna(how="all", axis="columns")
+    return hud.set_index(["UC", "Unit type"])
+
+
+@register("SURVEY")
+def load_survey():
+    # UCOP survey of rent costs (2017)
+    survey = pd.read_csv(DATA_DIR / "ucopsurvey_data.csv")
+    survey = survey.dropna(how="all")
+    survey = survey.dropna(how="all", axis="columns")
+    return survey.set_index("UC")
+
+
+# HUD fair market rents as a (campus, unit, year) array for vectorized lookups
+@register("HUD_YEARS")
+def load_hud_years():
+    columns = load("HUD").columns
+    return read_only(
+        np.array([int(col.split()[0]) for col in columns if col.endswith("FMR")])
+    )
+
+
+@register("HUD_RENT")
+def load_hud_rent():
+    years = load("HUD_YEARS")
+    rent = (
+        load("HUD")
+        .loc[pd.MultiIndex.from_product([CAMPUSES, UNITS]), [f"{y} FMR" for y in years]]
+        .values.astype(float)
+        .reshape(len(CAMPUSES), len(UNITS), len(years))
+    )
+    return read_only(rent)
+
+
+# BLS consumer price index for all urban consumers (CPI-U, 1982-84=100), annual
+# averages, with a column for each area. Campuses use the index of their metro
+# area if it has a column, and the U.S. city average otherwise, as for Davis,
+# Merced, Santa Barbara and Santa Cruz, which are in no published area.
+# Riverside-San Bernardino-Ontario is only published from 2018 (December
+# 2017=100), so earlier years are those of Los Angeles-Riverside-Orange County,
+# which it was part of, and later years are linked to them at December 2017.
+# San Diego-Carlsbad is published semiannually, its annual averages are those of
+# the semiannual series
+CPI_NATIONAL = "U.S. city average"
+CPI_AREAS = {
+    "Berkeley": "San Francisco-Oakland-Hayward",
+    "San Francisco": "San Francisco-Oakland-Hayward",
+    "Los Angeles": "Los Angeles-Long Beach-Anaheim",
+    "Irvine": "Los Angeles-Long Beach-Anaheim",
+    "Riverside": "Riverside-San Bernardino-Ontario",
+    "San Diego": "San Diego-Carlsbad",
+}
+
+
+@register("CPI_AREA")
+def load_cpi_area():
+    # area of the price index used for each of CAMPUSES
+    columns = pd.read_csv(DATA_DIR / "cpi_u.csv", nrows=0).columns
+    return tuple(
+        CPI_AREAS[campus] if CPI_AREAS.get(campus) in columns else CPI_NATIONAL
+        for campus in CAMPUSES
+    )
+
+
+@register("CPI")
+def load_cpi():
+    cpi = pd.read_csv(DATA_DIR / "cpi_u.csv").set_index("Year").sort_index()
+    # one column per campus, with a row for every HUD year (NaN if missing)
+    return (
+        cpi[list(load("CPI_AREA"))]
+        .set_axis(CAMPUSES, axis="columns")
+        .reindex(load("HUD_YEARS"))
+    )
+
+
+@register("REAL_DOLLARS_YEAR")
+def load_real_dollars_year():
+    # real dollars are dollars of the latest year with a price index
+    return int(load("CPI").dropna().index[-1])
+
+
+# deflators from nominal to real dollars as (campus, year) arrays aligned with
+# HUD_RENT, so that real dollars are a single multiply
+@register("DEFLATORS")
+def load_deflators():
+    cpi = load("CPI").values.T
+    base = load("CPI").loc[load("REAL_DOLLARS_YEAR")].values[:, None]
+    return read_only(base / cpi)
+
+
+@register("ACADEMIC_DEFLATORS")
+def load_academic_deflators():
+    # by academic year, e.g. 2016 for 2016-2017, from the average price index of
+    # both years, like rents in cola_colab.cola.get_cost_of_living. NaN for the
+    # latest year
+    cpi = load("CPI").values.T
+    base = load("CPI").loc[load("REAL_DOLLARS_YEAR")].values[:, None]
+    academic_cpi = np.full_like(cpi, np.nan)
+    academic_cpi[:, :-1] = 0.5 * (cpi[:, :-1] + cpi[:, 1:])
+    return read_only(base / academic_cpi)
+
+
+# degrees with stipend data, and their stipend data files
+DEGREES = ("PhD", "Masters")
+STIPEND_FILES = {
+    "PhD": "uc_net_stipend_per_capita_by_discipline_manual_phd.csv",
+    "Masters": "uc_net_stipend_per_capita_by_discipline_manual_masters.csv",
+}
+
+# campus label of stipends given for the UC system as a whole (Masters only)
+SYSTEMWIDE = "Systemwide"
+
+
+@register("NET_STIPEND")
+def load_net_stipend():
+    """
+    Annual net stipends of all degrees in a single table, with a sorted
+    ("Degree", "Campus", "Discipline", "Year") index so that e.g.
+    `NET_STIPEND.loc[("PhD", "Berkeley")]` is a lookup rather than a scan.
+    """
+    net_stipend = pd.concat(
         [
-            "Employee Name",
-            "Notes",
-            "Agency",
-            "Status",
-            "Other Pay",
-            "Overtime Pay",
-            "Benefits",
+            pd.read_csv(DATA_DIR / STIPEND_FILES[degree]).assign(Degree=degree)
+            for degree in DEGREES
         ],
-        axis=1,
+        ignore_index=True,
+    )
+    net_stipend = net_stipend.drop(["Source"], axis=1)
+    # categoricals hold a few distinct strings rather than one Python object per
+    # row, and keep the order of degrees, campuses and disciplines
+    net_stipend = net_stipend.astype(
+        {
+            "Degree": pd.CategoricalDtype(DEGREES),
+            "Campus": pd.CategoricalDtype([*CAMPUSES, SYSTEMWIDE]),
+            "Discipline": pd.CategoricalDtype(list(net_stipend["Discipline"].unique())),
+        }
     )
+    return net_stipend.set_index(
+        ["Degree", "Campus", "Discipline", "Year"]
+    ).sort_index()
 
-    UC_WIDE_SALARY_DF.to_json(DATA_DIR / "uc_salary_cache.json.gz")
-
-else:
-
-    # specify dtypes to reduce memory usage
-    # UC_WIDE_SALARY_DF = pd.read_json(
-    #     DATA_DIR / "uc_salary_cache.json.gz",
-    #     convert_axes=True,
-    #     dtype={
-    #         "Job Title": "category",
-    #         "Year": "category",
-    #         "Base Pay": np.float32,
-    #         "Overtime Pay": np.float32,
-    #         "Other Pay": np.float32,
-    #         "Benefits": np.float32,
-    #         "Total Pay": np.float32,
-    #         "Total Pay & Benefits": np.float32,
-    #     },
-    # )
-    UC_WIDE_SALARY_DF = pd.read_parquet(DATA_DIR / "uc_salary_cache.parquet")
 
-# see most common job titles
-cutoff = 1024  # individuals
-MOST_COMMON_JOBS = [
-    job_name
-    for job_name, job_count in dict(
-        UC_WIDE_SALARY_DF["Job Title"].value_counts()
-    ).items()
-    if job_count > cutoff
-]
+@register("DISCIPLINES")
+def load_disciplines():
+    return tuple(load("NET_STIPEND").index.get_level_values("Discipline").categories)
 
-# specific column names to plot
-PAY_TYPES = ("Base Pay", "Total Pay", "Total Pay & Benefits")
 
+def hash_files(paths, root=DATA_DIR):
+    """
+    Short hash of the names, relative to root, and contents of files, skipping
+    any that do not exist.
+    """
+    sha1 = hashlib.sha1()
+    for path in sorted(Path(path) for path in paths):
+        if path.is_file():
+            sha1.update(os.path.relpath(path, root).encode())
+            sha1.update(path.read_bytes())
+    return sha1.hexdigest()[:12]
 
-# HUD rental market data
-HUD = pd.read_csv(DATA_DIR / "hud_data.csv")
-# remove empty columns (excel artefact)
-HUD = HUD.dropna(how="all")
-HUD = HUD.dropna(how="all", axis="columns")
 
-# UCOP survey of rent costs (2017)
-SURVEY = pd.read_csv(DATA_DIR / "ucopsurvey_data.csv")
-SURVEY = SURVEY.dropna(how="all")
-SURVEY = SURVEY.dropna(how="all", axis="columns")
+def is_up_to_date(table, sources, root=DATA_DIR):
+    """
+    Whether a pre-computed table, e.g. the deficit table, was built from the
+    current contents of its source files, as recorded in its "source_hash" when
+    it was saved, see hash_files.
+    """
+    return "source_hash" in table and str(table["source_hash"]) == hash_files(
+        sources, root
+    )
 
-# re-index the dataframes
-HUD = HUD.set_index(["UC", "Unit type"])
-SURVEY = SURVEY.set_index("UC")
 
-NET_STIPEND = pd.read_csv(
-    DATA_DIR / "uc_net_stipend_per_capita_by_discipline_manual_phd.csv"
-)
-NET_STIPEND = NET_STIPEND.drop(["Source"], axis=1)
-DISCIPLINES = tuple(NET_STIPEND["Discipline"].unique())
+def get_data_version(data_dir=DATA_DIR):
+    """
+    Short hash of the contents of all data files, excluding the raw data, which
+    changes whenever any data shown in the app changes.
+    """
+    return hash_files(
+        (
+            path
+            for path in Path(data_dir).rglob("*")
+            if path.relative_to(data_dir).parts[0] != "raw_data"
+        ),
+        data_dir,
+    )
+
+
+register("DATA_VERSION")(get_data_version)
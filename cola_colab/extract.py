@@ -0,0 +1,503 @@
+"""
+Extraction of the UCOP "Graduate Student Financial Support" tables, in
+`cola_colab/data/raw_data/graduate_student_support_tabels/`, into a single long
+table with one row per year, campus, degree, discipline, measure and line item.
+
+The raw tables are one file per academic year, degree (academic doctoral,
+academic masters, professional, all academic) and measure (per capita or total
+dollars), with one page (PDF, until 2006-07) or sheet (Excel, from 2007-08) per
+campus. Files are parsed in parallel, across a process pool, and the parsed
+table of each file is cached under a hash of its content, so that re-running
+the extraction only parses new or changed files:
+
+    python -m cola_colab.ingest support
+
+Parsing the PDF files needs pdfplumber, and the Excel files xlrd (.xls) and
+openpyxl (.xlsx), none of which the app itself needs.
+"""
+
+import hashlib
+import re
+
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor
+from difflib import get_close_matches
+from pathlib import Path
+
+from cola_colab.data import CAMPUSES, DATA_DIR, SYSTEMWIDE, match_campus
+
+SUPPORT_TABLES_DIR = DATA_DIR / "raw_data" / "graduate_student_support_tabels"
+SUPPORT_TABLE_PATH = DATA_DIR / "uc_graduate_support.parquet"
+SUPPORT_CACHE_DIR = DATA_DIR / "uc_graduate_support_cache"
+
+# part of every cache key, increment when a change to the parsers changes output
+PARSER_VERSION = 1
+
+# net stipends, in the format of the manual net stipend files, by degree
+NET_STIPEND_PATHS = {
+    "PhD": DATA_DIR / "uc_net_stipend_per_capita_by_discipline_extracted_phd.csv",
+    "Masters": DATA_DIR
+    / "uc_net_stipend_per_capita_by_discipline_extracted_masters.csv",
+}
+
+COLUMNS = ["Year", "Campus", "Degree", "Discipline", "Measure", "Item", "Value"]
+
+# degree and measure codes in the file names, e.g. gradsupport_0506_pc_phd.pdf
+# or (2014-15 only) gradsupport_1415_AcadPhd_PC.xlsx
+DEGREE_CODES = {
+    "phd": "PhD",
+    "acadphd": "PhD",
+    "ma": "Masters",
+    "acadmas": "Masters",
+    "prof": "Professional",
+    "allacad": "All Academic",
+    "acadall": "All Academic",
+}
+MEASURE_CODES = {"pc": "Per Capita", "td": "Total Dollars"}
+
+# discipline names as in the manual net stipend files, matched against the
+# start of the (lower case) column headers, which vary from year to year
+DISCIPLINE_NAMES = [
+    (r"engineering", "Engineering & CS"),
+    (r"fine", "Fine Arts"),
+    (r"health", "Health Sciences"),
+    (r"human", "Humanities"),
+    (r"joint", "Joint/Unknown"),
+    (r"life", "Life Sciences"),
+    (r"other health", "Other Health Sciences"),
+    (r"other no fee", "Other No Fee Professional Programs"),
+    (r"other professional fee", "Other Professional Fee Programs"),
+    (r"other", "Other"),
+    (r"physical", "Physical Sciences"),
+    (r"professional school", "Professional"),
+    (r"social", "Social Sciences"),
+    (r"teacher", "Teacher Credential"),
+    (r"total", "Total"),
+]
+
+# header lines spanning all columns, rather than naming one
+SPANNING_HEADERS = re.compile(r"degree programs$", re.IGNORECASE)
+
+# a dollar amount or count, e.g. "1,415", "$17,144", "-$7,413" or "($7,413)"
+NUMBER = re.compile(r"^(\()?(-)?\$?(-)?(\d[\d,]*(\.\d+)?)\)?$")
+
+
+def parse_file_name(path):
+    """
+    Args:
+        path (Path): raw support table, e.g. gradsupport_0506_pc_phd.pdf
+
+    Returns:
+        (tuple) year, i.e. the first calendar year of the academic year, degree
+            and measure
+    """
+    match = re.match(
+        r"gradsupport_(\d{2})(\d{2})_([a-z]+)_([a-z]+)$", path.stem.lower()
+    )
+    if not match:
+        raise ValueError(f"Unexpected support table file name {path.name}")
+    year, _, first, second = match.groups()
+    year = int(year) + (1900 if int(year) > 50 else 2000)
+    if first in MEASURE_CODES:
+        measure, degree = first, second
+    else:
+        degree, measure = first, second
+    return year, DEGREE_CODES[degree], MEASURE_CODES[measure]
+
+
+def clean_label(text):
+    """
+    Collapse whitespace and drop footnote markers, e.g. "Net Stipend***" or
+    "Medicine1", from a row label or column header.
+    """
+    text = " ".join(str(text).split())
+    return re.sub(r"(?<=[A-Za-z)])(\*+|\d)$", "", text).strip()
+
+
+def match_discipline(header):
+    """
+    Args:
+        header (str): column header, e.g. "Engineering/\\nComp. Sci."
+
+    Returns:
+        (str) discipline name, or the cleaned header if it is not a known one
+    """
+    header = clean_label(header)
+    for pattern, name in DISCIPLINE_NAMES:
+        if re.match(pattern, header.lower()):
+            return name
+    return header
+
+
+def parse_number(text):
+    """
+    Returns:
+        (float) value of a number as formatted in the tables, or None
+    """
+    if isinstance(text, (int, float, np.number)):
+        return None if pd.isnull(text) else float(text)
+    match = NUMBER.match(str(text).strip())
+    if not match:
+        return None
+    parenthesis, minus, inner_minus, digits, _ = match.groups()
+    value = float(digits.replace(",", ""))
+    return -value if (parenthesis or minus or inner_minus) else value
+
+
+def _campus_name(title):
+    # e.g. "... Doctoral Students - Los Angeles" -> "los angeles"
+    name = re.split(r"students", title, flags=re.IGNORECASE)[-1]
+    return " ".join(re.sub(r"[^a-z]", " ", name.lower()).split())
+
+
+def _names_campus(title):
+    return _campus_name(title) in [name.lower() for name in [SYSTEMWIDE, *CAMPUSES]]
+
+
+def match_table_campus(title):
+    """
+    The campus of a table, named at the end of its title, e.g. "Per Capita Support
+    of Academic Doctoral Students - Berkeley", allowing for typos.
+
+    Returns:
+        (str) one of CAMPUSES, or SYSTEMWIDE
+    """
+    names = {name.lower(): name for name in [SYSTEMWIDE, *CAMPUSES]}
+    match = get_close_matches(_campus_name(title), names, n=1)
+    if match:
+        return names[match[0]]
+    return match_campus(title) or SYSTEMWIDE
+
+
+def match_table_measure(title, default):
+    """
+    The measure as stated in the title of a table, which takes precedence over
+    the file name (some files are misnamed), or else the default.
+    """
+    title = title.lower()
+    if "per capita" in title:
+        return MEASURE_CODES["pc"]
+    if "total dollar" in title:
+        return MEASURE_CODES["td"]
+    return default
+
+
+def _pdf_lines(page, tolerance=3):
+    """
+    Words on a PDF page grouped into lines, top to bottom, each line a list of
+    pdfplumber word dicts from left to right.
+    """
+    lines = []
+    for word in sorted(page.extract_words(), key=lambda word: word["top"]):
+        if lines and abs(word["top"] - lines[-1][0]["top"]) <= tolerance:
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+    return [sorted(line, key=lambda word: word["x0"]) for line in lines]
+
+
+def _phrases(line, gap=5):
+    """
+    Join the words of a line that are no more than gap apart, e.g. "Other" and
+    "Health" of a column header, into a single word dict.
+    """
+    phrases = []
+    for word in line:
+        if phrases and word["x0"] - phrases[-1]["x1"] <= gap:
+            phrases[-1] = dict(
+                text=f"{phrases[-1]['text']} {word['text']}",
+                x0=phrases[-1]["x0"],
+                x1=word["x1"],
+            )
+        else:
+            phrases.append(dict(text=word["text"], x0=word["x0"], x1=word["x1"]))
+    return phrases
+
+
+def _line_text(line):
+    return " ".join(word["text"] for word in line)
+
+
+def parse_pdf_page(page):
+    """
+    Parse one page, i.e. the table of one campus, of a PDF support table.
+
+    The columns are located from the rows with a value in every column (counts
+    and dollar amounts are not always aligned alike), the values of other rows
+    and the (wrapped, multi-line) column headers are then assigned to a column
+    by their position.
+
+    Returns:
+        (tuple) title text, and list of (discipline, item, value) tuples, both
+            empty if the page has no table
+    """
+    lines = _pdf_lines(page)
+    rows = []
+    for i, line in enumerate(lines):
+        values = [word for word in line if parse_number(word["text"]) is not None]
+        # a value row has a label followed by numbers, and perhaps errors such
+        # as "#VALUE!" in place of some
+        if values and line[-1] in values and line[0] not in values:
+            if re.match(r"page \d+$", _line_text(line), re.IGNORECASE):
+                continue
+            label = [word["text"] for word in line[: line.index(values[0])]]
+            rows.append((i, clean_label(" ".join(label)), values))
+            # the net stipend is the last row, followed only by footnotes
+            if rows[-1][1] == "Net Stipend":
+                break
+    first = rows[0][0] if rows else 0
+
+    # the title ends with the line naming the students and campus, which may
+    # wrap onto the next line, e.g. "... Students - San" "Francisco"
+    title_end = max(
+        [
+            i + 1
+            for i, line in enumerate(lines[:first])
+            if "students" in _line_text(line).lower()
+        ],
+        default=0,
+    )
+    if not title_end:
+        return "", []
+    title = " ".join(_line_text(line) for line in lines[:title_end])
+    if not _names_campus(title) and title_end < first:
+        wrapped = f"{title} {_line_text(lines[title_end])}"
+        if _names_campus(wrapped):
+            title, title_end = wrapped, title_end + 1
+
+    columns = max(len(values) for _, _, values in rows)
+    full = [values for _, _, values in rows if len(values) == columns]
+    lefts = np.min([[word["x0"] for word in values] for values in full], axis=0)
+    rights = np.max([[word["x1"] for word in values] for values in full], axis=0)
+    boundaries = (rights[:-1] + lefts[1:]) / 2
+
+    def column(word):
+        return np.searchsorted(boundaries, (word["x0"] + word["x1"]) / 2)
+
+    # the header of the row labels, e.g. "Program", starts at their margin
+    margin = min(lines[i][0]["x0"] for i, _, _ in rows) + 5
+    headers = [[] for _ in range(columns)]
+    for line in lines[title_end:first]:
+        if SPANNING_HEADERS.search(_line_text(line)):
+            continue
+        for phrase in _phrases(line):
+            if phrase["x0"] > margin:
+                headers[column(phrase)].append(phrase["text"])
+    disciplines = [match_discipline(" ".join(words)) for words in headers]
+
+    records = []
+    for _, item, values in rows:
+        for i, word in enumerate(values):
+            discipline = disciplines[i if len(values) == columns else column(word)]
+            records.append((discipline, item, parse_number(word["text"])))
+    return title, records
+
+
+def parse_pdf(path):
+    """
+    Args:
+        path (Path): PDF support table
+
+    Returns:
+        (list) (campus, measure, discipline, item, value) tuples
+    """
+    try:
+        import pdfplumber
+    except ImportError:
+        raise ImportError("Parsing PDF support tables needs pdfplumber") from None
+
+    _, _, default_measure = parse_file_name(path)
+    records = []
+    with pdfplumber.open(str(path)) as pdf:
+        for page in pdf.pages:
+            title, page_records = parse_pdf_page(page)
+            campus = match_table_campus(title)
+            measure = match_table_measure(title, default_measure)
+            records += [(campus, measure, *record) for record in page_records]
+    return records
+
+
+def parse_excel(path):
+    """
+    Args:
+        path (Path): Excel support table, with one sheet per campus
+
+    Returns:
+        (list) (campus, measure, discipline, item, value) tuples
+    """
+    try:
+        sheets = pd.read_excel(path, sheet_name=None, header=None)
+    except ImportError:
+        raise ImportError(
+            "Parsing Excel support tables needs xlrd (.xls) and openpyxl (.xlsx)"
+        ) from None
+
+    _, _, default_measure = parse_file_name(path)
+    records = []
+    for sheet_name, sheet in sheets.items():
+        cells = sheet.values
+        # the header row labels the first column e.g. "Program", and every other
+        # non-empty column with a discipline
+        for header_index, row in enumerate(cells):
+            headers = [cell for cell in row[1:] if not pd.isnull(cell)]
+            if len(headers) >= 2 and all(isinstance(cell, str) for cell in headers):
+                break
+        else:
+            continue
+        title = " ".join(
+            str(cell) for row in cells[:header_index] for cell in row if cell == cell
+        )
+        campus = match_table_campus(title or sheet_name.replace("_", " "))
+        measure = match_table_measure(title, default_measure)
+        disciplines = {
+            column: match_discipline(header)
+            for column, header in enumerate(cells[header_index])
+            if column > 0 and isinstance(header, str)
+        }
+        for row in cells[header_index + 1 :]:
+            if not isinstance(row[0], str):
+                continue
+            item = clean_label(row[0])
+            for column, discipline in disciplines.items():
+                value = parse_number(row[column])
+                if value is not None:
+                    records.append((campus, measure, discipline, item, value))
+    return records
+
+
+def parse_support_table(path):
+    """
+    Parse a raw support table into a long table.
+
+    Args:
+        path (Path): PDF or Excel support table
+
+    Returns:
+        (pd.DataFrame) with COLUMNS
+    """
+    path = Path(path)
+    year, degree, _ = parse_file_name(path)
+    parse = parse_pdf if path.suffix.lower() == ".pdf" else parse_excel
+    df = pd.DataFrame(
+        parse(path), columns=["Campus", "Measure", "Discipline", "Item", "Value"]
+    )
+    df.insert(0, "Year", year)
+    df.insert(2, "Degree", degree)
+    return df[COLUMNS]
+
+
+def find_support_tables(directory=SUPPORT_TABLES_DIR):
+    return sorted(
+        path
+        for path in Path(directory).glob("gradsupport_*")
+        if path.suffix.lower() in (".pdf", ".xls", ".xlsx")
+    )
+
+
+def file_hash(path):
+    digest = hashlib.sha1(f"v{PARSER_VERSION}:".encode())
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024**2), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def extract_support_tables(
+    paths=None, cache_dir=SUPPORT_CACHE_DIR, max_workers=None, progress=None
+):
+    """
+    Parse support tables in a process pool, re-using the cached table of any
+    file whose content (and the parser version) is unchanged.
+
+    Args:
+        paths (list): support tables, by default all in SUPPORT_TABLES_DIR
+        cache_dir (Path): directory of parsed tables, one parquet file per
+            file hash, entries no longer used by any support table are removed
+            when extracting all of them
+        max_workers (int): size of the process pool, by default the CPU count
+        progress (callable): called with each path and whether it was parsed
+            (rather than read from the cache)
+
+    Returns:
+        (pd.DataFrame) long table with COLUMNS and a "Source" column with the
+            file name
+    """
+    prune = paths is None
+    paths = find_support_tables() if paths is None else [Path(p) for p in paths]
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    cached = {path: cache_dir / f"{file_hash(path)}.parquet" for path in paths}
+    missing = [path for path in paths if not cached[path].exists()]
+    if missing:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for path, df in zip(missing, executor.map(parse_support_table, missing)):
+                df.to_parquet(cached[path], index=False)
+                if progress:
+                    progress(path, True)
+    if progress:
+        for path in paths:
+            if path not in missing:
+                progress(path, False)
+
+    # only a full run knows which entries are no longer used
+    if prune:
+        for entry in set(cache_dir.glob("*.parquet")) - set(cached.values()):
+            entry.unlink()
+
+    frames = []
+    for path in paths:
+        df = pd.read_parquet(cached[path])
+        df["Source"] = path.name
+        frames.append(df)
+    df = pd.concat(frames, ignore_index=True)
+    # a few files are misnamed, and duplicate another file once their measure
+    # is taken from the table title
+    return df.drop_duplicates(subset=COLUMNS[:-1], keep="first")
+
+
+def merge_support_tables(df, update):
+    """
+    Replace the rows of a long table taken from the files of another, e.g. of
+    only new or changed support tables, keeping the rows of all other files.
+
+    Args:
+        df (pd.DataFrame): long table from extract_support_tables
+        update (pd.DataFrame): long table from extract_support_tables
+
+    Returns:
+        (pd.DataFrame) merged long table
+    """
+    df = df[~df["Source"].isin(update["Source"].unique())]
+    df = pd.concat([df, update], ignore_index=True)
+    return df.drop_duplicates(subset=COLUMNS[:-1], keep="first")
+
+
+def save_support_table(df, output=SUPPORT_TABLE_PATH):
+    df.to_parquet(output, index=False)
+
+
+def net_stipend_table(df, degree):
+    """
+    Per capita net stipends of one degree in the format of the manual net stipend
+    files, see `cola_colab.data.load_net_stipend`.
+
+    Args:
+        df (pd.DataFrame): long table from extract_support_tables
+        degree (str): e.g. "PhD"
+
+    Returns:
+        (pd.DataFrame) with Year, Campus, Discipline, Net Stipend and Source
+    """
+    df = df[
+        (df["Degree"] == degree)
+        & (df["Measure"] == MEASURE_CODES["pc"])
+        & (df["Item"] == "Net Stipend")
+    ].copy()
+    df = df.rename(columns={"Value": "Net Stipend"})
+    df["Net Stipend"] = df["Net Stipend"].round().astype(int)
+    return df[["Year", "Campus", "Discipline", "Net Stipend", "Source"]].sort_values(
+        ["Year", "Campus", "Discipline"]
+    )
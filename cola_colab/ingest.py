@@ -0,0 +1,423 @@
+"""
+Offline ingest of the raw data sources into the compact stores read by the app.
+
+The web app never downloads anything itself, it only reads the stores written
+here. To (re-)build the salary store, first download the Transparent California
+exports for the University of California, one file per year, from e.g.
+
+    https://transcal.s3.amazonaws.com/public/export/university-of-california-2018.csv
+
+and then run:
+
+    python -m cola_colab.ingest salaries path/to/mirror/
+
+where the mirror directory contains the downloaded CSV files. Individual CSV files
+can also be given instead of a directory.
+
+The Transparent California exports are UC-wide, the store is nevertheless
+partitioned by campus so that campus-level data can be added where available:
+salaries are attributed to a campus from a "Campus" column, if the source has
+one, or else from the `--campus` option, or from a campus name in the file or
+mirror subdirectory name (e.g. `mirror/berkeley/2018.csv`), and are otherwise
+stored as UC-wide.
+
+This also pre-computes the salary
+statistics (histograms, quantiles and density estimates) for the most common job
+titles, these can be re-computed from the store on their own with:
+
+    python -m cola_colab.ingest stats
+
+To add a new year, ingest only that year's export, with:
+
+    python -m cola_colab.ingest salaries --incremental path/to/new-year.csv
+
+which leaves existing partitions of the store as they are, and only updates the
+statistics of the years written, keeping the job titles and bins of the existing
+statistics. A full `stats` re-build re-evaluates which job titles are common.
+
+The cost-of-living deficits for every degree, campus, discipline, year and rent
+burden threshold shown in the app are also pre-computed, from the HUD and stipend data
+in `cola_colab/data/`, with:
+
+    python -m cola_colab.ingest deficits
+
+which also pre-computes the annual cost of a COLA at each campus, alongside its
+finances, from the headcounts in the support tables below, see `cola_colab.context`.
+
+The UCOP graduate student support tables in `cola_colab/data/raw_data/` are
+extracted into a single long table, and per capita net stipends in the format of
+the stipend data, with:
+
+    python -m cola_colab.ingest support
+
+see `cola_colab.extract`.
+"""
+
+import argparse
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from pathlib import Path
+
+from cola_colab.data import (
+    CAMPUSES,
+    PAY_TYPES,
+    SALARY_STATS_PATH,
+    SALARY_STORE,
+    hash_files,
+    match_campus,
+    most_common_jobs,
+    read_salary_store,
+    salary_store_files,
+    salary_store_partitions,
+)
+from cola_colab.cola import DEFICIT_TABLE_PATH, build_deficit_table, save_deficit_table
+from cola_colab.context import (
+    CONTEXT_TABLE_PATH,
+    build_context_table,
+    save_context_table,
+)
+from cola_colab.extract import (
+    NET_STIPEND_PATHS,
+    SUPPORT_CACHE_DIR,
+    SUPPORT_TABLE_PATH,
+    SUPPORT_TABLES_DIR,
+    extract_support_tables,
+    merge_support_tables,
+    net_stipend_table,
+    save_support_table,
+)
+from cola_colab.stats import (
+    UC_WIDE,
+    build_salary_stats,
+    is_current_format,
+    load_salary_stats,
+    merge_salary_stats,
+    save_salary_stats,
+)
+
+# rows read from a source CSV at a time, to keep memory bounded for large exports
+CHUNK_SIZE = 100_000
+
+# rows per row group in the salary store, partitions are sorted by job title so
+# that reading a few job titles only reads a few row groups
+ROW_GROUP_SIZE = 16_384
+
+# compact on-disk schema for the salary store, job titles are dictionary-encoded
+# by parquet and read back as a categorical, the campus is given by the partition
+SALARY_SCHEMA = pa.schema(
+    [
+        ("Job Title", pa.string()),
+        *[(pay_type, pa.float32()) for pay_type in PAY_TYPES],
+        ("Year", pa.int16()),
+    ]
+)
+
+
+def find_salary_csvs(paths):
+    """
+    Expand any directories in paths to the CSV files they contain.
+
+    Args:
+        paths (list): CSV files and/or mirror directories of CSV files
+
+    Returns:
+        (list) sorted CSV file paths
+    """
+    csvs = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            csvs += sorted(path.glob("*.csv")) + sorted(path.glob("*.csv.gz"))
+        else:
+            csvs.append(path)
+    return csvs
+
+
+def read_salary_csv(path, chunk_size=CHUNK_SIZE, campus=None):
+    """
+    Stream a Transparent California export, yielding compact, pruned chunks.
+
+    Args:
+        path (Path): CSV file, the year is taken from its "Year" column or,
+            if that is missing, from a four-digit year in the file name
+        chunk_size (int): number of rows to read at a time
+        campus (str): campus of all salaries in the file, by default taken from
+            a "Campus" column, or the file or directory name, see match_campus
+
+    Yields:
+        (pd.DataFrame) chunks matching SALARY_SCHEMA, plus a "Campus" column
+    """
+    path = Path(path)
+    match = re.search(r"(\d{4})", path.name)
+    file_year = int(match.group(1)) if match else None
+
+    header = pd.read_csv(path, nrows=0).columns
+    usecols = ["Employee Name", "Job Title", *PAY_TYPES]
+    if "Year" in header:
+        usecols.append("Year")
+    elif file_year is None:
+        raise ValueError(f"Could not determine year of {path}")
+    if "Campus" in header:
+        usecols.append("Campus")
+    file_campus = (
+        campus
+        or match_campus(path.name.split(".")[0])
+        or match_campus(path.parent.name)
+        or UC_WIDE
+    )
+
+    for chunk in pd.read_csv(path, usecols=usecols, chunksize=chunk_size):
+
+        # exclude named employees (anyone with student status has their name redacted)
+        # note that the inverse is not necessarily true: a redacted name does not imply student
+        chunk = chunk[chunk["Employee Name"] == "Not provided"]
+        chunk = chunk.drop(["Employee Name"], axis=1)
+
+        if "Year" not in chunk:
+            chunk["Year"] = file_year
+        if "Campus" in chunk and campus is None:
+            campuses = {name: match_campus(name) for name in chunk["Campus"].unique()}
+            chunk["Campus"] = chunk["Campus"].map(campuses).fillna(file_campus)
+        else:
+            chunk["Campus"] = file_campus
+
+        for pay_type in PAY_TYPES:
+            chunk[pay_type] = pd.to_numeric(chunk[pay_type], errors="coerce").astype(
+                np.float32
+            )
+        chunk["Year"] = chunk["Year"].astype(np.int16)
+        chunk["Job Title"] = chunk["Job Title"].astype(str)
+
+        yield chunk[["Campus", *SALARY_SCHEMA.names]]
+
+
+def ingest_salaries(
+    paths, store=SALARY_STORE, chunk_size=CHUNK_SIZE, campus=None, incremental=False
+):
+    """
+    Build the salary store, one parquet file per campus and year, from raw CSV
+    exports.
+
+    Args:
+        paths (list): CSV files and/or mirror directories of CSV files
+        store (Path): output directory, existing files for ingested campuses and
+            years are replaced
+        chunk_size (int): number of rows to read at a time
+        campus (str): campus of all salaries in the files, see read_salary_csv
+        incremental (bool): only write partitions not already in the store
+
+    Returns:
+        (dict) number of rows written per (campus, year)
+    """
+    store = Path(store)
+    existing = set()
+    if incremental:
+        existing = {
+            (partition_campus, year)
+            for partition_campus, year, _ in salary_store_partitions(store)
+        }
+
+    writers = {}
+    rows = {}
+    try:
+        for csv in find_salary_csvs(paths):
+            for chunk in read_salary_csv(csv, chunk_size=chunk_size, campus=campus):
+                for (chunk_campus, year), part in chunk.groupby(["Campus", "Year"]):
+                    partition = (chunk_campus, int(year))
+                    if partition in existing:
+                        continue
+                    if partition not in writers:
+                        path = salary_partition_path(store, *partition)
+                        path.parent.mkdir(parents=True, exist_ok=True)
+                        writers[partition] = pq.ParquetWriter(str(path), SALARY_SCHEMA)
+                        rows[partition] = 0
+                    writers[partition].write_table(
+                        pa.Table.from_pandas(
+                            part[SALARY_SCHEMA.names],
+                            schema=SALARY_SCHEMA,
+                            preserve_index=False,
+                        )
+                    )
+                    rows[partition] += len(part)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    for partition in writers:
+        sort_salary_partition(salary_partition_path(store, *partition))
+
+    return rows
+
+
+def salary_partition_path(store, campus, year):
+    return Path(store) / f"Campus={campus}" / f"{year}.parquet"
+
+
+def sort_salary_partition(path, row_group_size=ROW_GROUP_SIZE):
+    """
+    Sort a partition of the salary store by job title, in place. A single
+    partition (one campus and year) is small enough to sort in memory.
+    """
+    df = pq.read_table(str(path)).to_pandas()
+    df = df.sort_values("Job Title", kind="mergesort")
+    pq.write_table(
+        pa.Table.from_pandas(df, schema=SALARY_SCHEMA, preserve_index=False),
+        str(path),
+        row_group_size=row_group_size,
+    )
+
+
+def ingest_stats(store=SALARY_STORE, output=SALARY_STATS_PATH, years=None):
+    """
+    Build the pre-aggregated salary statistics for the most common job titles
+    from the salary store, see `cola_colab.stats`.
+
+    Args:
+        store (Path): salary store directory
+        output (Path): output `.npz` file
+        years (list): only re-compute the statistics of these years, of every
+            campus, and merge them into the existing output, if there is any,
+            rather than re-computing everything, unless it is in an older
+            format, see `cola_colab.stats.is_current_format`
+
+    Returns:
+        (dict) statistics cube
+    """
+    stats = None
+    if years is not None and Path(output).is_file():
+        stats = load_salary_stats(output)
+    if stats is not None and is_current_format(stats):
+        update = build_salary_stats(
+            read_salary_store(store, years=years),
+            list(stats["job_titles"]),
+            list(stats["pay_types"]),
+            bin_edges=stats["bin_edges"],
+            kde_grid=stats["kde_grid"],
+        )
+        stats = merge_salary_stats(stats, update)
+    else:
+        df = read_salary_store(store)
+        stats = build_salary_stats(df, most_common_jobs(df), PAY_TYPES)
+    # to tell when the store has changed since, see cola_colab.data.is_up_to_date
+    stats["source_hash"] = np.array(hash_files(salary_store_files(store), store))
+    save_salary_stats(stats, output)
+    return stats
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m cola_colab.ingest", description=__doc__.splitlines()[1]
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    salaries = subparsers.add_parser(
+        "salaries", help="build the salary store from Transparent California exports"
+    )
+    salaries.add_argument(
+        "paths", nargs="+", help="CSV files, or mirror directories of CSV files"
+    )
+    salaries.add_argument("--store", default=SALARY_STORE, type=Path)
+    salaries.add_argument("--chunk-size", default=CHUNK_SIZE, type=int)
+    salaries.add_argument(
+        "--campus",
+        choices=CAMPUSES,
+        help="campus of all given salaries, if not in the data or file names",
+    )
+    salaries.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only add campuses and years not already in the store, and update "
+        "the statistics for those years only",
+    )
+
+    stats = subparsers.add_parser(
+        "stats", help="re-build the salary statistics from the salary store"
+    )
+    stats.add_argument("--store", default=SALARY_STORE, type=Path)
+    stats.add_argument(
+        "--years",
+        nargs="+",
+        type=int,
+        help="only update the statistics of these years, default all",
+    )
+
+    deficits = subparsers.add_parser(
+        "deficits", help="build the cost-of-living deficit and COLA context tables"
+    )
+    deficits.add_argument("--output", default=DEFICIT_TABLE_PATH, type=Path)
+    deficits.add_argument("--context-output", default=CONTEXT_TABLE_PATH, type=Path)
+
+    support = subparsers.add_parser(
+        "support", help="extract the UCOP graduate student support tables"
+    )
+    support.add_argument(
+        "paths",
+        nargs="*",
+        type=Path,
+        help=f"support tables, by default all in {SUPPORT_TABLES_DIR}, if given "
+        "only their rows of the output are replaced",
+    )
+    support.add_argument("--output", default=SUPPORT_TABLE_PATH, type=Path)
+    support.add_argument("--cache-dir", default=SUPPORT_CACHE_DIR, type=Path)
+    support.add_argument(
+        "--workers", type=int, help="number of parser processes, default CPU count"
+    )
+
+    args = parser.parse_args(args)
+    years = getattr(args, "years", None)
+
+    if args.command == "salaries":
+        rows = ingest_salaries(
+            args.paths,
+            store=args.store,
+            chunk_size=args.chunk_size,
+            campus=args.campus,
+            incremental=args.incremental,
+        )
+        for (campus, year), count in sorted(rows.items()):
+            print(f"{campus} {year}: {count} rows")
+        if args.incremental:
+            years = sorted({year for _, year in rows})
+
+    # with nothing new ingested, the statistics are up to date
+    if args.command in ("salaries", "stats") and years != []:
+        stats = ingest_stats(store=args.store, years=years)
+        print(
+            f"Salary statistics for {len(stats['job_titles'])} job titles and "
+            f"years {', '.join(map(str, stats['years']))}"
+        )
+
+    if args.command == "deficits":
+        table = build_deficit_table()
+        save_deficit_table(table, args.output)
+        print(f"Deficit table of shape {table['deficit'].shape}")
+        context_table = build_context_table(table)
+        save_context_table(context_table, args.context_output)
+        print(f"Context table of shape {context_table['cola_cost'].shape}")
+
+    if args.command == "support":
+        df = extract_support_tables(
+            args.paths or None,
+            cache_dir=args.cache_dir,
+            max_workers=args.workers,
+            progress=lambda path, parsed: print(
+                f"{path.name}: {'parsed' if parsed else 'cached'}"
+            ),
+        )
+        # support tables given explicitly replace only their own rows
+        if args.paths and args.output.is_file():
+            df = merge_support_tables(pd.read_parquet(args.output), df)
+        save_support_table(df, args.output)
+        print(f"Support table of {len(df)} rows")
+        for degree, path in NET_STIPEND_PATHS.items():
+            net_stipend_table(df, degree).to_csv(path, index=False)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,294 @@
+"""
+Instrumentation of the Dash callbacks, exposed as Prometheus metrics.
+
+Every callback request is split into phases, which add up to the time taken to
+serve the request:
+
+    data       reading and filtering data, in `with phase("data")` blocks
+    figure     the rest of the callback, i.e. building the plotly figure
+    cache      figure cache lookups and stores, see cola_colab.cache
+    serialize  JSON (de)serialization and compression of cached figures, and
+               parsing the request and encoding the response in Dash
+
+Phases nest, time spent in an inner phase is not counted in the outer one.
+Histograms of phase durations and response sizes, by callback, and the durations
+of the slowest requests of each callback, are kept in memory, per process, so each
+gunicorn worker reports its own. The inputs of the slowest requests are not
+metric labels, as they are user input, of unbounded cardinality, but are listed
+by `slowest_requests`, see /metrics/slowest in cola_colab.app.
+
+Under gevent, the lag of the event loop, i.e. how long greenlets wait to run
+while another holds the worker, e.g. building a figure, is also measured, see
+monitor_event_loop.
+"""
+
+import hashlib
+import heapq
+import json
+import threading
+import time
+
+from contextlib import contextmanager
+
+PHASES = ("data", "figure", "cache", "serialize")
+
+# histogram buckets, in seconds and bytes
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 10)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# number of slowest requests kept per callback, with distinct inputs, and the
+# length of their inputs as JSON, beyond which they are truncated
+SLOWEST = 10
+INPUTS_MAX_LENGTH = 500
+
+# seconds between wake-ups of the event loop monitor, see monitor_event_loop
+LOOP_INTERVAL = 0.01
+
+
+class Histogram:
+    """
+    Cumulative histogram in the Prometheus sense, by label values.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = {}
+        self.sums = {}
+
+    def observe(self, labels, value):
+        counts = self.counts.setdefault(labels, [0] * (len(self.buckets) + 1))
+        for i, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                counts[i] += 1
+        counts[-1] += 1
+        self.sums[labels] = self.sums.get(labels, 0) + value
+
+    def render(self, name, label_names):
+        lines = []
+        for labels, counts in sorted(self.counts.items()):
+            pairs = list(zip(label_names, labels))
+            for bucket, count in zip([*self.buckets, "+Inf"], counts):
+                lines.append(
+                    f"{name}_bucket{format_labels([*pairs, ('le', bucket)])} {count}"
+                )
+            lines.append(f"{name}_sum{format_labels(pairs)} {self.sums[labels]}")
+            lines.append(f"{name}_count{format_labels(pairs)} {counts[-1]}")
+        return lines
+
+
+def format_labels(labels):
+    """
+    Format (name, value) pairs as Prometheus labels, e.g. `{phase="data"}`.
+    """
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " "))
+        for name, value in labels
+    )
+    pairs = ",".join(f'{name}="{value}"' for name, value in escaped)
+    return "{" + pairs + "}" if pairs else ""
+
+
+class CallbackMetrics:
+    """
+    Per-phase timings and response sizes of callback requests.
+
+    A request is timed from `start` to `finish`, phases within it with `phase`,
+    which does nothing outside of a request, e.g. when warming up the cache.
+    """
+
+    def __init__(self, slowest=SLOWEST):
+        self.phase_seconds = Histogram(DURATION_BUCKETS)
+        self.request_seconds = Histogram(DURATION_BUCKETS)
+        self.response_bytes = Histogram(SIZE_BUCKETS)
+        self.loop_lag_seconds = Histogram(DURATION_BUCKETS)
+        self.max_loop_lag = 0.0
+        self.slowest = slowest
+        self._slowest = {}
+        self._lock = threading.Lock()
+        # greenlet-local under gevent, which patches threading
+        self._local = threading.local()
+
+    def start(self, callback, inputs=None):
+        """
+        Start timing a request.
+
+        Args:
+            callback (str): callback name, e.g. the id and property of its output
+            inputs: callback inputs, listed for the slowest requests, see
+                slowest_requests
+        """
+        self._local.request = {
+            "callback": callback,
+            "inputs": inputs,
+            "start": time.perf_counter(),
+            "phases": dict.fromkeys(PHASES, 0.0),
+            "stack": [],
+        }
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Context manager timing a phase of the current request.
+        """
+        request = getattr(self._local, "request", None)
+        if request is None:
+            yield
+            return
+        stack = request["stack"]
+        stack.append(0.0)  # time spent in nested phases
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = stack.pop()
+            request["phases"][name] += elapsed - nested
+            if stack:
+                stack[-1] += elapsed
+
+    def stop(self):
+        """
+        Stop timing the current request without recording it, e.g. in a
+        ProcessPool process, whose phases are then added to the request of the
+        calling process with add_phases.
+
+        Returns:
+            (dict) seconds spent in each phase, see PHASES
+        """
+        request = getattr(self._local, "request", None)
+        self._local.request = None
+        return request["phases"] if request is not None else {}
+
+    def add_phases(self, phases):
+        """
+        Add time spent in phases elsewhere, e.g. in another process, to the
+        current request, as if they were nested in the current phase.
+
+        Args:
+            phases (dict): seconds by phase, see stop
+        """
+        request = getattr(self._local, "request", None)
+        if request is None:
+            return
+        for name, seconds in phases.items():
+            request["phases"][name] += seconds
+        if request["stack"]:
+            request["stack"][-1] += sum(phases.values())
+
+    def finish(self, response_bytes):
+        """
+        Finish timing the current request, and record it. The time not spent in
+        any phase is attributed to Dash serializing the request and response.
+
+        Args:
+            response_bytes (int): size of the (uncompressed) response
+        """
+        request = getattr(self._local, "request", None)
+        if request is None:
+            return
+        self._local.request = None
+        total = time.perf_counter() - request["start"]
+        phases = request["phases"]
+        phases["serialize"] += max(total - sum(phases.values()), 0)
+
+        callback = request["callback"]
+        with self._lock:
+            for phase, seconds in phases.items():
+                self.phase_seconds.observe((callback, phase), seconds)
+            self.request_seconds.observe((callback,), total)
+            self.response_bytes.observe((callback,), response_bytes)
+            inputs = json.dumps(request["inputs"], default=str)
+            digest = hashlib.sha1(inputs.encode()).hexdigest()
+            slowest = self._slowest.setdefault(callback, [])
+            if not any(previous == digest for _, previous, _ in slowest):
+                entry = (total, digest, inputs[:INPUTS_MAX_LENGTH])
+                heapq.heappush(slowest, entry)
+                if len(slowest) > self.slowest:
+                    heapq.heappop(slowest)
+
+    def slowest_requests(self):
+        """
+        Returns:
+            (dict) slowest requests of each callback, slowest first, as dicts of
+                "seconds" and "inputs", as JSON truncated to INPUTS_MAX_LENGTH
+        """
+        with self._lock:
+            return {
+                callback: [
+                    {"seconds": seconds, "inputs": inputs}
+                    for seconds, _, inputs in sorted(slowest, reverse=True)
+                ]
+                for callback, slowest in sorted(self._slowest.items())
+            }
+
+    def observe_loop_lag(self, seconds):
+        """
+        Record how late the event loop monitor woke up, see monitor_event_loop.
+        """
+        with self._lock:
+            self.loop_lag_seconds.observe((), seconds)
+            self.max_loop_lag = max(self.max_loop_lag, seconds)
+
+    def render(self):
+        """
+        Returns:
+            (list) lines of metrics in the Prometheus text format
+        """
+        with self._lock:
+            lines = [
+                "# HELP cola_callback_phase_seconds Time spent in each phase of a callback request",
+                "# TYPE cola_callback_phase_seconds histogram",
+                *self.phase_seconds.render(
+                    "cola_callback_phase_seconds", ("callback", "phase")
+                ),
+                "# HELP cola_callback_seconds Time taken to serve a callback request",
+                "# TYPE cola_callback_seconds histogram",
+                *self.request_seconds.render("cola_callback_seconds", ("callback",)),
+                "# HELP cola_callback_response_bytes Size of the uncompressed callback response",
+                "# TYPE cola_callback_response_bytes histogram",
+                *self.response_bytes.render(
+                    "cola_callback_response_bytes", ("callback",)
+                ),
+                "# HELP cola_callback_slowest_seconds Slowest callback requests with distinct inputs, by rank",
+                "# TYPE cola_callback_slowest_seconds gauge",
+            ]
+            for callback, slowest in sorted(self._slowest.items()):
+                for rank, (seconds, *_) in enumerate(sorted(slowest, reverse=True), 1):
+                    labels = format_labels([("callback", callback), ("rank", rank)])
+                    lines.append(f"cola_callback_slowest_seconds{labels} {seconds}")
+            if self.loop_lag_seconds.counts:
+                lines += [
+                    "# HELP cola_event_loop_lag_seconds Delay of the event loop monitor waking up",
+                    "# TYPE cola_event_loop_lag_seconds histogram",
+                    *self.loop_lag_seconds.render("cola_event_loop_lag_seconds", ()),
+                    "# HELP cola_event_loop_lag_max_seconds Longest delay of the event loop monitor",
+                    "# TYPE cola_event_loop_lag_max_seconds gauge",
+                    f"cola_event_loop_lag_max_seconds {self.max_loop_lag}",
+                ]
+        return lines
+
+
+def monitor_event_loop(interval=LOOP_INTERVAL):
+    """
+    Measure the lag of the gevent event loop, in a greenlet waking up every
+    interval and recording how late it is, which is how long any greenlet of the
+    worker can be kept waiting. Does nothing if gevent is not installed.
+    """
+    try:
+        import gevent
+    except ImportError:
+        return
+
+    def monitor():
+        while True:
+            start = time.perf_counter()
+            gevent.sleep(interval)
+            callback_metrics.observe_loop_lag(
+                max(time.perf_counter() - start - interval, 0)
+            )
+
+    return gevent.spawn(monitor)
+
+
+callback_metrics = CallbackMetrics()
+phase = callback_metrics.phase
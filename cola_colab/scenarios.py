@@ -0,0 +1,317 @@
+"""
+Headless cost-of-living scenarios, for sensitivity sweeps outside of the web app.
+
+Every combination of degree, campus, discipline, academic year, rent burden
+threshold and unit mix (the mix of HUD unit types students are assumed to rent)
+is evaluated in one vectorized call, and results are streamed to CSV or Parquet,
+e.g.
+
+    python -m cola_colab.scenarios --threshold 25 30 35 \\
+        --unit-mix studio=1,1,0,0,0 --unit-mix shared=0,0,1,1,1 \\
+        --output sweep.parquet
+
+With the default equal unit mix, results match `cola_colab.cola.get_cost_of_living`
+and the deficit graph in the app.
+"""
+
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from pathlib import Path
+
+from cola_colab import cola
+from cola_colab.cola import THRESHOLDS, unit_mix_key
+from cola_colab.data import CAMPUSES, OCCUPANTS, UNITS, UNIT_WEIGHTS, load
+
+# weights of UNITS, as assumed by the app
+EQUAL_MIX = {"Equal": UNIT_WEIGHTS}
+
+# unit mixes evaluated at a time when streaming, to keep memory bounded
+BATCH_SIZE = 16
+
+COLUMNS = [
+    "Unit Mix",
+    "Degree",
+    "Campus",
+    "Discipline",
+    "Year",
+    "Threshold",
+    "Cost of Living",
+    "Net Stipend",
+    "Deficit",
+]
+
+
+def parse_unit_mix(text):
+    """
+    Parse a unit mix given as "name=w1,w2,w3,w4,w5", with one weight per unit
+    type in UNITS, e.g. "studio=1,1,0,0,0".
+
+    Returns:
+        (tuple) name and weights
+    """
+    name, _, weights = text.partition("=")
+    weights = tuple(float(weight) for weight in weights.split(","))
+    if len(weights) != len(UNITS):
+        raise ValueError(f"Unit mix {text!r} needs a weight for each of {UNITS}")
+    return name, weights
+
+
+def get_cost_of_living(
+    percentage, campus, academic_year, unit_mixes=EQUAL_MIX, occupants=OCCUPANTS
+):
+    """
+    Cost of living for any number of unit mixes, see
+    cola_colab.cola.get_cost_of_living. Rents for all unit mixes are computed at
+    once, and not memoized, see cola_colab.cola.get_rents_per_person.
+
+    Args:
+        percentage (np.ndarray): rent burden thresholds, 0-100
+        campus (np.ndarray): campuses, broadcast with percentage and academic_year
+        academic_year (np.ndarray): academic years, rental data is averaged over
+            the year and the next
+        unit_mixes (dict): weights of UNITS by unit mix name
+        occupants (tuple): number of people sharing each of UNITS
+
+    Returns:
+        (np.ndarray) (unit mix, ...) cost of living per month
+    """
+    rent = cola.get_rents_per_person(list(unit_mixes.values()), occupants)
+    return cola.rent_to_cost_of_living(rent, percentage, campus, academic_year)
+
+
+def evaluate_scenarios(
+    degrees=None,
+    campuses=None,
+    disciplines=None,
+    years=None,
+    thresholds=THRESHOLDS,
+    unit_mixes=EQUAL_MIX,
+    occupants=OCCUPANTS,
+):
+    """
+    Evaluate the cost of living and cost-of-living deficit for every combination
+    of the given degrees, campuses, disciplines, years, thresholds and unit mixes.
+
+    Args:
+        degrees (list): degrees, defaults to all in DEFICIT_TABLE
+        campuses (list): campuses, defaults to CAMPUSES
+        disciplines (list): disciplines, defaults to all in DEFICIT_TABLE
+        years (list): academic years, defaults to all in DEFICIT_TABLE
+        thresholds (list): rent burden thresholds, in percent
+        unit_mixes (dict): weights of UNITS by unit mix name
+        occupants (tuple): number of people sharing each of UNITS
+
+    Returns:
+        (dict) of numpy arrays: "unit_mixes", "degrees", "campuses", "disciplines",
+            "years" and "thresholds" labelling the axes of "cost_of_living"
+            (unit mix, campus, year, threshold), "net_stipend" (degree, campus,
+            discipline, year) and "deficit" (unit mix, degree, campus, discipline,
+            year, threshold), all monthly in USD and NaN where there is no
+            stipend data
+    """
+    deficit_table = load("DEFICIT_TABLE")
+    labels = {
+        "degrees": deficit_table["degrees"] if degrees is None else degrees,
+        "campuses": CAMPUSES if campuses is None else campuses,
+        "disciplines": (
+            deficit_table["disciplines"] if disciplines is None else disciplines
+        ),
+        "years": deficit_table["years"] if years is None else years,
+    }
+    indices = {
+        name: pd.Index(deficit_table[name]).get_indexer(np.ravel(values))
+        for name, values in labels.items()
+    }
+    for name, index in indices.items():
+        if np.any(index < 0):
+            raise KeyError(f"Unknown {name} in {labels[name]}")
+
+    net_stipend = deficit_table["net_stipend"][np.ix_(*indices.values())]
+    cost_of_living = get_cost_of_living(
+        np.asarray(thresholds)[None, None, :],
+        np.asarray(labels["campuses"])[:, None, None],
+        np.asarray(labels["years"])[None, :, None],
+        unit_mixes,
+        occupants,
+    )
+    return {
+        "unit_mixes": np.array(list(unit_mixes), dtype=str),
+        **{name: np.asarray(values) for name, values in labels.items()},
+        "thresholds": np.asarray(thresholds),
+        "cost_of_living": cost_of_living,
+        "net_stipend": net_stipend,
+        "deficit": cost_of_living[:, None, :, None, :, :]
+        - net_stipend[None, ..., None],
+    }
+
+
+def scenario_frame(scenarios, dropna=True):
+    """
+    Flatten evaluated scenarios into a long table.
+
+    Args:
+        scenarios (dict): see evaluate_scenarios
+        dropna (bool): leave out scenarios without stipend data
+
+    Returns:
+        (pd.DataFrame) with COLUMNS
+    """
+    axes = ["unit_mixes", "degrees", "campuses", "disciplines", "years", "thresholds"]
+    df = pd.MultiIndex.from_product(
+        [scenarios[axis] for axis in axes], names=COLUMNS[:6]
+    ).to_frame(index=False)
+    shape = scenarios["deficit"].shape
+    df["Cost of Living"] = np.broadcast_to(
+        scenarios["cost_of_living"][:, None, :, None, :, :], shape
+    ).ravel()
+    df["Net Stipend"] = np.broadcast_to(
+        scenarios["net_stipend"][None, ..., None], shape
+    ).ravel()
+    df["Deficit"] = scenarios["deficit"].ravel()
+    if dropna:
+        df = df[df["Net Stipend"].notna()]
+    return df.reset_index(drop=True)
+
+
+def iter_scenarios(unit_mixes=EQUAL_MIX, batch_size=BATCH_SIZE, dropna=True, **kwargs):
+    """
+    Evaluate scenarios a batch of unit mixes at a time.
+
+    Args:
+        unit_mixes (dict): weights of UNITS by unit mix name
+        batch_size (int): number of unit mixes per batch
+        dropna (bool): leave out scenarios without stipend data
+        **kwargs: see evaluate_scenarios
+
+    Yields:
+        (pd.DataFrame) scenarios of each batch, see scenario_frame
+    """
+    names = list(unit_mixes)
+    for start in range(0, len(names), batch_size):
+        batch = {name: unit_mixes[name] for name in names[start : start + batch_size]}
+        yield scenario_frame(evaluate_scenarios(unit_mixes=batch, **kwargs), dropna)
+
+
+def write_scenarios(path, frames):
+    """
+    Stream scenarios to a CSV or Parquet file, by the file extension.
+
+    Args:
+        path (Path): output file, ".parquet" or ".csv"
+        frames (iterable): data frames, see iter_scenarios
+
+    Returns:
+        (int) number of rows written
+    """
+    path = Path(path)
+    rows = 0
+    if path.suffix == ".parquet":
+        writer = None
+        try:
+            for df in frames:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(str(path), table.schema)
+                writer.write_table(table)
+                rows += len(df)
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        with open(path, "w", newline="") as f:
+            for i, df in enumerate(frames):
+                df.to_csv(f, header=i == 0, index=False)
+                rows += len(df)
+    return rows
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m cola_colab.scenarios",
+        description=__doc__.splitlines()[1],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="\n".join(__doc__.splitlines()[2:]),
+    )
+    parser.add_argument("--degree", nargs="+", help="default all")
+    parser.add_argument("--campus", nargs="+", choices=CAMPUSES, help="default all")
+    parser.add_argument("--discipline", nargs="+", help="default all")
+    parser.add_argument("--year", nargs="+", type=int, help="default all")
+    parser.add_argument(
+        "--threshold",
+        nargs="+",
+        type=float,
+        default=THRESHOLDS.tolist(),
+        help="rent burden thresholds in percent, default those in the app",
+    )
+    parser.add_argument(
+        "--unit-mix",
+        action="append",
+        type=parse_unit_mix,
+        help=f"name=weights of {', '.join(UNITS)}, can be repeated, default equal",
+    )
+    parser.add_argument(
+        "--occupants",
+        nargs=len(UNITS),
+        type=float,
+        default=OCCUPANTS,
+        help=f"people sharing each unit type, default {OCCUPANTS}",
+    )
+    parser.add_argument(
+        "--keep-missing",
+        action="store_true",
+        help="include scenarios without stipend data",
+    )
+    parser.add_argument(
+        "--output", type=Path, required=True, help=".csv or .parquet file"
+    )
+    args = parser.parse_args(args)
+
+    names = [name for name, _ in args.unit_mix or []]
+    repeated = sorted({name for name in names if names.count(name) > 1})
+    if repeated:
+        parser.error(f"Unit mix names must be unique, repeated: {', '.join(repeated)}")
+    unit_mixes = dict(args.unit_mix) if args.unit_mix else EQUAL_MIX
+    kwargs = dict(
+        degrees=args.degree,
+        campuses=args.campus,
+        disciplines=args.discipline,
+        years=args.year,
+        thresholds=args.threshold,
+        occupants=tuple(args.occupants),
+    )
+    if any(threshold <= 0 for threshold in args.threshold):
+        parser.error("Rent burden thresholds must be positive")
+    # check every unit mix, and evaluate the first, so that invalid inputs are
+    # reported before anything is written
+    try:
+        for unit_weights in unit_mixes.values():
+            unit_mix_key(unit_weights, kwargs["occupants"])
+        first = next(iter(unit_mixes))
+        first_df = scenario_frame(
+            evaluate_scenarios(unit_mixes={first: unit_mixes[first]}, **kwargs),
+            dropna=not args.keep_missing,
+        )
+    except (KeyError, ValueError) as e:
+        parser.error(e.args[0])
+    # which scenarios have stipend data does not depend on the unit mix
+    if first_df.empty:
+        parser.error(
+            "No stipend data for the given degrees, campuses, disciplines and "
+            "years, use --keep-missing to write their scenarios anyway"
+        )
+
+    frames = iter_scenarios(
+        unit_mixes=unit_mixes, dropna=not args.keep_missing, **kwargs
+    )
+    rows = write_scenarios(args.output, frames)
+    print(f"{rows} scenarios written to {args.output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
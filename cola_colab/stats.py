@@ -0,0 +1,398 @@
+"""
+Pre-aggregated salary statistics, so that the salary distribution graph never has
+to touch (or send to the browser) individual salaries.
+
+The statistics "cube" is a dict of numpy arrays indexed by (campus, job title,
+year, pay type), computed once at ingest time and saved as a single `.npz` file.
+The first campus is always UC_WIDE, statistics over all salaries, followed by the
+campuses that salaries could be attributed to at ingest, if any. Histogram bins
+and density estimate grids are per (job title, pay type), so that the salaries
+of a single job title are never squashed into a few bins by those of another.
+"""
+
+import numpy as np
+
+# label for salaries across the whole UC system, including those that could not be
+# attributed to a campus
+UC_WIDE = "UC-wide"
+
+# number of histogram bins per job title and pay type, bins are shared across
+# campuses and years so that histograms can simply be summed
+HISTOGRAM_BINS = 100
+
+# bin sizes are one of these times a power of ten, as in plotly's histograms
+NICE_BIN_SIZES = (1, 2, 2.5, 5, 10)
+
+# number of points at which the kernel density estimate is sampled
+KDE_POINTS = 128
+
+# values above this quantile (of each job title) are counted as "overflow" rather
+# than binned, so that a handful of outliers do not squash the histogram
+RANGE_QUANTILE = 0.999
+
+# stored per (campus, job title, year, pay type): min, lower quartile, median, upper quartile, max
+QUANTILES = (0, 0.25, 0.5, 0.75, 1)
+
+# arrays indexed by (campus, job title, year, pay type, ...), and their value where
+# there are no salaries
+CUBE_FILL = {
+    "counts": 0,
+    "mean": np.nan,
+    "quantiles": np.nan,
+    "histograms": 0,
+    "overflow": 0,
+    "kde": 0,
+}
+
+
+def is_current_format(stats):
+    """
+    Whether a statistics cube, e.g. one loaded from disk, has per job title bins
+    and overflow counts, rather than bins shared by all job titles.
+    """
+    return "overflow" in stats and np.ndim(stats["bin_edges"]) == 3
+
+
+def nice_bin_edges(low, high, bins=HISTOGRAM_BINS):
+    """
+    Evenly spaced bin edges covering [low, high], with a "nice" bin size, see
+    NICE_BIN_SIZES, starting at a multiple of it, so that the same bins can be
+    given to a plotly histogram as xbins=dict(start=..., size=...).
+
+    Returns:
+        (np.ndarray) (bins + 1,) bin edges
+    """
+    if not high > low:
+        high = low + 1
+    magnitude = 10 ** np.floor(np.log10((high - low) / bins))
+    for nice_size in NICE_BIN_SIZES:
+        size = nice_size * magnitude
+        start = np.floor(low / size) * size
+        if start + bins * size >= high:
+            break
+    return start + size * np.arange(bins + 1)
+
+
+def kde_bandwidth(values: np.ndarray):
+    """
+    Bandwidth for a Gaussian kernel density estimate, using the same rule of thumb
+    as plotly's violin plots (Silverman's rule).
+    """
+    if len(values) < 2:
+        return 0.0
+    q1, q3 = np.percentile(values, [25, 75])
+    spread = min(np.std(values, ddof=1), (q3 - q1) / 1.349) or np.std(values, ddof=1)
+    return 1.059 * spread * len(values) ** (-1 / 5)
+
+
+def binned_kde(values: np.ndarray, grid: np.ndarray):
+    """
+    Approximate Gaussian kernel density estimate of values, evaluated on an evenly
+    spaced grid, computed by binning values onto the grid and convolving with
+    the kernel. This is O(n + len(grid)^2) rather than O(n * len(grid)).
+
+    Returns:
+        (np.ndarray) density at each grid point, integrating to 1
+    """
+    density = np.zeros(len(grid))
+    if len(values) == 0:
+        return density
+
+    step = grid[1] - grid[0]
+    indices = np.clip(np.rint((values - grid[0]) / step).astype(int), 0, len(grid) - 1)
+    counts = np.bincount(indices, minlength=len(grid)).astype(float)
+
+    bandwidth = kde_bandwidth(values)
+    if bandwidth < step:
+        density = counts
+    else:
+        offsets = np.arange(-len(grid) + 1, len(grid)) * step
+        kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2)
+        density = np.convolve(counts, kernel)[len(grid) - 1 : 2 * len(grid) - 1]
+
+    return density / (density.sum() * step)
+
+
+def build_salary_stats(df, job_titles, pay_types, bin_edges=None, kde_grid=None):
+    """
+    Compute the statistics cube for the given job titles.
+
+    Args:
+        df (pd.DataFrame): salary data with "Job Title", "Year" and pay type
+            columns, and optionally "Campus"
+        job_titles (list): job titles to include
+        pay_types (list): pay type columns to include
+        bin_edges (np.ndarray): (job title, pay type, bins + 1) histogram bin
+            edges, by default spanning the data of each job title, see
+            RANGE_QUANTILE and nice_bin_edges
+        kde_grid (np.ndarray): (job title, pay type, points) density estimate
+            grid, by default spanning the same range as the bins
+
+    Returns:
+        (dict) of numpy arrays, see module docstring
+    """
+    df = df[df["Job Title"].isin(job_titles)]
+    years = np.array(sorted(df["Year"].unique()), dtype=np.int16)
+    campuses = [UC_WIDE]
+    if "Campus" in df:
+        campuses += sorted(set(df["Campus"].unique()) - {UC_WIDE})
+
+    shape = (len(campuses), len(job_titles), len(years), len(pay_types))
+    stats = {
+        "campuses": np.array(campuses, dtype=str),
+        "job_titles": np.array(job_titles, dtype=str),
+        "years": years,
+        "pay_types": np.array(pay_types, dtype=str),
+        "counts": np.zeros(shape, dtype=np.int64),
+        "mean": np.full(shape, np.nan, dtype=np.float32),
+        "quantiles": np.full((*shape, len(QUANTILES)), np.nan, dtype=np.float32),
+        "bin_edges": np.zeros((len(job_titles), len(pay_types), HISTOGRAM_BINS + 1)),
+        "histograms": np.zeros((*shape, HISTOGRAM_BINS), dtype=np.int32),
+        "overflow": np.zeros(shape, dtype=np.int32),
+        "kde_grid": np.zeros((len(job_titles), len(pay_types), KDE_POINTS)),
+        "kde": np.zeros((*shape, KDE_POINTS), dtype=np.float32),
+    }
+
+    # bins are shared across campuses too, and with statistics built before if
+    # given, so that they can be merged
+    if bin_edges is not None:
+        stats["bin_edges"][:] = bin_edges
+        stats["kde_grid"][:] = kde_grid
+    else:
+        job_dfs = dict(tuple(df.groupby("Job Title", observed=True)))
+        for t, job_title in enumerate(job_titles):
+            for p, pay_type in enumerate(pay_types):
+                values = (
+                    job_dfs[job_title][pay_type].dropna().values.astype(float)
+                    if job_title in job_dfs
+                    else np.array([])
+                )
+                low = min(0.0, values.min()) if len(values) else 0.0
+                high = np.quantile(values, RANGE_QUANTILE) if len(values) else 1.0
+                edges = nice_bin_edges(low, high)
+                stats["bin_edges"][t, p] = edges
+                stats["kde_grid"][t, p] = np.linspace(edges[0], edges[-1], KDE_POINTS)
+
+    for c, campus in enumerate(campuses):
+        campus_df = df if campus == UC_WIDE else df[df["Campus"] == campus]
+        groups = campus_df.groupby(["Job Title", "Year"], observed=True)
+        for (job_title, year), group in groups:
+            t = job_titles.index(job_title)
+            y = int(np.searchsorted(years, year))
+            for p, pay_type in enumerate(pay_types):
+                values = group[pay_type].dropna().values.astype(float)
+                if not len(values):
+                    continue
+                edges = stats["bin_edges"][t, p]
+                in_range = values <= edges[-1]
+                stats["counts"][c, t, y, p] = len(values)
+                stats["mean"][c, t, y, p] = values.mean()
+                stats["quantiles"][c, t, y, p] = np.quantile(values, QUANTILES)
+                stats["histograms"][c, t, y, p] = np.histogram(
+                    np.maximum(values[in_range], edges[0]), bins=edges
+                )[0]
+                stats["overflow"][c, t, y, p] = np.count_nonzero(~in_range)
+                # overflow values are left out of the density too, rather than
+                # piling up at the end of the grid
+                stats["kde"][c, t, y, p] = (
+                    binned_kde(values[in_range], stats["kde_grid"][t, p])
+                    * in_range.mean()
+                )
+
+    return stats
+
+
+def merge_salary_stats(stats, update):
+    """
+    Merge statistics of new (or re-ingested) years into a statistics cube.
+
+    Args:
+        stats (dict): statistics cube
+        update (dict): statistics cube of the same job titles, pay types and bins,
+            see build_salary_stats, replacing those of stats for its years
+
+    Returns:
+        (dict) statistics cube of all campuses and years of both
+    """
+    campuses = [
+        UC_WIDE,
+        *sorted((set(stats["campuses"]) | set(update["campuses"])) - {UC_WIDE}),
+    ]
+    years = np.union1d(stats["years"], update["years"]).astype(np.int16)
+    merged = {
+        **stats,
+        "campuses": np.array(campuses, dtype=str),
+        "years": years,
+    }
+    for key, fill in CUBE_FILL.items():
+        shape = list(stats[key].shape)
+        shape[0], shape[2] = len(campuses), len(years)
+        merged[key] = np.full(shape, fill, dtype=stats[key].dtype)
+
+    t = np.arange(len(stats["job_titles"]))
+    kept = ~np.isin(stats["years"], update["years"])
+    for cube, cube_years in ((stats, kept), (update, slice(None))):
+        c = [campuses.index(campus) for campus in cube["campuses"]]
+        y = np.searchsorted(years, cube["years"][cube_years])
+        for key in CUBE_FILL:
+            merged[key][np.ix_(c, t, y)] = cube[key][:, :, cube_years]
+    return merged
+
+
+def save_salary_stats(stats, path):
+    np.savez_compressed(path, **stats)
+
+
+def load_salary_stats(path):
+    with np.load(path) as npz:
+        return {key: npz[key] for key in npz.files}
+
+
+def combine_salary_stats(stats, job_titles, pay_type, campus=UC_WIDE):
+    """
+    Combine the statistics of several job titles for a single pay type. Those of
+    a single job title are returned as is, those of several are re-binned onto
+    common bins spanning all of them.
+
+    Args:
+        stats (dict): statistics cube
+        job_titles (list): job titles to combine, unknown titles are ignored
+        pay_type (str): pay type
+        campus (str): campus, must be one of the cube's "campuses"
+
+    Returns:
+        (dict) with per-year "counts" (Y,), "histograms" (Y, bins), "overflow"
+        (Y,), "kde" (Y, points) and "quantiles" (Y, 5) arrays, along with the
+        "bin_edges", "kde_grid" and "years" they refer to
+    """
+    c = list(stats["campuses"]).index(campus)
+    known = list(stats["job_titles"])
+    t = [known.index(job_title) for job_title in job_titles if job_title in known]
+    p = list(stats["pay_types"]).index(pay_type)
+
+    if len(t) == 1:
+        return {
+            "years": stats["years"],
+            "counts": stats["counts"][c, t[0], :, p],
+            "histograms": stats["histograms"][c, t[0], :, p],
+            "overflow": stats["overflow"][c, t[0], :, p],
+            "bin_edges": stats["bin_edges"][t[0], p],
+            "kde": stats["kde"][c, t[0], :, p],
+            "kde_grid": stats["kde_grid"][t[0], p],
+            "quantiles": stats["quantiles"][c, t[0], :, p],
+        }
+
+    if t:
+        bin_edges = nice_bin_edges(
+            stats["bin_edges"][t, p, 0].min(), stats["bin_edges"][t, p, -1].max()
+        )
+    else:
+        bin_edges = nice_bin_edges(0, 1)
+    kde_grid = np.linspace(bin_edges[0], bin_edges[-1], KDE_POINTS)
+
+    counts = stats["counts"][c, t, :, p]
+    total = counts.sum(axis=0)
+    histograms = np.zeros((len(stats["years"]), HISTOGRAM_BINS), dtype=np.int64)
+    overflow = np.zeros(len(stats["years"]), dtype=np.int64)
+    kde = np.zeros((len(stats["years"]), KDE_POINTS))
+    for i in t:
+        job_histograms, job_overflow = rebin_histograms(
+            stats["histograms"][c, i, :, p],
+            stats["overflow"][c, i, :, p],
+            stats["bin_edges"][i, p],
+            stats["quantiles"][c, i, :, p, -1],
+            bin_edges,
+        )
+        histograms += job_histograms
+        overflow += job_overflow
+        # densities are weighted by the number of people in each job title
+        for y, job_kde in enumerate(stats["kde"][c, i, :, p]):
+            kde[y] += stats["counts"][c, i, y, p] * np.interp(
+                kde_grid, stats["kde_grid"][i, p], job_kde, left=0, right=0
+            )
+    with np.errstate(invalid="ignore", divide="ignore"):
+        kde = kde / total[:, None]
+    kde = np.nan_to_num(kde)
+
+    if not t:
+        quantiles = np.full((len(stats["years"]), len(QUANTILES)), np.nan)
+    else:
+        quantiles = histogram_quantiles(
+            histograms,
+            bin_edges,
+            low=np.fmin.reduce(stats["quantiles"][c, t, :, p, 0], axis=0),
+            high=np.fmax.reduce(stats["quantiles"][c, t, :, p, -1], axis=0),
+            overflow=overflow,
+        )
+
+    return {
+        "years": stats["years"],
+        "counts": total,
+        "histograms": histograms,
+        "overflow": overflow,
+        "bin_edges": bin_edges,
+        "kde": kde,
+        "kde_grid": kde_grid,
+        "quantiles": quantiles,
+    }
+
+
+def rebin_histograms(histograms, overflow, bin_edges, high, new_bin_edges):
+    """
+    Re-bin histograms onto other bins, assuming values are evenly spread within
+    each bin, and overflow values between the last bin edge and the maximum.
+
+    Args:
+        histograms (np.ndarray): (Y, bins) counts
+        overflow (np.ndarray): (Y,) counts above the last bin edge
+        bin_edges (np.ndarray): (bins + 1,) bin edges
+        high (np.ndarray): (Y,) exact maximum values
+        new_bin_edges (np.ndarray): bin edges to re-bin onto, starting at or
+            below the first of bin_edges
+
+    Returns:
+        (tuple) of (Y, new bins) counts, and (Y,) counts above the last new bin
+        edge
+    """
+    totals = histograms.sum(axis=1) + overflow
+    cumulative = np.zeros((len(histograms), len(new_bin_edges)))
+    for y, counts in enumerate(histograms):
+        if not totals[y]:
+            continue
+        x = bin_edges
+        counts = np.concatenate([[0], np.cumsum(counts)])
+        if overflow[y]:
+            x = np.append(x, max(high[y], np.nextafter(x[-1], np.inf)))
+            counts = np.append(counts, totals[y])
+        cumulative[y] = np.interp(new_bin_edges, x, counts)
+    # rounded cumulative counts, so that counts stay whole and totals are kept
+    cumulative = np.rint(cumulative).astype(np.int64)
+    return np.diff(cumulative, axis=1), totals - cumulative[:, -1]
+
+
+def histogram_quantiles(histograms, bin_edges, low, high, overflow=None):
+    """
+    Approximate quantiles from binned counts by linear interpolation within bins.
+
+    Args:
+        histograms (np.ndarray): (Y, bins) counts
+        bin_edges (np.ndarray): (bins + 1,) bin edges
+        low (np.ndarray): (Y,) exact minimum values
+        high (np.ndarray): (Y,) exact maximum values
+        overflow (np.ndarray): (Y,) counts above the last bin edge, if any
+
+    Returns:
+        (np.ndarray) (Y, 5) quantiles, see QUANTILES
+    """
+    if overflow is None:
+        overflow = np.zeros(len(histograms))
+    quantiles = np.full((len(histograms), len(QUANTILES)), np.nan)
+    for y, counts in enumerate(histograms):
+        total = counts.sum() + overflow[y]
+        if not total:
+            continue
+        cumulative = np.concatenate([[0], np.cumsum(counts), [total]]) / total
+        x = np.append(bin_edges, max(high[y], bin_edges[-1]))
+        quantiles[y] = np.interp(QUANTILES, cumulative, x)
+        quantiles[y, 0], quantiles[y, -1] = low[y], high[y]
+    return quantiles
@@ -0,0 +1,50 @@
+"""
+gunicorn configuration, see the Procfile.
+
+The app, and with it all data, is loaded once in the master process before the
+workers are forked (preload_app), so that the workers share the memory holding
+the data rather than each loading their own copy. See `read_only` in
+`cola_colab/data.py`.
+"""
+
+import gc
+import os
+
+# with preload_app the app is imported by the master process, before the gevent
+# worker has monkey-patched the standard library, so patch it here first, or
+# e.g. locks and sockets created at import would block the whole worker
+from gevent import monkey
+
+monkey.patch_all()
+
+worker_class = "gevent"
+preload_app = True
+
+
+def when_ready(server):
+    # load the data callbacks read, and fill the figure cache for the default view,
+    # in the master so that workers start with them, set CACHE_WARM=0 to load on
+    # first use
+    if os.environ.get("CACHE_WARM", "1") != "0":
+        from cola_colab.app import warm_up
+
+        warm_up()
+
+
+def pre_fork(server, worker):
+    # move everything loaded so far into a permanent generation the garbage
+    # collector ignores, as collections in the workers would otherwise write to
+    # (and so copy) every page holding a tracked object
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # figures are built in processes forked from each worker, rather than on its
+    # event loop, see cola_colab.app.FIGURE_WORKERS, whose lag is measured
+    from cola_colab.app import figure_cache, start_figure_pool
+    from cola_colab.metrics import monitor_event_loop
+
+    start_figure_pool()
+    monitor_event_loop()
+    # metrics are per worker, so do not count the misses of warming up the cache
+    figure_cache.reset_stats()
@@ -0,0 +1,80 @@
+import threading
+import time
+
+from cola_colab.cache import FigureCache, LRUCache
+
+
+def make_figure(title, job_titles=None):
+    layout = {"title": {"text": title}, "meta": list(job_titles or [])}
+    return {"data": [], "layout": layout}
+
+
+def test_concurrent_misses_build_once():
+    cache = FigureCache(LRUCache(), version="1")
+    release = threading.Event()
+    calls = []
+
+    @cache.memoize()
+    def slow_figure(title):
+        calls.append(title)
+        release.wait(5)
+        return make_figure(title)
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(slow_figure("a")))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    # the first miss builds the figure, the others wait for it
+    deadline = time.monotonic() + 5
+    while cache.coalesced < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert calls == ["a"]
+    assert results == [make_figure("a")] * 4
+    assert cache.stats() == {"hits": 0, "misses": 4, "coalesced": 3}
+    assert slow_figure("a") == make_figure("a")
+    assert cache.hits == 1 and calls == ["a"]
+
+
+def test_changed_version_makes_new_keys():
+    backend = LRUCache()
+    calls = []
+
+    def figure(title):
+        calls.append(title)
+        return make_figure(title)
+
+    old, new = FigureCache(backend, version="1"), FigureCache(backend, version="2")
+    arguments = FigureCache.normalize_arguments(figure, ("a",), {})
+    assert old.make_key(figure, arguments) != new.make_key(figure, arguments)
+
+    old.memoize()(figure)("a")
+    old.memoize()(figure)("a")
+    new.memoize()(figure)("a")
+    assert calls == ["a", "a"]
+
+
+def test_version_is_resolved_once():
+    versions = iter(["1", "2"])
+    cache = FigureCache(LRUCache(), version=lambda: next(versions))
+    assert cache.version == "1"
+    assert cache.version == "1"
+
+
+def test_unordered_arguments_share_key_and_figure():
+    cache = FigureCache(LRUCache(), version="1")
+    calls = []
+
+    @cache.memoize(unordered=("job_titles",))
+    def figure(title, job_titles):
+        calls.append(job_titles)
+        return make_figure(title, job_titles)
+
+    assert figure("a", ["b", "a", "b"]) == figure("a", ("a", "b"))
+    assert calls == [["a", "b"]]
@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cola_colab.stats import (
+    build_salary_stats,
+    combine_salary_stats,
+    merge_salary_stats,
+    nice_bin_edges,
+)
+
+JOB_TITLES = ["Student Assistant", "Postdoc", "Professor"]
+PAY_TYPES = ["Total Pay"]
+
+
+def make_salaries(years=(2017, 2018), seed=0):
+    """
+    Synthetic salaries of job titles of very different scales, with an
+    outlier each year.
+    """
+    rng = np.random.default_rng(seed)
+    parts = []
+    for scale, job_title in zip((5e3, 5e4, 1.5e5), JOB_TITLES):
+        for year in years:
+            pay = rng.lognormal(np.log(scale), 0.4, 2000)
+            pay[0] *= 20
+            parts.append(
+                pd.DataFrame(
+                    {
+                        "Job Title": job_title,
+                        "Year": year,
+                        "Campus": rng.choice(["Berkeley", "Davis"], len(pay)),
+                        "Total Pay": pay,
+                    }
+                )
+            )
+    return pd.concat(parts, ignore_index=True)
+
+
+def test_nice_bin_edges():
+    edges = nice_bin_edges(0, 87654)
+    assert len(edges) == 101
+    assert edges[0] == 0 and edges[-1] >= 87654
+    assert edges[1] - edges[0] == 1000
+
+
+def test_overflow_is_counted_rather_than_clipped():
+    df = make_salaries()
+    stats = combine_salary_stats(
+        build_salary_stats(df, JOB_TITLES, PAY_TYPES), ["Postdoc"], "Total Pay"
+    )
+    values = df.loc[(df["Job Title"] == "Postdoc") & (df["Year"] == 2017)]
+    values = values["Total Pay"].values
+    edges = stats["bin_edges"]
+    assert stats["overflow"][0] == np.count_nonzero(values > edges[-1]) > 0
+    np.testing.assert_array_equal(
+        stats["histograms"][0], np.histogram(values[values <= edges[-1]], edges)[0]
+    )
+
+
+@pytest.mark.parametrize(
+    "job_titles", [["Postdoc"], ["Student Assistant", "Professor"], JOB_TITLES]
+)
+def test_selection_does_not_depend_on_other_job_titles(job_titles):
+    """
+    A selection is drawn the same from the statistics of all job titles as from
+    statistics built from only its salaries, as small selections used to be.
+    """
+    df = make_salaries()
+    stats = combine_salary_stats(
+        build_salary_stats(df, JOB_TITLES, PAY_TYPES), job_titles, "Total Pay"
+    )
+    selected = combine_salary_stats(
+        build_salary_stats(df[df["Job Title"].isin(job_titles)], job_titles, PAY_TYPES),
+        job_titles,
+        "Total Pay",
+    )
+    for key, value in stats.items():
+        np.testing.assert_allclose(value, selected[key], err_msg=key)
+
+
+def test_combined_job_titles_keep_counts_and_quantiles():
+    df = make_salaries()
+    stats = combine_salary_stats(
+        build_salary_stats(df, JOB_TITLES, PAY_TYPES), JOB_TITLES, "Total Pay"
+    )
+    np.testing.assert_array_equal(
+        stats["histograms"].sum(axis=1) + stats["overflow"], [6000, 6000]
+    )
+    width = stats["bin_edges"][1] - stats["bin_edges"][0]
+    for y, year in enumerate((2017, 2018)):
+        exact = np.quantile(df.loc[df["Year"] == year, "Total Pay"], [0.25, 0.5, 0.75])
+        np.testing.assert_allclose(stats["quantiles"][y, 1:4], exact, atol=width)
+
+
+@pytest.mark.parametrize("first_years", [[2017], [2017, 2018]])
+def test_merged_years_match_a_single_build(first_years):
+    """
+    Merging the statistics of 2018, e.g. re-ingested, and with a campus only
+    it has, into those of first_years is the same as building them at once.
+    """
+    df = make_salaries()
+    df.loc[(df["Year"] == 2018) & (df.index % 7 == 0), "Campus"] = "Merced"
+    first = build_salary_stats(df[df["Year"].isin(first_years)], JOB_TITLES, PAY_TYPES)
+    bins = {"bin_edges": first["bin_edges"], "kde_grid": first["kde_grid"]}
+    update = build_salary_stats(df[df["Year"] == 2018], JOB_TITLES, PAY_TYPES, **bins)
+    merged = merge_salary_stats(first, update)
+    single = build_salary_stats(df, JOB_TITLES, PAY_TYPES, **bins)
+
+    assert merged.keys() == single.keys()
+    for key, value in single.items():
+        np.testing.assert_array_equal(merged[key], value, err_msg=key)